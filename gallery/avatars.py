@@ -0,0 +1,129 @@
+"""
+Face avatars packed into sprite atlases
+
+Pages that show many faces reference one atlas image instead of one crop per face. Each face
+is normalized to a square AVATAR_SIZE avatar, and the avatars for a page are packed in
+order into grids of at most COLUMNS columns and MAX_TILES avatars each, so a page with many
+faces has a few atlases. Templates show avatar i of a page with the `avatar` macro in
+templates/avatar.html.
+
+Atlases are made in a thread, since that decodes the originals of faces that are not
+cropped yet, and a page that is being made is only made once however many ask for it.
+
+An atlas is named by a hash of what is in it (each face's image and box), so it never
+changes once written. When the faces on a page change, only that page's atlas is made
+again, the next time the page is shown. At most MAX_ATLASES are kept, the least recently
+used are removed, which invalidates cached pages that may use them.
+"""
+
+from pathlib import Path
+import threading
+import asyncio
+import hashlib
+import math
+import os
+
+from PIL import Image as PilImage
+from PIL import ImageOps
+
+from gallery import model
+from gallery import crops
+from gallery.model import log
+
+AVATAR_SIZE = 160
+
+COLUMNS = 8
+
+# most avatars in one atlas
+MAX_TILES = 64
+
+QUALITY = 85
+
+MAX_ATLASES = 2000
+
+# once there are more than MAX_ATLASES, the least recently used are removed down to this
+# many. Removing any invalidates every cached page, see _prune()
+PRUNE_TO = 1800
+
+# atlas name -> asyncio.Future for atlases being made
+_PENDING = {}
+
+
+def _key(faces: list) -> str:
+    h = hashlib.sha256(f"{AVATAR_SIZE}:{COLUMNS}".encode())
+    for face in faces:
+        box = f"{face.top},{face.right},{face.bottom},{face.left}"
+        h.update(f"|{face.image.image_hash}:{box}".encode())
+    return h.hexdigest()[0:16]
+
+
+def _placeholder() -> PilImage.Image:
+    return PilImage.new("RGB", (AVATAR_SIZE, AVATAR_SIZE), (203, 196, 196))
+
+
+def _avatar(face, crop_path: Path) -> PilImage.Image:
+    if crop_path is None:
+        log(f"face {face.id}: no crop", component="avatars")
+        return _placeholder()
+    try:
+        with PilImage.open(crop_path) as crop:
+            return ImageOps.fit(crop.convert("RGB"), (AVATAR_SIZE, AVATAR_SIZE))
+    except OSError as e:
+        log(f"face {face.id}: unable to read crop: {e}", component="avatars")
+        return _placeholder()
+
+
+def _prune():
+    atlases = sorted(model.AVATARS_DIR.glob("*.jpg"), key=lambda p: p.stat().st_mtime)
+    if len(atlases) <= MAX_ATLASES:
+        return
+    for path in atlases[: len(atlases) - PRUNE_TO]:
+        path.unlink(missing_ok=True)
+    log(f"removed {len(atlases) - PRUNE_TO} atlases", component="avatars")
+    # a cached page, or one a browser revalidates, may use a removed atlas. A new
+    # generation has them made again
+    model.bump_generation()
+
+
+def _build(path: Path, faces: list, columns: int, rows: int):
+    atlas = PilImage.new("RGB", (columns * AVATAR_SIZE, rows * AVATAR_SIZE))
+    for i, (face, crop_path) in enumerate(zip(faces, crops.ensure(faces))):
+        row, column = divmod(i, columns)
+        atlas.paste(_avatar(face, crop_path), (column * AVATAR_SIZE, row * AVATAR_SIZE))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}")
+    atlas.save(tmp, format="JPEG", quality=QUALITY)
+    os.replace(tmp, path)
+    log(f"{path.name}: {len(faces)} faces", component="avatars")
+    _prune()
+
+
+async def _atlas(faces: list) -> dict:
+    columns = min(len(faces), COLUMNS)
+    rows = math.ceil(len(faces) / columns)
+    name = f"{_key(faces)}.jpg"
+    path = model.AVATARS_DIR / name
+    if path.exists():
+        os.utime(path)  # recently used, see _prune()
+    else:
+        future = _PENDING.get(name)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(None, _build, path, faces, columns, rows)
+            _PENDING[name] = future
+            future.add_done_callback(lambda _: _PENDING.pop(name, None))
+        await future
+    return {"src": name, "columns": columns, "rows": rows, "tiles": MAX_TILES}
+
+
+async def atlases(faces: list) -> list:
+    """
+    the atlases of `faces` (Face rows with their Image loaded, in the order they are
+    shown), made if needed
+
+    returns a list of {"src": path under /static/avatar/, "columns": ..., "rows": ...,
+    "tiles": MAX_TILES}, one per MAX_TILES faces
+    """
+    return [
+        await _atlas(faces[i : i + MAX_TILES]) for i in range(0, len(faces), MAX_TILES)
+    ]
@@ -0,0 +1,77 @@
+"""
+Benchmark face detection resolution
+
+For each detection size, detect faces in every image and compare to detection at full
+resolution. Reports recall (the fraction of full-resolution faces also found) and seconds per
+megapixel of original image, including decoding.
+
+    python -m gallery.bench_detection --sizes 0,800,1600,2400 /path/to/images/*
+"""
+
+import time
+
+import click
+
+from gallery import model
+from gallery import config
+
+
+def _detect(path, second_pass: bool):
+    with open(path, "rb") as f:
+        pil_img = model.PilImage.open(f)
+        size = pil_img.size
+    with open(path, "rb") as f:
+        pil_img = model.open_for_detection(f)
+    config.update(detection_second_pass=second_pass)
+    return model.locate_faces(pil_img, size), size
+
+
+def _matched(found: list, reference: list) -> int:
+    """number of reference faces that overlap a found face"""
+    return sum(
+        any(model._overlap(ref, loc) >= 0.5 for loc in found) for ref in reference
+    )
+
+
+@click.command()
+@click.option(
+    "--sizes",
+    default="800,1600,2400",
+    show_default=True,
+    help="Comma-separated detection sizes to try (0: full resolution)",
+)
+@click.option(
+    "--second-pass", is_flag=True, help="Also try each size with a second pass"
+)
+@click.argument("paths", nargs=-1)
+def bench(paths, sizes: str, second_pass: bool):
+    sizes = [int(s) for s in sizes.split(",")]
+
+    # reference detections at full resolution
+    config.update(detection_max_size=0)
+    reference = {}
+    megapixels = 0
+    for path in paths:
+        reference[path], (width, height) = _detect(path, False)
+        megapixels += width * height / 1e6
+    total = sum(len(r) for r in reference.values())
+    print(f"{len(paths)} images, {megapixels:.1f} MP, {total} faces at full resolution")
+
+    runs = [(size, False) for size in sizes]
+    if second_pass:
+        runs += [(size, True) for size in sizes if size]
+    print(f"{'size':>6} {'2nd pass':>8} {'recall':>7} {'s/MP':>7}")
+    for size, sp in runs:
+        config.update(detection_max_size=size)
+        found = 0
+        start = time.time()
+        for path in paths:
+            locations, _ = _detect(path, sp)
+            found += _matched(locations, reference[path])
+        elapsed = time.time() - start
+        recall = found / total if total else 1.0
+        print(f"{size:>6} {str(sp):>8} {recall:>7.3f} {elapsed / megapixels:>7.3f}")
+
+
+if __name__ == "__main__":
+    bench()
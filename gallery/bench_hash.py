@@ -0,0 +1,93 @@
+"""
+Benchmark pixel hashing
+
+Hashes synthetic RGB images of each size (and any images given as paths) with the current
+utils.hash_image_data and with the version 1 list-based hash, checks that the digests match,
+and reports seconds, MB/s, and peak Python memory for each.
+
+    python -m gallery.bench_hash --megapixels 1,12,24 /path/to/images/*
+"""
+
+import hashlib
+import tracemalloc
+import time
+
+import click
+import numpy as np
+from PIL import Image as PilImage
+
+from gallery import utils
+
+
+def hash_image_data_v1(img) -> str:
+    """image hash version 1, see utils.IMAGE_HASH_VERSION"""
+    if len(img.getbands()) == 1:  # getdata() yields values, not tuples
+        pixel_data = list(img.getdata())
+    else:
+        pixel_data = [x for xs in list(img.getdata()) for x in xs]
+    return hashlib.sha256(bytes(pixel_data)).hexdigest()
+
+
+def _measure(fn, img) -> tuple:
+    """returns (digest, seconds, peak MB of Python allocations)"""
+    tracemalloc.start()
+    start = time.time()
+    digest = fn(img)
+    elapsed = time.time() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return digest, elapsed, peak / 1e6
+
+
+@click.command()
+@click.option(
+    "--megapixels",
+    default="1,12",
+    show_default=True,
+    help="Comma-separated sizes of synthetic images to hash",
+)
+@click.option(
+    "--v1-max-megapixels",
+    type=float,
+    default=12,
+    show_default=True,
+    help="Skip the version 1 hash above this size, it needs gigabytes of memory",
+)
+@click.argument("paths", nargs=-1)
+def bench(paths, megapixels: str, v1_max_megapixels: float):
+    rng = np.random.default_rng(0)
+    images = []
+    for mp in [float(m) for m in megapixels.split(",")]:
+        width = int((mp * 1e6 * 4 / 3) ** 0.5)
+        height = int(mp * 1e6 / width)
+        pixels = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        images += [(f"{mp:g} MP random", PilImage.fromarray(pixels, "RGB"))]
+    for path in paths:
+        img = PilImage.open(path)
+        img.load()
+        images += [(path, img)]
+
+    print(f"{'image':>24} {'version':>7} {'s':>7} {'MB/s':>7} {'peak MB':>8} match")
+    for name, img in images:
+        mb = len(img.getbands()) * img.width * img.height / 1e6
+        versions = [(utils.IMAGE_HASH_VERSION, utils.hash_image_data)]
+        if img.width * img.height / 1e6 <= v1_max_megapixels:
+            versions += [(1, hash_image_data_v1)]
+
+        digests = []
+        for version, fn in versions:
+            try:
+                digest, elapsed, peak = _measure(fn, img)
+            except Exception as e:
+                print(f"{name[-24:]:>24} {version:>7} failed: {e}")
+                continue
+            digests += [digest]
+            match = all(d == digests[0] for d in digests)
+            print(
+                f"{name[-24:]:>24} {version:>7} {elapsed:>7.3f} "
+                f"{mb / max(elapsed, 1e-9):>7.1f} {peak:>8.1f} {match}"
+            )
+
+
+if __name__ == "__main__":
+    bench()
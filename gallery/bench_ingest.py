@@ -0,0 +1,90 @@
+"""
+Benchmark ingest storage modes
+
+Ingests the same originals into a fresh, temporary gallery once for each storage mode (see
+gallery.storage), and reports seconds, MB copied into the cache, MB added without copying,
+and the disk space taken by the cache's copies of the originals. Reflinked copies share
+their blocks with the originals, but are counted in full because that sharing is not visible
+to stat.
+
+    python -m gallery.bench_ingest --modes copy,hardlink,reference /path/to/images/*
+"""
+
+from pathlib import Path
+import subprocess
+import tempfile
+import json
+import sys
+import os
+
+import click
+
+# runs in a child process, since the cache directory is fixed when gallery.model is imported
+_CHILD = """
+import json, sys, time
+from gallery import config
+config.update(storage_mode=sys.argv[1])
+from gallery import model, ingest
+model.init()
+final = {}
+start = time.time()
+ingest.ingest(
+    sys.argv[3:],
+    processes=int(sys.argv[2]),
+    progress=lambda stats, total: final.update(stats),
+)
+model.get_writer().flush()
+final["elapsed"] = time.time() - start
+print("RESULT", json.dumps(final))
+"""
+
+
+def _disk_usage(path: Path, originals: list) -> int:
+    """bytes allocated to files under `path` that are not links to `originals`"""
+    seen = {(st.st_dev, st.st_ino) for st in map(os.stat, originals)}
+    total = 0
+    for d, _, files in os.walk(path):
+        for f in files:
+            st = os.lstat(os.path.join(d, f))
+            if (st.st_dev, st.st_ino) not in seen:
+                seen.add((st.st_dev, st.st_ino))
+                total += st.st_blocks * 512
+    return total
+
+
+@click.command()
+@click.option(
+    "--modes",
+    default="copy,hardlink,reflink,reference",
+    show_default=True,
+    help="Comma-separated storage modes to compare",
+)
+@click.option("--processes", default=1, show_default=True, help="Worker processes")
+@click.argument("paths", nargs=-1, required=True)
+def bench(paths, modes: str, processes: int):
+    paths = [str(Path(p).resolve()) for p in paths]
+    print(f"{'mode':>10} {'s':>7} {'copied MB':>10} {'linked MB':>10} {'images MB':>9}")
+    for mode in modes.split(","):
+        # a temporary directory beside the first path, so it is on the same filesystem
+        with tempfile.TemporaryDirectory(dir=Path(paths[0]).parent) as d:
+            (Path(d) / ".gallery").mkdir()
+            child = subprocess.run(
+                [sys.executable, "-c", _CHILD, mode, str(processes), *paths],
+                cwd=d,
+                capture_output=True,
+                text=True,
+            )
+            if child.returncode != 0:
+                print(f"{mode:>10} failed: {child.stderr.strip()[-200:]}")
+                continue
+            result = [l for l in child.stdout.splitlines() if l.startswith("RESULT ")]
+            stats = json.loads(result[-1][len("RESULT ") :])
+            images = _disk_usage(Path(d) / ".gallery" / "images", paths)
+            print(
+                f"{mode:>10} {stats['elapsed']:>7.2f} {stats['stored_bytes'] / 1e6:>10.1f} "
+                f"{stats['saved_bytes'] / 1e6:>10.1f} {images / 1e6:>9.1f}"
+            )
+
+
+if __name__ == "__main__":
+    bench()
@@ -0,0 +1,84 @@
+"""
+Benchmark queries per gallery page
+
+Counts the SQL statements run to list a page of images with their titles, the way /gallery
+does, using the titles stored in Image.display_title and, for comparison, resolving each
+title on its own as the version 1 get_image_title did. Run it in a directory with a gallery.
+
+    python -m gallery.bench_titles --limits 24,100,400
+"""
+
+import time
+
+import click
+from sqlalchemy.orm import Session
+from sqlalchemy import select, desc, event
+
+from gallery import model
+from gallery.model import Image, Person
+
+
+def get_image_title_v1(session: Session, image_id: int) -> str:
+    """get_image_title before titles were stored, for comparison"""
+    image = session.scalars(select(Image).where(Image.id == image_id)).one()
+    if image.title != "" and image.title is not None:
+        return image.title
+    people_ids = list(
+        set(face.person_id for face in image.faces if face.person_id is not None)
+    )
+    if len(people_ids) == 1:
+        person = session.scalars(select(Person).where(Person.id == people_ids[0])).one()
+        if person.name:
+            return person.name
+    return image.original_name
+
+
+def _page(limit: int, titles) -> tuple:
+    """(statements, seconds, titles) to list the newest `limit` images"""
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = model.get_engine()
+    event.listen(engine, "before_cursor_execute", count)
+    start = time.time()
+    try:
+        with Session(engine) as session:
+            images = session.scalars(
+                select(Image).order_by(desc(Image.created_at)).limit(limit)
+            ).all()
+            result = titles(session, images)
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+    return len(statements), time.time() - start, result
+
+
+@click.command()
+@click.option(
+    "--limits",
+    default="24,100",
+    show_default=True,
+    help="Comma-separated numbers of images per page",
+)
+def bench(limits: str):
+    model.init()
+
+    versions = [
+        ("v1", lambda s, images: [get_image_title_v1(s, i.id) for i in images]),
+        ("stored", model.get_image_titles),
+    ]
+    print(f"{'images':>7} {'titles':>7} {'queries':>8} {'ms':>8} match")
+    for limit in [int(l) for l in limits.split(",")]:
+        expected = None
+        for name, titles in versions:
+            queries, seconds, result = _page(limit, titles)
+            expected = expected or result
+            print(
+                f"{len(result):>7} {name:>7} {queries:>8} {seconds * 1000:>8.1f} "
+                f"{result == expected}"
+            )
+
+
+if __name__ == "__main__":
+    bench()
@@ -1,5 +1,3 @@
-import multiprocessing
-
 from sqlalchemy.orm import Session
 from sqlalchemy import select
 
@@ -7,31 +5,85 @@ import click
 
 from gallery import model
 from gallery import config
+from gallery import ingest
+from gallery import workers
 
 
 @click.command()
 @click.option("--cache-dir", help="Gallery cache directory")
+@click.option(
+    "--processes",
+    default=model.CPUS,
+    show_default=True,
+    help="Decode/detect/encode worker processes",
+)
+@click.option(
+    "--detection-max-size",
+    type=int,
+    help="Detect faces at most this many pixels on the long side (0: full resolution)",
+)
+@click.option(
+    "--second-pass/--no-second-pass",
+    default=None,
+    help="Search around detected faces again at higher resolution",
+)
+@click.option(
+    "--tile-size",
+    type=int,
+    help="Detect faces in overlapping tiles of this size in images larger than it (0: never)",
+)
+@click.option("--tile-workers", type=int, help="Threads per image for tiled detection")
+@click.option(
+    "--near-duplicates",
+    type=click.Choice(["keep", "link", "skip"]),
+    help="What to do with near-duplicates of images already in the gallery",
+)
+@click.option(
+    "--storage",
+    type=click.Choice(["copy", "hardlink", "reflink", "reference"]),
+    help="How originals are stored in the cache directory",
+)
 @click.argument("paths", nargs=-1)
-def add_images(paths, cache_dir: str = None):
+def add_images(
+    paths,
+    cache_dir: str = None,
+    processes: int = model.CPUS,
+    detection_max_size: int = None,
+    second_pass: bool = None,
+    tile_size: int = None,
+    tile_workers: int = None,
+    near_duplicates: str = None,
+    storage: str = None,
+):
 
     if cache_dir:
         config.update(cache_dir=cache_dir)
+    config.update(
+        detection_max_size=detection_max_size,
+        detection_second_pass=second_pass,
+        detection_tile_size=tile_size,
+        detection_tile_workers=tile_workers,
+        near_duplicate_policy=near_duplicates,
+        storage_mode=storage,
+    )
 
     model.init()
 
-    with multiprocessing.Pool(model.CPUS) as p:
-        p.map(model.add_original, paths)
+    ingest.ingest(paths, processes=processes)
 
     model.incremental_index()
 
-    # try to detect faces in all images
-    # add_original won't do it if the image has already been added
+    # ingest skips files that are already in the catalog, so pick up
+    # any images whose face detection never completed
     with Session(model.get_engine()) as session:
-        images = session.scalars(select(model.Image)).all()
-        with multiprocessing.Pool(model.CPUS) as p:
-            p.starmap(model.detect_face, [(image.id,) for image in images])
+        image_ids = session.scalars(
+            select(model.Image.id).where(model.Image.face_detection_complete == False)
+        ).all()
+    if image_ids:
+        with workers.new_pool(processes) as p:
+            p.map(model.detect_face, image_ids)
 
-    model.generate_embeddings()
+    model.generate_embeddings(processes=processes)
 
     model.update_labels()
 
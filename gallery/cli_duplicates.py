@@ -0,0 +1,43 @@
+import click
+
+from gallery import model
+from gallery import config
+from gallery import duplicates
+
+
+@click.command()
+@click.option("--cache-dir", help="Gallery cache directory")
+@click.option(
+    "--processes",
+    type=int,
+    default=model.CPUS,
+    show_default=True,
+    help="Hashing worker processes",
+)
+@click.option(
+    "--distance",
+    type=int,
+    default=config.NEAR_DUPLICATE_DISTANCE,
+    show_default=True,
+    help="Most differing perceptual hash bits for images to be near-duplicates",
+)
+@click.option(
+    "--rehash",
+    is_flag=True,
+    help="Hash every image again, e.g. images hashed by an earlier version of this command",
+)
+def find_duplicates(
+    cache_dir: str = None, processes: int = None, distance: int = None, rehash=False
+):
+    """Hash images added before perceptual hashing, and record their near-duplicates"""
+
+    if cache_dir:
+        config.update(cache_dir=cache_dir)
+
+    model.init()
+
+    duplicates.backfill(processes=processes, max_distance=distance, rehash=rehash)
+
+
+if __name__ == "__main__":
+    find_duplicates()
@@ -0,0 +1,38 @@
+import sys
+
+import click
+
+from gallery import model
+from gallery import config
+
+
+@click.group()
+@click.option("--cache-dir", help="Gallery cache directory")
+def embeddings(cache_dir: str = None):
+    """Maintain the embedding store in the cache directory"""
+    if cache_dir:
+        config.update(cache_dir=cache_dir)
+
+    model.init()
+
+
+@embeddings.command()
+def rebuild():
+    """Rewrite the embedding store from the database"""
+    model.rebuild_embeddings()
+
+
+@embeddings.command()
+@click.option("--fix", is_flag=True, help="Rebuild the store if it does not match")
+def verify(fix: bool):
+    """Check the embedding store against the database"""
+    if model.verify_embeddings():
+        return
+    if fix:
+        model.rebuild_embeddings()
+    else:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    embeddings()
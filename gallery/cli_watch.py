@@ -0,0 +1,70 @@
+import time
+
+import click
+
+from gallery import model
+from gallery import config
+from gallery import watch
+
+
+@click.command()
+@click.option("--cache-dir", help="Gallery cache directory")
+@click.option(
+    "--processes",
+    type=int,
+    default=model.CPUS,
+    show_default=True,
+    help="Decode/detect/encode worker processes",
+)
+@click.option(
+    "--quiet",
+    type=float,
+    default=config.WATCH_QUIET_SECONDS,
+    show_default=True,
+    help="Seconds a file must be unchanged before it is ingested",
+)
+@click.option(
+    "--poll",
+    type=float,
+    default=config.WATCH_POLL_SECONDS,
+    show_default=True,
+    help="Seconds between scans when polling",
+)
+@click.option("--no-inotify", is_flag=True, help="Poll instead of using inotify")
+@click.argument("originals_dir")
+def watch_originals(
+    originals_dir: str,
+    cache_dir: str = None,
+    processes: int = model.CPUS,
+    quiet: float = None,
+    poll: float = None,
+    no_inotify: bool = False,
+):
+    """Ingest new images under ORIGINALS_DIR as they appear"""
+
+    config.update(originals_dir=originals_dir, cache_dir=cache_dir)
+
+    model.init()
+
+    def on_batch(paths):
+        watch.ingest_batch(paths, processes=processes)
+        model.incremental_index()
+        model.assign_faces()
+
+    watcher = watch.Watcher(
+        config.ORIGINALS_DIR,
+        on_batch,
+        quiet=quiet,
+        poll_interval=poll,
+        use_inotify=not no_inotify,
+    )
+    watcher.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        watcher.stop()
+
+
+if __name__ == "__main__":
+    watch_originals()
@@ -6,8 +6,75 @@ from os import getcwd
 ORIGINALS_DIR = None
 CACHE_DIR = Path(getcwd()) / ".gallery"
 
+# faces are detected in a copy of each image reduced to at most this many pixels
+# on the long side (0: full resolution)
+DETECTION_MAX_SIZE = 1600
+# search around detected faces again at higher resolution for small faces
+DETECTION_SECOND_PASS = False
 
-def update(originals_dir=None, cache_dir=None):
+# images larger than this on the long side are searched for faces in overlapping tiles
+# of this size, bounding detector memory (0: never tile)
+DETECTION_TILE_SIZE = 0
+# fraction of each tile that overlaps its neighbor
+DETECTION_TILE_OVERLAP = 0.2
+# threads used to detect faces in the tiles of one image
+DETECTION_TILE_WORKERS = 1
+
+# processes in the server's detection and encoding pool (0: one per spare core)
+WORKER_PROCESSES = 0
+
+# make thumbnails while ingesting, instead of when they are first requested
+THUMBS_AT_INGEST = True
+
+# most megabytes of face crops kept in the cache (see gallery.crops)
+FACE_CACHE_MB = 512
+
+# most megabytes in one upload request
+UPLOAD_MAX_MB = 4096
+
+# follow ORIGINALS_DIR and ingest new originals as they appear
+WATCH = False
+# seconds a new original must be unchanged before it is ingested
+WATCH_QUIET_SECONDS = 2.0
+# seconds between walks of ORIGINALS_DIR when inotify is not available
+WATCH_POLL_SECONDS = 5.0
+
+# how originals are stored in the cache: "copy", "hardlink", "reflink", or "reference" them
+# where they are (see gallery.storage)
+STORAGE_MODE = "copy"
+
+# what ingest does with an image that is a near-duplicate of one already in the gallery:
+# "keep" it, "link" it to the existing image without detecting its faces, or "skip" it
+NEAR_DUPLICATE_POLICY = "keep"
+# most differing bits of two images' perceptual hashes for them to be near-duplicates
+NEAR_DUPLICATE_DISTANCE = 4
+
+# seconds without a labeling trigger before pending faces are labeled
+RECLUSTER_QUIET_SECONDS = 2.0
+# seconds between scheduled full re-clusters, 0 for none
+RECLUSTER_INTERVAL_SECONDS = 0
+
+
+def update(
+    originals_dir=None,
+    cache_dir=None,
+    recluster_quiet=None,
+    recluster_interval=None,
+    detection_max_size=None,
+    detection_second_pass=None,
+    detection_tile_size=None,
+    detection_tile_workers=None,
+    worker_processes=None,
+    watch=None,
+    watch_quiet=None,
+    watch_poll=None,
+    near_duplicate_policy=None,
+    near_duplicate_distance=None,
+    storage_mode=None,
+    thumbs_at_ingest=None,
+    face_cache_mb=None,
+    upload_max_mb=None,
+):
 
     if originals_dir:
         global ORIGINALS_DIR
@@ -26,3 +93,87 @@ def update(originals_dir=None, cache_dir=None):
             print(f"==== provided cache_dir {cache_dir} is not a directory")
             sys.exit(1)
         CACHE_DIR = cache_dir
+
+    if recluster_quiet is not None:
+        global RECLUSTER_QUIET_SECONDS
+        RECLUSTER_QUIET_SECONDS = float(recluster_quiet)
+
+    if recluster_interval is not None:
+        global RECLUSTER_INTERVAL_SECONDS
+        RECLUSTER_INTERVAL_SECONDS = float(recluster_interval)
+
+    if detection_max_size is not None:
+        global DETECTION_MAX_SIZE
+        DETECTION_MAX_SIZE = int(detection_max_size)
+
+    if detection_second_pass is not None:
+        global DETECTION_SECOND_PASS
+        DETECTION_SECOND_PASS = bool(detection_second_pass)
+
+    if detection_tile_size is not None:
+        global DETECTION_TILE_SIZE
+        DETECTION_TILE_SIZE = int(detection_tile_size)
+
+    if detection_tile_workers is not None:
+        global DETECTION_TILE_WORKERS
+        DETECTION_TILE_WORKERS = int(detection_tile_workers)
+
+    if worker_processes is not None:
+        global WORKER_PROCESSES
+        WORKER_PROCESSES = int(worker_processes)
+
+    if watch is not None:
+        global WATCH
+        WATCH = bool(watch)
+
+    if watch_quiet is not None:
+        global WATCH_QUIET_SECONDS
+        WATCH_QUIET_SECONDS = float(watch_quiet)
+
+    if watch_poll is not None:
+        global WATCH_POLL_SECONDS
+        WATCH_POLL_SECONDS = float(watch_poll)
+
+    if near_duplicate_policy is not None:
+        global NEAR_DUPLICATE_POLICY
+        if near_duplicate_policy not in ("keep", "link", "skip"):
+            print(
+                f"==== near_duplicate_policy {near_duplicate_policy} is not keep, link, or skip"
+            )
+            sys.exit(1)
+        NEAR_DUPLICATE_POLICY = near_duplicate_policy
+
+    if near_duplicate_distance is not None:
+        global NEAR_DUPLICATE_DISTANCE
+        NEAR_DUPLICATE_DISTANCE = int(near_duplicate_distance)
+
+    if storage_mode is not None:
+        global STORAGE_MODE
+        if storage_mode not in ("copy", "hardlink", "reflink", "reference"):
+            print(
+                f"==== storage_mode {storage_mode} is not copy, hardlink, reflink, or reference"
+            )
+            sys.exit(1)
+        STORAGE_MODE = storage_mode
+
+    if thumbs_at_ingest is not None:
+        global THUMBS_AT_INGEST
+        THUMBS_AT_INGEST = thumbs_at_ingest
+
+    if face_cache_mb is not None:
+        global FACE_CACHE_MB
+        FACE_CACHE_MB = float(face_cache_mb)
+
+    if upload_max_mb is not None:
+        global UPLOAD_MAX_MB
+        UPLOAD_MAX_MB = float(upload_max_mb)
+
+
+def settings() -> dict:
+    """the current settings, for processes that do not inherit them (see gallery.workers)"""
+    return {name: value for name, value in globals().items() if name.isupper()}
+
+
+def apply(values: dict):
+    """use settings from settings()"""
+    globals().update(values)
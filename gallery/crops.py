@@ -0,0 +1,210 @@
+"""
+Face crops, made on request from the boxes stored in the catalog
+
+Ingest does not save a crop for each face. The first time a face is shown, its crop is cut
+out of the original (decoded at reduced size where the format allows, see CROP_SIZE) and
+kept under FACES_DIR, named by image hash and box (see model.face_crop_name).
+
+FACES_DIR is a cache: once it holds more than config.FACE_CACHE_MB, the least recently used
+crops are removed. Crops of named people are made ahead of time by prewarm(), since those
+are the faces that are shown most.
+"""
+
+from collections import OrderedDict
+from pathlib import Path
+import threading
+import os
+
+from PIL import Image as PilImage
+
+from sqlalchemy.orm import Session
+from sqlalchemy import select
+
+from gallery import model
+from gallery import config
+from gallery.model import Face, Person, log
+
+# longest side of a crop, in pixels
+CROP_SIZE = 300
+
+QUALITY = 90
+
+# faces of each named person that prewarm() crops
+PREWARM_FACES = 24
+
+
+class CropCache:
+    """sizes of the files under a directory, least recently used first"""
+
+    def __init__(self, root: Path):
+        self.root = root
+        self._entries = None  # name -> bytes
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _load(self):
+        """find what is already cached, in order of last use (mtime)"""
+        found = []
+        for path in self.root.glob("*/*"):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            found += [(st.st_mtime, str(path.relative_to(self.root)), st.st_size)]
+        self._entries = OrderedDict((name, size) for _, name, size in sorted(found))
+        self._bytes = sum(self._entries.values())
+        log(
+            f"{len(self._entries)} crops, {self._bytes / 1e6:.1f} MB cached",
+            component="crops",
+        )
+
+    def get(self, name: str) -> Path:
+        """the cached file, or None"""
+        path = self.root / name
+        try:
+            os.utime(path)  # recently used, so it survives after a restart
+        except FileNotFoundError:
+            with self._lock:
+                if self._entries is not None and name in self._entries:
+                    self._bytes -= self._entries.pop(name)
+            return None
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            if name in self._entries:
+                self._entries.move_to_end(name)
+            else:  # made by another process
+                self._entries[name] = path.stat().st_size
+                self._bytes += self._entries[name]
+        return path
+
+    def put(self, name: str, img) -> Path:
+        """cache `img` as `name`, then evict until within config.FACE_CACHE_MB"""
+        path = self.root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}")
+        img.save(tmp, format="JPEG", quality=QUALITY)
+        os.replace(tmp, path)
+        size = path.stat().st_size
+
+        evicted = []
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            self._bytes += size - self._entries.pop(name, 0)
+            self._entries[name] = size
+            while self._bytes > config.FACE_CACHE_MB * 1e6 and len(self._entries) > 1:
+                old, old_size = self._entries.popitem(last=False)
+                self._bytes -= old_size
+                evicted += [old]
+        for old in evicted:
+            (self.root / old).unlink(missing_ok=True)
+        return path
+
+    def remove(self, name: str):
+        with self._lock:
+            if self._entries is not None and name in self._entries:
+                self._bytes -= self._entries.pop(name)
+        (self.root / name).unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            return {"crops": len(self._entries), "bytes": self._bytes}
+
+
+CACHE = CropCache(model.FACES_DIR)
+
+
+def _name(face: Face) -> str:
+    return str(
+        model.face_crop_name(
+            face.image.image_hash, (face.top, face.right, face.bottom, face.left)
+        )
+    )
+
+
+def _render(image, faces: list):
+    """decode `image` once and cache the crops of `faces`, which are all in it"""
+    with PilImage.open(model.IMAGES_DIR / image.file_name) as pil_img:
+        width, height = pil_img.size
+        # decode at reduced size if even the smallest face stays larger than CROP_SIZE
+        smallest = min(min(f.right - f.left, f.bottom - f.top) for f in faces)
+        scale = max(1, smallest / CROP_SIZE)
+        pil_img.draft("RGB", (int(width / scale) + 1, int(height / scale) + 1))
+        sx, sy = pil_img.width / width, pil_img.height / height
+        pil_img = pil_img.convert("RGB")
+
+        for face in faces:
+            crop = pil_img.crop(
+                (
+                    round(face.left * sx),
+                    round(face.top * sy),
+                    round(face.right * sx),
+                    round(face.bottom * sy),
+                )
+            )
+            crop.thumbnail((CROP_SIZE, CROP_SIZE))
+            CACHE.put(_name(face), crop)
+
+
+def ensure(faces: list) -> list:
+    """the path of each of `faces`' crop, made if needed. None where it could not be"""
+    paths = {}
+    missing = {}  # image id -> faces
+    for face in faces:
+        path = CACHE.get(_name(face))
+        if path is None:
+            missing.setdefault(face.image_id, []).append(face)
+        paths[face.id] = path
+
+    for image_faces in missing.values():
+        image = image_faces[0].image
+        try:
+            _render(image, image_faces)
+        except OSError as e:
+            log(f"image {image.id}: unable to crop faces: {e}", component="crops")
+            continue
+        for face in image_faces:
+            paths[face.id] = CACHE.root / _name(face)
+    return [paths[face.id] for face in faces]
+
+
+def face_crop_name(face_id: int) -> str:
+    """the name of a face's crop, whether or not it is cached. None if there is no such face"""
+    with Session(model.get_engine()) as session:
+        face = session.get(Face, face_id)
+        return None if face is None else _name(face)
+
+
+def face_crop(face_id: int) -> Path:
+    """the path of a face's crop, made if needed. None if there is no such face"""
+    with Session(model.get_engine()) as session:
+        face = session.get(Face, face_id)
+        if face is None:
+            return None
+        return ensure([face])[0]
+
+
+def remove(face: Face):
+    """remove a face's crop, including one saved at ingest by earlier versions"""
+    CACHE.remove(_name(face))
+    if face.extracted_path:
+        CACHE.remove(face.extracted_path)
+
+
+def prewarm(per_person: int = PREWARM_FACES):
+    """make the crops of the first `per_person` visible faces of every named person"""
+    made = 0
+    with Session(model.get_engine()) as session:
+        people = session.scalars(
+            select(Person).where(Person.name != None).where(Person.name != "")
+        ).all()
+        for person in people:
+            faces = [face for face in person.faces if face.hidden == 0][:per_person]
+            missing = [face for face in faces if CACHE.get(_name(face)) is None]
+            ensure(missing)
+            made += len(missing)
+    log(f"prewarmed {made} crops of {len(people)} named people", component="crops")
+    return made
@@ -0,0 +1,198 @@
+"""
+Near-duplicate images by perceptual hash
+
+Every image stores a 64-bit difference hash (utils.dhash). Images whose hashes differ in at
+most config.NEAR_DUPLICATE_DISTANCE bits are near-duplicates: resized, re-encoded or lightly
+edited copies of each other.
+
+Hashes are kept in a BK-tree, which only visits subtrees whose distance from the query could
+be within range, so a lookup touches a small fraction of the library rather than every image.
+
+What ingest does with a near-duplicate depends on config.NEAR_DUPLICATE_POLICY:
+* "keep": add it, and record which image it duplicates (Image.duplicate_of)
+* "link": add it and record duplicate_of, but don't detect its faces, so it doesn't add
+  another copy of the same faces to clustering
+* "skip": don't add it
+"""
+
+import threading
+
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy import select, update
+from PIL import Image as PilImage
+
+from gallery import model
+from gallery import utils
+from gallery import config
+from gallery import workers
+from gallery.model import Image, log
+
+POLICIES = ("keep", "link", "skip")
+
+
+def distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """a BK-tree of (64-bit hash, value) under Hamming distance"""
+
+    def __init__(self):
+        self._root = None  # [hash, [values], {distance: child}]
+        self.size = 0
+
+    def add(self, h: int, value):
+        self.size += 1
+        if self._root is None:
+            self._root = [h, [value], {}]
+            return
+        node = self._root
+        while True:
+            d = distance(h, node[0])
+            if d == 0:
+                node[1].append(value)
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [h, [value], {}]
+                return
+            node = child
+
+    def search(self, h: int, max_distance: int) -> list:
+        """(distance, value) for each value within `max_distance` of `h`, nearest first"""
+        found = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            d = distance(h, node[0])
+            if d <= max_distance:
+                found += [(d, value) for value in node[1]]
+            # by the triangle inequality, matches can only be in these children
+            for child_d, child in node[2].items():
+                if d - max_distance <= child_d <= d + max_distance:
+                    stack.append(child)
+        return sorted(found, key=lambda x: x[0])
+
+
+class NearDuplicateIndex:
+    """
+    image hashes of the catalog's images by their dhash
+
+    refresh() picks up images added since the last refresh, by any process. images that were
+    deleted stay in the tree, so callers check that matches still exist
+    """
+
+    def __init__(self):
+        self.tree = BKTree()
+        self.last_id = 0
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        with self.lock, Session(model.get_engine()) as session:
+            rows = session.execute(
+                select(Image.id, Image.image_hash, Image.dhash)
+                .where(Image.id > self.last_id)
+                .order_by(Image.id)
+            ).all()
+            for id, image_hash, dhash in rows:
+                if dhash is not None:
+                    self.tree.add(int(dhash, 16), image_hash)
+                self.last_id = id
+
+    def add(self, dhash: str, image_hash: str):
+        """add an image that is about to be committed"""
+        with self.lock:
+            self.tree.add(int(dhash, 16), image_hash)
+
+    def search(self, dhash: str, max_distance: int) -> list:
+        """(distance, image hash) of near-duplicates of `dhash`, nearest first"""
+        with self.lock:
+            return self.tree.search(int(dhash, 16), max_distance)
+
+
+INDEX = None
+
+
+def get_index() -> NearDuplicateIndex:
+    """the index for this process, brought up to date with the catalog"""
+    global INDEX
+    if INDEX is None:
+        INDEX = NearDuplicateIndex()
+    INDEX.refresh()
+    return INDEX
+
+
+def pairs(session: Session, limit: int, offset: int) -> list:
+    """(image, image it duplicates) for recorded near-duplicates, newest first"""
+    original = aliased(Image)
+    return session.execute(
+        select(Image, original)
+        .join(original, Image.duplicate_of == original.id)
+        .order_by(Image.id.desc())
+        .offset(offset)
+        .limit(limit)
+    ).all()
+
+
+def _image_dhash(item: tuple) -> tuple:
+    id, file_name = item
+    try:
+        # decoded in full, as at ingest, since a reduced JPEG decode hashes differently
+        with PilImage.open(model.IMAGES_DIR / file_name) as pil_img:
+            return id, utils.dhash(pil_img)
+    except Exception as e:
+        log(f"{file_name}: unable to hash: {e}", component="duplicates")
+        return id, None
+
+
+def backfill(
+    processes: int = model.CPUS, max_distance: int = None, rehash: bool = False
+) -> int:
+    """
+    compute missing dhashes, then record near-duplicates among images that have none
+    recorded, each pointing at the oldest image it duplicates
+
+    `rehash`: compute every dhash again, not only missing ones. Earlier versions hashed a
+    reduced decode here, which does not always match the hash computed at ingest
+
+    returns the number of near-duplicates recorded
+    """
+    if max_distance is None:
+        max_distance = config.NEAR_DUPLICATE_DISTANCE
+
+    with Session(model.get_engine()) as session:
+        query = select(Image.id, Image.file_name)
+        if not rehash:
+            query = query.where(Image.dhash == None)
+        missing = session.execute(query).all()
+    if missing:
+        log(f"hash {len(missing)} images", component="duplicates")
+        with workers.new_pool(processes) as pool:
+            hashes = pool.map(_image_dhash, missing, chunksize=16)
+        rows = [{"id": id, "dhash": dhash} for id, dhash in hashes if dhash]
+        if rows:
+            model.get_writer().call(
+                lambda session: session.execute(update(Image), rows)
+            )
+
+    with Session(model.get_engine()) as session:
+        images = session.execute(
+            select(Image.id, Image.dhash, Image.duplicate_of)
+            .where(Image.dhash != None)
+            .order_by(Image.id)
+        ).all()
+
+    tree = BKTree()
+    found = []
+    for id, dhash, duplicate_of in images:
+        h = int(dhash, 16)
+        if duplicate_of is None:
+            matches = tree.search(h, max_distance)
+            if matches:
+                found += [{"id": id, "duplicate_of": min(m for _, m in matches)}]
+        tree.add(h, id)
+
+    if found:
+        model.get_writer().call(lambda session: session.execute(update(Image), found))
+    log(f"recorded {len(found)} near-duplicates", component="duplicates")
+    return len(found)
@@ -0,0 +1,114 @@
+"""
+Append-only, memory-mapped store of face embeddings
+
+Faces.embedding_bytes remains the source of truth. This store keeps a copy of every embedding
+as one row of a float32 matrix file, with the face id of each row in a parallel int64 file, so
+the whole library can be read as a single (N, 128) array without loading any Face rows.
+
+Rows are only ever appended. If a face's embedding is written twice, the last row wins.
+Rows for faces that were since deleted stay in the file until the next rebuild; callers are
+expected to select the face ids they want (see model.all_embeddings).
+"""
+
+from pathlib import Path
+from contextlib import contextmanager
+import fcntl
+import os
+
+import numpy as np
+import numpy.typing as npt
+
+DIM = 128
+
+
+class EmbeddingStore:
+    def __init__(self, directory: Path, dim: int = DIM):
+        self.directory = Path(directory)
+        self.dim = dim
+        self.vectors_path = self.directory / "embeddings.f32"
+        self.ids_path = self.directory / "embedding_ids.i64"
+        self.lock_path = self.directory / "embeddings.lock"
+
+    @contextmanager
+    def _locked(self):
+        """exclusive lock, so appends from several processes don't interleave"""
+        self.directory.mkdir(exist_ok=True, parents=True)
+        with open(self.lock_path, "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def __len__(self) -> int:
+        """number of complete rows (present in both files)"""
+        try:
+            n_ids = self.ids_path.stat().st_size // 8
+            n_vectors = self.vectors_path.stat().st_size // (4 * self.dim)
+        except FileNotFoundError:
+            return 0
+        return min(n_ids, n_vectors)
+
+    def append(self, face_ids, vectors) -> None:
+        """append one row for each face id. vectors may be any float dtype"""
+        ids = np.asarray(face_ids, dtype=np.int64).reshape(-1)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        if len(ids) != len(vectors):
+            raise ValueError(f"{len(ids)} face ids for {len(vectors)} embeddings")
+        if not len(ids):
+            return
+
+        with self._locked():
+            # drop any partially-written row left by a crash
+            n = len(self)
+            with open(self.vectors_path, "ab") as f:
+                f.truncate(n * 4 * self.dim)
+                f.write(vectors.tobytes())
+            with open(self.ids_path, "ab") as f:
+                f.truncate(n * 8)
+                f.write(ids.tobytes())
+
+    def load(self) -> tuple[npt.NDArray[np.float32], npt.NDArray[np.int64]]:
+        """
+        returns (vectors, face_ids), with vectors of shape (N, dim)
+
+        both are read-only memory maps of the store files unless a face appears more than once,
+        in which case only the latest row for each face is returned (as a copy)
+        """
+        n = len(self)
+        if n == 0:
+            return np.empty((0, self.dim), dtype=np.float32), np.empty(
+                (0,), dtype=np.int64
+            )
+
+        vectors = np.memmap(
+            self.vectors_path, dtype=np.float32, mode="r", shape=(n, self.dim)
+        )
+        ids = np.memmap(self.ids_path, dtype=np.int64, mode="r", shape=(n,))
+
+        unique_ids, last = np.unique(ids[::-1], return_index=True)
+        if len(unique_ids) != n:
+            keep = np.sort(n - 1 - last)
+            return vectors[keep], ids[keep]
+        return vectors, ids
+
+    def rebuild(self, rows) -> int:
+        """
+        replace the store contents with `rows`, an iterable of (face_id, vector)
+
+        returns the number of rows written
+        """
+        self.directory.mkdir(exist_ok=True, parents=True)
+        vectors_tmp = self.vectors_path.with_suffix(".f32.tmp")
+        ids_tmp = self.ids_path.with_suffix(".i64.tmp")
+
+        n = 0
+        with self._locked():
+            with open(vectors_tmp, "wb") as vf, open(ids_tmp, "wb") as idf:
+                for face_id, vector in rows:
+                    vf.write(np.asarray(vector, dtype=np.float32).tobytes())
+                    idf.write(np.int64(face_id).tobytes())
+                    n += 1
+            os.replace(vectors_tmp, self.vectors_path)
+            os.replace(ids_tmp, self.ids_path)
+        return n
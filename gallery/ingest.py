@@ -0,0 +1,527 @@
+"""
+Staged ingest pipeline for originals
+
+    read/hash -> decode -> detect -> encode -> thumbnail -> commit
+
+* read/hash: a few threads read each file and hash its bytes. Files whose hash is already
+  in the catalog are dropped here, before any decoding happens.
+* decode, detect, encode, thumbnail: a process pool decodes each image exactly once, hashes
+  the pixels, finds faces, computes embeddings for all visible faces with one
+  face_encodings call, and makes thumbnails (see gallery.thumbs). Face crops are not saved,
+  they are made from the stored boxes when first shown (see gallery.crops).
+* commit: new originals are stored in IMAGES_DIR (see gallery.storage) and their Image and
+  Face rows are handed to the catalog writer (see gallery.writer), which commits them in
+  batches.
+
+Stages are connected by bounded queues, so memory use does not grow with the number of paths,
+and all stages overlap.
+"""
+
+from pathlib import Path
+from io import BytesIO
+from concurrent.futures import Future
+from functools import partial
+import multiprocessing
+import multiprocessing.pool
+import threading
+import queue
+import shutil
+import json
+import time
+
+from sqlalchemy.orm import Session
+from sqlalchemy import select
+
+import face_recognition
+import numpy as np
+from PIL import Image as PilImage
+
+from gallery import model
+from gallery import utils
+from gallery import config
+from gallery import storage
+from gallery import thumbs
+from gallery import workers
+from gallery import duplicates as near_duplicates
+from gallery.model import Image, Face, log
+from gallery.writer import after_commit
+
+# marks the end of a stage's output
+_DONE = None
+
+
+class IngestStats:
+    """counts and cumulative seconds for each stage"""
+
+    STAGES = ("read", "decode", "detect", "encode", "thumbnail", "commit")
+
+    def __init__(self):
+        self.start = time.time()
+        self.seconds = {stage: 0.0 for stage in self.STAGES}
+        self.files = 0
+        self.bytes = 0
+        self.known_files = 0
+        self.known_images = 0
+        self.near_duplicates = 0
+        self.stored_bytes = 0  # copied into IMAGES_DIR
+        self.saved_bytes = 0  # added to IMAGES_DIR without copying
+        self.failed = 0
+        self.added = 0
+        self.faces = 0
+
+    def as_dict(self) -> dict:
+        elapsed = max(time.time() - self.start, 1e-9)
+        return {
+            "files": self.files,
+            "bytes": self.bytes,
+            "added": self.added,
+            "known_files": self.known_files,
+            "known_images": self.known_images,
+            "near_duplicates": self.near_duplicates,
+            "stored_bytes": self.stored_bytes,
+            "saved_bytes": self.saved_bytes,
+            "failed": self.failed,
+            "faces": self.faces,
+            "seconds": dict(self.seconds),
+            "elapsed": elapsed,
+            "files_per_second": self.files / elapsed,
+        }
+
+    def report(self):
+        elapsed = max(time.time() - self.start, 1e-9)
+        log(
+            f"{self.files} files ({self.bytes / 1e6:.1f} MB) in {elapsed:.2f}s: "
+            f"{self.added} added, {self.known_files} known files, "
+            f"{self.known_images} known images, {self.near_duplicates} near-duplicates, "
+            f"{self.failed} failed, {self.faces} faces "
+            f"({self.files / elapsed:.1f} files/s)",
+            component="ingest",
+        )
+        log(
+            f"{self.stored_bytes / 1e6:.1f} MB copied into the cache, "
+            f"{self.saved_bytes / 1e6:.1f} MB added without copying",
+            component="ingest",
+        )
+        for stage in self.STAGES:
+            log(f"{stage}: {self.seconds[stage]:.2f}s", component="ingest")
+
+
+def decode_detect_encode(image_path: str, file_data: bytes, file_hash: str) -> dict:
+    """
+    decode the image once, then find and embed its faces
+
+    runs in a worker process. returns a dict describing the image and its faces,
+    or a dict with an "error" key if the image could not be processed
+    """
+
+    image_path = Path(image_path)
+    seconds = {}
+
+    try:
+        start = time.time()
+        with BytesIO(file_data) as f:
+            pil_img = PilImage.open(f)
+            pil_img.load()
+        img_hash = utils.hash_image_data(pil_img)
+        dhash = utils.dhash(pil_img)
+        fr_img = np.array(pil_img.convert("RGB"))
+        seconds["decode"] = time.time() - start
+
+        start = time.time()
+        locations = model.locate_faces(pil_img)
+        faces = []
+        for location in locations:  # (t, r, b, l)
+            hidden = model.face_is_small(location, pil_img.width, pil_img.height)
+            extracted_path = model.face_crop_name(img_hash, location)
+            faces += [
+                {
+                    "location": location,
+                    "hidden": hidden,
+                    "hidden_reason": model.HIDDEN_REASON_SMALL if hidden else None,
+                    "extracted_path": str(extracted_path),
+                    "embedding_bytes": None,
+                }
+            ]
+        seconds["detect"] = time.time() - start
+
+        # one face_encodings call for all the visible faces in the image
+        start = time.time()
+        visible = [face for face in faces if not face["hidden"]]
+        if visible:
+            encodings = face_recognition.face_encodings(
+                fr_img, known_face_locations=[face["location"] for face in visible]
+            )
+            for face, encoding in zip(visible, encodings):
+                face["embedding_bytes"] = encoding.tobytes()
+        seconds["encode"] = time.time() - start
+
+        start = time.time()
+        if config.THUMBS_AT_INGEST:
+            thumbs.render(pil_img, img_hash)
+        seconds["thumbnail"] = time.time() - start
+
+        return {
+            "path": str(image_path),
+            "file_hash": file_hash,
+            "image_hash": img_hash,
+            "dhash": dhash,
+            "width": pil_img.width,
+            "height": pil_img.height,
+            "comment": model.image_comment(pil_img),
+            "faces": faces,
+            "seconds": seconds,
+        }
+    except Exception as e:
+        return {"path": str(image_path), "error": f"{e}", "seconds": seconds}
+
+
+def _read_stage(paths, read_q, known_files, duplicates, file_hashes, stats, lock):
+    """
+    read and hash files from `paths`, forwarding unknown files to `read_q`
+
+    paths of known files are recorded in `duplicates` along with their file hash,
+    and the file hash of every path read is recorded in `file_hashes`. Paths that are
+    already in `file_hashes` are not hashed again
+    """
+
+    while True:
+        try:
+            image_path = paths.get_nowait()
+        except queue.Empty:
+            break
+
+        start = time.time()
+        try:
+            with open(image_path, "rb") as f:
+                file_data = f.read()
+        except OSError as e:
+            log(f"{image_path}: unable to read: {e}", component="ingest")
+            with lock:
+                stats.failed += 1
+            continue
+        with lock:
+            file_hash = file_hashes.get(str(image_path))
+        if file_hash is None:
+            with BytesIO(file_data) as f:
+                file_hash = utils.hash_file_data(f)
+        elapsed = time.time() - start
+
+        with lock:
+            stats.files += 1
+            stats.bytes += len(file_data)
+            stats.seconds["read"] += elapsed
+            file_hashes[str(image_path)] = file_hash
+            known = file_hash in known_files
+            if known:
+                stats.known_files += 1
+                duplicates[str(image_path)] = file_hash
+            else:
+                # in flight, so the same file appearing twice in `paths` is only processed once
+                known_files[file_hash] = None
+
+        if known:
+            log(f"{image_path} file already present", component="ingest")
+        else:
+            read_q.put((str(image_path), file_data, file_hash))
+
+    read_q.put(_DONE)
+
+
+def _dispatch_stage(pool, read_q, done_q, slots, readers):
+    """submit work from `read_q` to `pool`, with at most `slots` images in flight"""
+
+    submitted = 0
+    finished_readers = 0
+    while finished_readers < readers:
+        item = read_q.get()
+        if item is _DONE:
+            finished_readers += 1
+            continue
+        slots.acquire()
+        pool.apply_async(
+            decode_detect_encode,
+            item,
+            callback=done_q.put,
+            error_callback=lambda e, path=item[0]: done_q.put(
+                {"path": path, "error": f"{e}", "seconds": {}}
+            ),
+        )
+        submitted += 1
+
+    done_q.put(("submitted", submitted))
+
+
+def _add_image(session: Session, result: dict, stats, lock, move: bool = False) -> int:
+    """
+    writer operation: add the processed image in `result`, returns its id
+
+    may be retried, so everything other than the database rows must be idempotent, or
+    happen after commit
+    """
+
+    start = time.time()
+    image_path = Path(result["path"])
+    img_hash = result["image_hash"]
+
+    # move file to IMAGES_DIR, or store it there according to config.STORAGE_MODE
+    dst_name = Path(f"{img_hash[0:2]}") / f"{img_hash[0:8]}{image_path.suffix}"
+    dst_path = model.IMAGES_DIR / dst_name
+    dst_path.parent.mkdir(exist_ok=True, parents=True)
+    log(f"{image_path} -> {dst_path}", component="ingest")
+    original_path = None
+    if move:
+        # moved once committed, so a file whose row is rolled back stays where it was
+        # for a later try
+        mode = "move"
+    else:
+        mode = storage.store(image_path, dst_path, config.STORAGE_MODE)
+        if mode == "reference":
+            original_path = str(image_path.resolve())
+
+    duplicate_of = None
+    if "duplicate_of" in result:
+        duplicate_of = session.scalars(
+            select(Image.id).where(Image.image_hash == result["duplicate_of"])
+        ).first()
+
+    img = Image(
+        file_name=str(dst_name),
+        original_name=image_path.name,
+        display_title=image_path.name,  # no faces are labeled yet
+        height=result["height"],
+        width=result["width"],
+        image_hash=img_hash,
+        hash_version=utils.IMAGE_HASH_VERSION,
+        dhash=result["dhash"],
+        file_hash=result["file_hash"],
+        comment=result["comment"],
+        duplicate_of=duplicate_of,
+        original_path=original_path,
+        face_detection_complete=True,
+    )
+    img.faces = [
+        Face(
+            top=face["location"][0],
+            right=face["location"][1],
+            bottom=face["location"][2],
+            left=face["location"][3],
+            hidden=face["hidden"],
+            hidden_reason=face["hidden_reason"],
+            extracted_path=face["extracted_path"],
+            excluded_people=json.dumps([]),
+            embedding_bytes=face["embedding_bytes"],
+        )
+        for face in result["faces"]
+    ]
+    session.add(img)
+    session.flush()  # assign img.id and face ids
+
+    # the store has no rollback, so only add rows for faces that were committed
+    embedded = [face for face in img.faces if face.embedding_bytes is not None]
+    face_ids = [face.id for face in embedded]
+    vectors = [np.frombuffer(face.embedding_bytes) for face in embedded]
+    size = (image_path if move else dst_path).stat().st_size
+    elapsed = time.time() - start
+
+    def committed():
+        if move:
+            shutil.move(image_path, dst_path)
+        model.EMBEDDINGS.append(face_ids, vectors)
+        with lock:
+            if mode == "copy":
+                stats.stored_bytes += size
+            else:
+                stats.saved_bytes += size
+            stats.seconds["commit"] += elapsed
+
+    after_commit(session, committed)
+    return img.id
+
+
+def _near_duplicate(index, result: dict, known_images: dict) -> str:
+    """the image hash of the nearest image that `result` is a near-duplicate of, or None"""
+    for _, image_hash in index.search(result["dhash"], config.NEAR_DUPLICATE_DISTANCE):
+        # images deleted since the index was built are no longer known
+        if image_hash != result["image_hash"] and image_hash in known_images:
+            return image_hash
+    return None
+
+
+def _resolve(image_id) -> int:
+    """image ids are ints, or Futures from the writer for images added by this ingest"""
+    if isinstance(image_id, Future):
+        try:
+            return image_id.result()
+        except Exception:
+            return None
+    return image_id
+
+
+def ingest(
+    paths,
+    processes: int = model.CPUS,
+    readers: int = 2,
+    depth: int = None,
+    pool: multiprocessing.pool.Pool = None,
+    progress=None,
+    file_hashes: dict = None,
+    move: bool = False,
+) -> list:
+    """
+    add the images at `paths` to the catalog
+
+    `processes`: number of decode/detect/encode worker processes
+    `readers`: number of read/hash threads
+    `depth`: maximum number of images waiting between stages (default 2 * processes)
+    `pool`: an existing worker pool to use (see gallery.workers), in which case `processes`
+    should be its size. Otherwise a pool is created for this ingest
+    `progress`: called with IngestStats.as_dict() and the number of paths as each image
+    finishes
+    `file_hashes`: if provided, filled with the file hash of each path that could be read.
+    Hashes already in it, for example computed while the file was uploaded, are trusted
+    `move`: move new files into IMAGES_DIR, instead of storing them according to
+    config.STORAGE_MODE
+
+    rows are committed in batches by model.get_writer()
+
+    returns the image id for each path (None if the image could not be added)
+    """
+
+    model.init()
+
+    if depth is None:
+        depth = 2 * processes
+
+    paths = [Path(p) for p in paths]
+    if file_hashes is None:
+        file_hashes = {}
+    stats = IngestStats()
+    lock = threading.Lock()
+    writer = model.get_writer()
+
+    with Session(model.get_engine()) as session:
+        known_files = {
+            file_hash: id
+            for file_hash, id in session.execute(select(Image.file_hash, Image.id))
+        }
+        known_images = {
+            image_hash: id
+            for image_hash, id in session.execute(select(Image.image_hash, Image.id))
+        }
+    log(f"{len(paths)} paths, {len(known_files)} images known", component="ingest")
+    index = near_duplicates.get_index()
+
+    path_q = queue.Queue()
+    for p in paths:
+        path_q.put(p)
+    read_q = queue.Queue(maxsize=depth)
+    done_q = queue.Queue()
+    slots = threading.BoundedSemaphore(depth)
+
+    ids = {}  # path -> image id
+    duplicates = {}  # path -> file hash, for files that were already known
+    own_pool = pool is None
+    if own_pool:
+        pool = workers.new_pool(processes)
+    threads = [
+        threading.Thread(
+            target=_read_stage,
+            args=(path_q, read_q, known_files, duplicates, file_hashes, stats, lock),
+            daemon=True,
+        )
+        for _ in range(readers)
+    ]
+    threads += [
+        threading.Thread(
+            target=_dispatch_stage,
+            args=(pool, read_q, done_q, slots, readers),
+            daemon=True,
+        )
+    ]
+    for t in threads:
+        t.start()
+
+    received = 0
+    submitted = None
+    while submitted is None or received < submitted:
+        result = done_q.get()
+        if isinstance(result, tuple):
+            _, submitted = result
+            continue
+        received += 1
+        slots.release()
+        if progress:
+            with lock:
+                snapshot = stats.as_dict()
+            progress(snapshot, len(paths))
+
+        with lock:
+            for stage, seconds in result["seconds"].items():
+                stats.seconds[stage] += seconds
+
+        if "error" in result:
+            log(f"{result['path']}: {result['error']}", component="ingest")
+            with lock:
+                stats.failed += 1
+            ids[result["path"]] = None
+            continue
+
+        img_hash = result["image_hash"]
+        near = _near_duplicate(index, result, known_images)
+        if img_hash in known_images:
+            log(
+                f"{result['path']} image data already present",
+                component="ingest",
+            )
+            with lock:
+                stats.known_images += 1
+            image_id = known_images[img_hash]
+        elif near is not None and config.NEAR_DUPLICATE_POLICY == "skip":
+            log(
+                f"{result['path']} near-duplicate of an image already present",
+                component="ingest",
+            )
+            with lock:
+                stats.near_duplicates += 1
+            image_id = known_images[near]
+            thumbs.remove(img_hash)
+        else:
+            if near is not None:
+                with lock:
+                    stats.near_duplicates += 1
+                result["duplicate_of"] = near
+                if config.NEAR_DUPLICATE_POLICY == "link":
+                    result["faces"] = []  # the faces are already in the gallery
+            index.add(result["dhash"], img_hash)
+            image_id = writer.submit(
+                partial(_add_image, result=result, stats=stats, lock=lock, move=move)
+            )
+            known_images[img_hash] = image_id
+            with lock:
+                stats.added += 1
+                stats.faces += len(result["faces"])
+
+        ids[result["path"]] = image_id
+        with lock:
+            known_files[result["file_hash"]] = image_id
+
+    for t in threads:
+        t.join()
+
+    # let the workers exit normally so their queued log messages are stored
+    if own_pool:
+        pool.close()
+        pool.join()
+
+    writer.flush()
+    for path, file_hash in duplicates.items():
+        ids[path] = known_files.get(file_hash)
+
+    stats.report()
+    if progress:
+        progress(stats.as_dict(), len(paths))
+    log(
+        f"catalog writer: {writer.rows_per_second():.1f} rows/s",
+        component="ingest",
+    )
+    return [_resolve(ids.get(str(p))) for p in paths]
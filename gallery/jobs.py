@@ -0,0 +1,312 @@
+"""
+Persistent job queue for uploads and rescans
+
+Jobs are rows in the catalog's `jobs` table, so they survive a server restart. The server
+runs a loop (run_jobs) that claims the oldest queued job, runs the handler for its kind,
+and records the outcome. A job that fails is retried up to MAX_ATTEMPTS times.
+
+While a job runs, its handler reports progress (per-stage counts, seconds, and throughput),
+which is stored with the job at most every PROGRESS_INTERVAL seconds.
+"""
+
+from pathlib import Path
+import datetime
+import asyncio
+import shutil
+import socket
+import json
+import time
+import uuid
+import os
+
+from sqlalchemy.orm import Session
+from sqlalchemy import select, update
+
+from gallery import model
+from gallery import config
+from gallery import ingest
+from gallery import manifest
+from gallery import watch
+from gallery import workers
+from gallery.model import Job, log
+from gallery.scheduler import get_scheduler
+
+MAX_ATTEMPTS = 3
+
+# seconds between progress updates stored for a running job
+PROGRESS_INTERVAL = 1.0
+
+# seconds between looking for new jobs when idle
+POLL_INTERVAL = 1.0
+
+STATE_NAMES = {
+    model.JOB_QUEUED: "queued",
+    model.JOB_RUNNING: "running",
+    model.JOB_DONE: "done",
+    model.JOB_FAILED: "failed",
+}
+
+# kind -> handler(args: dict, progress), see handler()
+HANDLERS = {}
+
+
+def handler(kind: str):
+    """register a function that runs jobs of `kind`"""
+
+    def register(fn):
+        HANDLERS[kind] = fn
+        return fn
+
+    return register
+
+
+def uploads_dir() -> Path:
+    """a new directory to hold uploaded files until their job finishes"""
+    d = config.CACHE_DIR / "uploads" / uuid.uuid4().hex
+    d.mkdir(parents=True)
+    return d
+
+
+def submit(kind: str, args: dict) -> int:
+    """queue a job, returns its id"""
+
+    def add_job(session: Session):
+        job = Job(
+            kind=kind, args=json.dumps(args), state=model.JOB_QUEUED, progress="{}"
+        )
+        session.add(job)
+        session.flush()
+        return job.id
+
+    job_id = model.get_writer().call(add_job)
+    log(f"queued {kind} job {job_id}", component="jobs")
+    return job_id
+
+
+def _worker() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _alive(worker: str) -> bool:
+    """whether the process that claimed a job is still running"""
+    host, _, pid = (worker or "").rpartition(":")
+    if host != socket.gethostname():
+        return True  # can't tell, leave it alone
+    try:
+        os.kill(int(pid), 0)
+    except (ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def resume():
+    """requeue jobs that were running in a process that has since stopped"""
+
+    def requeue(session: Session):
+        running = session.execute(
+            select(Job.id, Job.worker).where(Job.state == model.JOB_RUNNING)
+        ).all()
+        orphaned = [id for id, worker in running if not _alive(worker)]
+        if orphaned:
+            session.execute(
+                update(Job)
+                .where(Job.id.in_(orphaned))
+                .where(Job.state == model.JOB_RUNNING)
+                .values(state=model.JOB_QUEUED, worker=None)
+            )
+        return len(orphaned)
+
+    n = model.get_writer().call(requeue)
+    if n:
+        log(f"resuming {n} interrupted jobs", component="jobs")
+
+
+def claim():
+    """mark the oldest queued job as running. returns (id, kind, args), or None"""
+
+    def claim_job(session: Session):
+        job = session.scalars(
+            select(Job).where(Job.state == model.JOB_QUEUED).order_by(Job.id).limit(1)
+        ).one_or_none()
+        if job is None:
+            return None
+        # another process may have claimed it first
+        claimed = session.execute(
+            update(Job)
+            .where(Job.id == job.id)
+            .where(Job.state == model.JOB_QUEUED)
+            .values(
+                state=model.JOB_RUNNING,
+                attempts=Job.attempts + 1,
+                worker=_worker(),
+                started_at=datetime.datetime.utcnow(),
+                finished_at=None,
+            )
+        ).rowcount
+        if not claimed:
+            return None
+        return job.id, job.kind, json.loads(job.args)
+
+    return model.get_writer().call(claim_job)
+
+
+def _set_progress(job_id: int, progress: dict):
+    def set_progress(session: Session):
+        session.execute(
+            update(Job).where(Job.id == job_id).values(progress=json.dumps(progress))
+        )
+
+    model.get_writer().submit(set_progress)
+
+
+def run_job(job_id: int, kind: str, args: dict):
+    """run a claimed job and record how it went"""
+
+    log(f"start {kind} job {job_id}", component="jobs")
+    last = {"time": 0.0, "progress": {}}
+
+    def progress(stage: str, stats: dict, total: int = None):
+        last["progress"] = {"stage": stage, "total": total, **stats}
+        if time.time() - last["time"] >= PROGRESS_INTERVAL:
+            last["time"] = time.time()
+            _set_progress(job_id, last["progress"])
+
+    error = None
+    try:
+        HANDLERS[kind](args, progress)
+    except Exception as e:
+        error = f"{e}"
+        log(f"{kind} job {job_id} failed: {e}", component="jobs")
+
+    def finish(session: Session):
+        job = session.get(Job, job_id)
+        job.progress = json.dumps(last["progress"])
+        job.error = error
+        if error is None:
+            job.state = model.JOB_DONE
+            job.finished_at = datetime.datetime.utcnow()
+        elif job.attempts < MAX_ATTEMPTS:
+            job.state = model.JOB_QUEUED
+        else:
+            job.state = model.JOB_FAILED
+            job.finished_at = datetime.datetime.utcnow()
+        return job.state
+
+    state = model.get_writer().call(finish)
+    if state == model.JOB_FAILED and kind == "upload":
+        # no more tries, so nothing will pick up the files that were not ingested
+        shutil.rmtree(args["dir"], ignore_errors=True)
+    log(f"finished {kind} job {job_id}", component="jobs")
+
+
+async def run_jobs(app):
+    """server task: resume interrupted jobs, then run queued jobs one at a time, forever"""
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, resume)
+    while True:
+        try:
+            job = await loop.run_in_executor(None, claim)
+        except Exception as e:
+            log(f"unable to claim a job: {e}", component="jobs")
+            job = None
+        if job is None:
+            await asyncio.sleep(POLL_INTERVAL)
+            continue
+        await loop.run_in_executor(None, run_job, *job)
+
+
+def as_dict(job: Job) -> dict:
+    def iso(t):
+        return t.isoformat() if t else None
+
+    seconds = None
+    if job.started_at:
+        end = job.finished_at or datetime.datetime.utcnow()
+        seconds = (end - job.started_at).total_seconds()
+
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "state": STATE_NAMES.get(job.state),
+        "attempts": job.attempts,
+        "error": job.error,
+        "progress": json.loads(job.progress or "{}"),
+        "created_at": iso(job.created_at),
+        "started_at": iso(job.started_at),
+        "finished_at": iso(job.finished_at),
+        "seconds": seconds,
+    }
+
+
+def recent(limit: int = 50) -> list:
+    """the most recent jobs, newest first, as dicts"""
+    with Session(model.get_engine()) as session:
+        jobs = session.scalars(select(Job).order_by(Job.id.desc()).limit(limit))
+        return [as_dict(job) for job in jobs]
+
+
+def _ingest(paths: list, progress, file_hashes: dict = None, move=False) -> list:
+    ids = ingest.ingest(
+        paths,
+        processes=workers.processes(),
+        pool=workers.get_pool(),
+        progress=lambda stats, total: progress("ingest", stats, total),
+        file_hashes=file_hashes,
+        move=move,
+    )
+    model.incremental_index()
+    get_scheduler().mark_dirty()
+    return ids
+
+
+@handler("watch")
+def watch_job(args: dict, progress):
+    """args: {"paths": originals that appeared or changed, see gallery.watch}"""
+    watch.ingest_batch(
+        args["paths"],
+        processes=workers.processes(),
+        pool=workers.get_pool(),
+        progress=lambda stats, total: progress("ingest", stats, total),
+    )
+    model.incremental_index()
+    get_scheduler().mark_dirty()
+
+
+@handler("upload")
+def upload_job(args: dict, progress):
+    """
+    args: {"dir": directory holding the uploaded files, which is removed when done,
+    "hashes": {path: file hash} computed while the files were received}
+
+    new files are moved, not copied, into IMAGES_DIR, once they are committed. So a retry
+    only finds the files that an earlier try did not add
+    """
+    upload_dir = Path(args["dir"])
+    paths = sorted(p for p in upload_dir.rglob("*") if p.is_file())
+    _ingest(paths, progress, file_hashes=dict(args.get("hashes", {})), move=True)
+    shutil.rmtree(upload_dir, ignore_errors=True)
+
+
+@handler("rescan")
+def rescan_job(args: dict, progress):
+    """
+    args: {"complete": whether to re-read every file, instead of only those that are new or
+    changed according to the manifest}
+    """
+    if not config.ORIGINALS_DIR:
+        raise RuntimeError("no originals directory configured")
+
+    found = manifest.walk(
+        config.ORIGINALS_DIR, progress=lambda n: progress("walk", {"files": n})
+    )
+    paths = manifest.changed(found, complete=args.get("complete", False))
+    log(
+        f"rescan: {len(paths)} of {len(found)} files new or changed",
+        component="jobs",
+    )
+
+    file_hashes = {}
+    ids = _ingest(paths, progress, file_hashes)
+    manifest.update(found, paths, file_hashes, ids, root=config.ORIGINALS_DIR)
@@ -0,0 +1,160 @@
+"""
+Manifest of the files under ORIGINALS_DIR, for incremental rescans
+
+Each file that has been ingested is recorded with its size, mtime_ns, inode, and file hash.
+A rescan only stats each file, and only files that are new or whose stat no longer matches
+the manifest are read and hashed again. A complete rescan ignores the manifest.
+
+The tree is walked with os.scandir on several threads, since a walk of a large library on
+a network or spinning disk is dominated by directory-listing latency.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+import os
+
+from sqlalchemy.orm import Session
+from sqlalchemy import select, delete
+from sqlalchemy.dialects.sqlite import insert
+
+from gallery import model
+from gallery.model import ManifestEntry, log
+
+IMAGE_SUFFIXES = [".jpg", ".png", ".webp", ".jpeg"]
+
+
+def _scan_dir(directory: str) -> tuple:
+    """returns ([(path, stat_result)], [subdirectories]) for one directory"""
+    files, dirs = [], []
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs += [entry.path]
+                    elif entry.is_file() and Path(entry.name).suffix in IMAGE_SUFFIXES:
+                        files += [(entry.path, entry.stat())]
+                except OSError as e:
+                    log(f"{entry.path}: unable to stat: {e}", component="manifest")
+    except OSError as e:
+        log(f"{directory}: unable to list: {e}", component="manifest")
+    return files, dirs
+
+
+def walk(root, threads: int = 8, progress=None) -> dict:
+    """
+    find the images under `root`
+
+    `progress`: called with the number of files found so far after each directory
+
+    returns {path: os.stat_result}
+    """
+    found = {}
+    with ThreadPoolExecutor(threads) as executor:
+        pending = {executor.submit(_scan_dir, str(root))}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, dirs = future.result()
+                found.update(files)
+                pending |= {executor.submit(_scan_dir, d) for d in dirs}
+            if progress:
+                progress(len(found))
+    return found
+
+
+def _matches(entry: tuple, st: os.stat_result) -> bool:
+    size, mtime_ns, inode = entry
+    return (size, mtime_ns, inode) == (st.st_size, st.st_mtime_ns, st.st_ino)
+
+
+def changed(found: dict, complete: bool = False) -> list:
+    """
+    the paths in `found` (see walk) that need to be read: new files, and files whose size,
+    mtime, or inode differ from the manifest. If `complete`, every path
+    """
+    if complete:
+        return sorted(found)
+
+    with Session(model.get_engine()) as session:
+        manifest = {
+            path: (size, mtime_ns, inode)
+            for path, size, mtime_ns, inode in session.execute(
+                select(
+                    ManifestEntry.path,
+                    ManifestEntry.size,
+                    ManifestEntry.mtime_ns,
+                    ManifestEntry.inode,
+                )
+            )
+        }
+    return sorted(
+        path
+        for path, st in found.items()
+        if path not in manifest or not _matches(manifest[path], st)
+    )
+
+
+def update(found: dict, paths: list, file_hashes: dict, image_ids: list, root=None):
+    """
+    record `paths`, which were just ingested, in the manifest
+
+    `found`: the stat of each path (see walk)
+    `file_hashes`: the file hash of each path, from ingest. Paths without one could not be read
+    and are left out, so they are tried again by the next rescan
+    `image_ids`: the image id of each path, from ingest
+    `root`: if provided, manifest entries under `root` that are not in `found` are removed
+    """
+
+    rows = [
+        {
+            "path": path,
+            "size": found[path].st_size,
+            "mtime_ns": found[path].st_mtime_ns,
+            "inode": found[path].st_ino,
+            "file_hash": file_hashes[path],
+            "image_id": image_id,
+        }
+        for path, image_id in zip(paths, image_ids)
+        if path in file_hashes and image_id is not None
+    ]
+
+    def update_manifest(session: Session):
+        for chunk in model._chunks(rows, 1000):
+            stmt = insert(ManifestEntry).values(chunk)
+            session.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=[ManifestEntry.path],
+                    set_={
+                        "size": stmt.excluded.size,
+                        "mtime_ns": stmt.excluded.mtime_ns,
+                        "inode": stmt.excluded.inode,
+                        "file_hash": stmt.excluded.file_hash,
+                        "image_id": stmt.excluded.image_id,
+                    },
+                )
+            )
+
+        removed = 0
+        if root is not None:
+            prefix = os.path.join(str(root), "")
+            gone = [
+                path
+                for path in session.scalars(
+                    select(ManifestEntry.path).where(
+                        ManifestEntry.path.startswith(prefix, autoescape=True)
+                    )
+                )
+                if path not in found
+            ]
+            for chunk in model._chunks(gone):
+                session.execute(
+                    delete(ManifestEntry).where(ManifestEntry.path.in_(chunk))
+                )
+            removed = len(gone)
+        return removed
+
+    removed = model.get_writer().call(update_manifest)
+    log(
+        f"manifest: recorded {len(rows)} files, removed {removed}", component="manifest"
+    )
@@ -4,21 +4,27 @@ import sqlite3
 import json
 from typing import Tuple
 import datetime
-import shutil
 from typing import List
+import threading
 import time
+import os
+import math
 from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship, Session
-from sqlalchemy import Text, Integer, DateTime, ForeignKey, LargeBinary
+from sqlalchemy.orm import selectinload
+from sqlalchemy import Text, Integer, DateTime, ForeignKey, LargeBinary, Index
 from sqlalchemy import create_engine
-from sqlalchemy import select
+from sqlalchemy import select, func, update, delete, insert, distinct, and_
+from sqlalchemy import event
+from sqlalchemy import inspect, text
 
 import face_recognition
 import numpy as np
 from sklearn.cluster import HDBSCAN
-from sklearn.neighbors import NearestNeighbors
 import numpy as np
 import numpy.typing as npt
 from PIL import Image as PilImage
@@ -30,6 +36,8 @@ from whoosh.qparser import QueryParser
 
 from gallery import utils
 from gallery import config as cfg
+from gallery.writer import Writer, after_commit
+from gallery.embeddings import EmbeddingStore
 
 PERSON_SOURCE_MANUAL = 1
 PERSON_SOURCE_AUTOMATIC = 2
@@ -37,13 +45,28 @@ PERSON_SOURCE_AUTOMATIC = 2
 HIDDEN_REASON_SMALL = 1
 HIDDEN_REASON_MANUAL = 2
 
+JOB_QUEUED = 1
+JOB_RUNNING = 2
+JOB_DONE = 3
+JOB_FAILED = 4
+
+# faces further apart than this are never labeled as the same person
+# CLUSTER_EPS = 0.44
+CLUSTER_EPS = 0.38
+
 CPUS = max(multiprocessing.cpu_count() - 1, 1)
 
+# seconds a connection waits for a lock before raising "database is locked"
+SQLITE_TIMEOUT = 30
+
 IMAGES_DIR = cfg.CACHE_DIR / "images"
 FACES_DIR = cfg.CACHE_DIR / "faces"
+THUMBS_DIR = cfg.CACHE_DIR / "thumbs"
+AVATARS_DIR = cfg.CACHE_DIR / "avatars"
 DB_PATH = cfg.CACHE_DIR / "gallery.db"
 DB_LOG_PATH = cfg.CACHE_DIR / "logs.db"
 WHOOSH_DIR = cfg.CACHE_DIR / "whoosh"
+EMBEDDINGS = EmbeddingStore(cfg.CACHE_DIR)
 
 WHOOSH_SCHEMA = whoosh.fields.Schema(
     id=whoosh.fields.NUMERIC(stored=True),
@@ -63,13 +86,23 @@ class Image(Base):
     height: Mapped[int] = mapped_column(Integer)
     width: Mapped[int] = mapped_column(Integer)
     title: Mapped[str] = mapped_column(Text, nullable=True)
+    # what get_image_title returns, kept current when titles, labels, or names change
+    display_title: Mapped[str] = mapped_column(Text, nullable=True)
     face_detection_complete: Mapped[bool] = mapped_column(Integer, default=False)
     archived: Mapped[bool] = mapped_column(Integer, default=False)
     created_at: Mapped[datetime.datetime] = mapped_column(
         DateTime, default=datetime.datetime.utcnow
     )  # time in UTC
     image_hash: Mapped[str] = mapped_column(Text)  # hash of the image data
-    file_hash: Mapped[str] = mapped_column(Text)  # hash of the file data
+    # utils.IMAGE_HASH_VERSION that produced image_hash, NULL for version 1
+    hash_version: Mapped[int] = mapped_column(Integer, nullable=True)
+    dhash: Mapped[str] = mapped_column(Text, nullable=True)  # see utils.dhash
+    # where the original lives, if it is referenced in place rather than stored in
+    # IMAGES_DIR (see gallery.storage)
+    original_path: Mapped[str] = mapped_column(Text, nullable=True)
+    # the image this is a near-duplicate of, see gallery.duplicates
+    duplicate_of: Mapped[int] = mapped_column(ForeignKey("images.id"), nullable=True)
+    file_hash: Mapped[str] = mapped_column(Text, index=True)  # hash of the file data
     comment: Mapped[str] = mapped_column(Text, default="")
     faces: Mapped[List["Face"]] = relationship(
         back_populates="image",  # Face.image
@@ -107,6 +140,65 @@ class Person(Base):
     )
 
 
+class PersonStats(Base):
+    """
+    what the people pages show about a person, kept current by refresh_person_stats
+
+    only unhidden faces are counted
+    """
+
+    __tablename__ = "person_stats"
+    person_id: Mapped[int] = mapped_column(ForeignKey("people.id"), primary_key=True)
+    named: Mapped[bool] = mapped_column(Integer)  # whether Person.name is set
+    face_count: Mapped[int] = mapped_column(Integer)
+    image_count: Mapped[int] = mapped_column(Integer)
+    # the person's first face, shown as their avatar
+    thumb_face_id: Mapped[int] = mapped_column(ForeignKey("faces.id"), nullable=True)
+    # Image.created_at of the newest image the person is in
+    last_seen: Mapped[datetime.datetime] = mapped_column(DateTime, nullable=True)
+
+    person: Mapped["Person"] = relationship()
+    thumb_face: Mapped["Face"] = relationship()
+
+
+# the people pages are a range scan of this, see get_people_page
+Index(
+    "ix_person_stats_page",
+    PersonStats.named,
+    PersonStats.face_count.desc(),
+    PersonStats.person_id,
+)
+
+
+class ManifestEntry(Base):
+    """the last known state of a file under ORIGINALS_DIR, see gallery.manifest"""
+
+    __tablename__ = "manifest"
+    path: Mapped[str] = mapped_column(Text, primary_key=True)
+    size: Mapped[int] = mapped_column(Integer)
+    mtime_ns: Mapped[int] = mapped_column(Integer)
+    inode: Mapped[int] = mapped_column(Integer)
+    file_hash: Mapped[str] = mapped_column(Text, nullable=True)
+    image_id: Mapped[int] = mapped_column(Integer, nullable=True)
+
+
+class Job(Base):
+    __tablename__ = "jobs"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    kind: Mapped[str] = mapped_column(Text)  # see gallery.jobs
+    args: Mapped[str] = mapped_column(Text)  # json
+    state: Mapped[int] = mapped_column(Integer, index=True)  # JOB_*
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    worker: Mapped[str] = mapped_column(Text, nullable=True)  # host:pid running it
+    error: Mapped[str] = mapped_column(Text, nullable=True)
+    progress: Mapped[str] = mapped_column(Text, default="{}")  # json
+    created_at: Mapped[datetime.datetime] = mapped_column(
+        DateTime, default=datetime.datetime.utcnow
+    )  # time in UTC
+    started_at: Mapped[datetime.datetime] = mapped_column(DateTime, nullable=True)
+    finished_at: Mapped[datetime.datetime] = mapped_column(DateTime, nullable=True)
+
+
 class LogBase(DeclarativeBase):
     pass
 
@@ -119,6 +211,14 @@ class Log(LogBase):
     message: Mapped[str] = mapped_column(Text)
 
 
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets readers proceed while the writer commits, and fsyncs far less often
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
 ENGINE = None
 
 
@@ -128,7 +228,10 @@ def get_engine():
         DB_PATH.parent.mkdir(exist_ok=True, parents=True)
         engine_path = f"sqlite:///{DB_PATH.resolve()}"
         print(f"open {engine_path}")
-        ENGINE = create_engine(engine_path, echo=False)
+        ENGINE = create_engine(
+            engine_path, echo=False, connect_args={"timeout": SQLITE_TIMEOUT}
+        )
+        event.listen(ENGINE, "connect", _set_sqlite_pragmas)
     return ENGINE
 
 
@@ -141,14 +244,152 @@ def get_log_engine():
         DB_LOG_PATH.parent.mkdir(exist_ok=True, parents=True)
         engine_path = f"sqlite:///{DB_LOG_PATH.resolve()}"
         print(f"open {engine_path}")
-        LOG_ENGINE = create_engine(engine_path, echo=False)
+        LOG_ENGINE = create_engine(
+            engine_path, echo=False, connect_args={"timeout": SQLITE_TIMEOUT}
+        )
+        event.listen(LOG_ENGINE, "connect", _set_sqlite_pragmas)
     return LOG_ENGINE
 
 
+# changes whenever something shown on a page is committed, by any process
+GENERATION_PATH = cfg.CACHE_DIR / "generation"
+
+# tables whose changes do not show on any page
+GENERATION_IGNORED_TABLES = {"jobs", "manifest"}
+
+_GENERATION = {"stat": None, "value": 0}
+_GENERATION_LOCK = threading.Lock()
+
+
+def generation() -> int:
+    """
+    the catalog generation, which increases whenever a change is committed
+
+    reads GENERATION_PATH only when it has changed, so this is a stat, not a query
+    """
+    try:
+        st = os.stat(GENERATION_PATH)
+    except FileNotFoundError:
+        return 0
+    key = (st.st_ino, st.st_mtime_ns, st.st_size)
+    if key != _GENERATION["stat"]:
+        try:
+            value = int(GENERATION_PATH.read_text())
+        except (OSError, ValueError):
+            return _GENERATION["value"]  # being replaced
+        _GENERATION.update(stat=key, value=value)
+    return _GENERATION["value"]
+
+
+def bump_generation() -> int:
+    """advance the catalog generation, returns the new one"""
+    with _GENERATION_LOCK:
+        # a timestamp, so generations from different processes still increase
+        value = max(generation() + 1, time.time_ns())
+        tmp = GENERATION_PATH.with_name(f".generation.{os.getpid()}")
+        tmp.write_text(f"{value}")
+        os.replace(tmp, GENERATION_PATH)
+    return value
+
+
+def _changed_tables(session: Session, tables):
+    if session.bind is ENGINE and set(tables) - GENERATION_IGNORED_TABLES:
+        session.info["catalog_changed"] = True
+
+
+@event.listens_for(Session, "after_flush")
+def _after_flush(session: Session, flush_context):
+    objs = [*session.new, *session.dirty, *session.deleted]
+    _changed_tables(session, {obj.__tablename__ for obj in objs})
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _do_orm_execute(state):
+    # bulk statements, e.g. session.execute(update(Face), [...]), do not flush objects
+    if state.is_insert or state.is_update or state.is_delete:
+        table = getattr(state.statement, "table", None)
+        _changed_tables(state.session, {getattr(table, "name", None)})
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session: Session):
+    if session.info.pop("catalog_changed", False):
+        bump_generation()
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session: Session):
+    session.info.pop("catalog_changed", None)
+
+
+WRITER = None
+
+
+def get_writer() -> Writer:
+    """the single writer for the catalog database in this process"""
+    global WRITER
+    if WRITER is None or WRITER.pid != os.getpid():
+        # writers are closed in the reverse order they were made, and this one logs
+        # through the log writer when it closes
+        get_log_writer()
+        WRITER = Writer(get_engine, "catalog", log=log)
+    return WRITER
+
+
+LOG_WRITER = None
+
+
+def get_log_writer() -> Writer:
+    """the single writer for the log database in this process"""
+    global LOG_WRITER
+    if LOG_WRITER is None or LOG_WRITER.pid != os.getpid():
+        LOG_WRITER = Writer(get_log_engine, "log", max_delay=0.5)
+    return LOG_WRITER
+
+
+def _upgrade_schema(engine):
+    """
+    create_all only creates missing tables. add the columns and indexes declared since a
+    table was created. added columns must be nullable
+
+    returns the added columns, as "table.column"
+    """
+    added = []
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(engine.dialect)
+                    conn.execute(
+                        text(
+                            f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}'
+                        )
+                    )
+                    added += [f"{table.name}.{column.name}"]
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+    return added
+
+
 def init():
     # sqlite database
     engine = get_engine()
+    had_person_stats = inspect(engine).has_table(PersonStats.__tablename__)
     Base.metadata.create_all(engine)
+    added = _upgrade_schema(engine)
+    if not had_person_stats:
+        with Session(engine) as session:
+            n = refresh_person_stats(session, session.scalars(select(Person.id)).all())
+            session.commit()
+        log(f"stored stats of {n} people")
+    if "images.display_title" in added:
+        with Session(engine) as session:
+            n = refresh_titles(session, session.scalars(select(Image.id)).all())
+            session.commit()
+        log(f"stored titles of {n} images")
 
     log_engine = get_log_engine()
     LogBase.metadata.create_all(log_engine)
@@ -168,42 +409,123 @@ def log(message: str, component: str = None):
     if not isinstance(message, str):
         message = f"{message}"
 
+    def add_record(session: Session):
+        session.add(Log(unix=epoch_us, message=message, component=component))
+
+    # log messages are batched, nothing waits for them to be stored
     try:
-        record = Log(unix=epoch_us, message=message, component=component)
-        with Session(get_log_engine()) as session:
-            session.add(record)
-            session.commit()
+        get_log_writer().submit(add_record)
     except Exception as e:
         print(f"error storing log message: {e}")
 
 
 def new_person(name: str) -> int:
-    with Session(get_engine()) as session:
+    def add_person(session: Session) -> int:
         person = Person(name=name)
         session.add(person)
-        session.commit()
+        session.flush()
         return person.id
 
+    return get_writer().call(add_person)
+
 
-def all_embeddings(session: Session, include_hidden=False) -> list:
-    query = select(Face).where(Face.embedding_bytes != None)
+def embedding_face_ids(session: Session, include_hidden=False) -> list:
+    """ids of all faces with an embedding"""
+    query = select(Face.id).where(Face.embedding_bytes != None)
     if not include_hidden:
         query = query.where(Face.hidden == 0)
-    faces = session.scalars(query).all()
+    return session.scalars(query).all()
 
-    return [np.frombuffer(face.embedding_bytes) for face in faces], [
-        face.id for face in faces
-    ]
+
+def all_embeddings(session: Session, include_hidden=False) -> Tuple[npt.NDArray, list]:
+    """
+    returns (X, face_ids), where row i of X is the embedding of face face_ids[i]
+
+    X is read from EMBEDDINGS. When every stored embedding is wanted, X is the memory map of
+    the store itself. Otherwise it is a copy of just the selected rows.
+    Any faces missing from the store are appended to it first.
+    """
+    wanted = np.array(embedding_face_ids(session, include_hidden), dtype=np.int64)
+
+    X, ids = EMBEDDINGS.load()
+    missing = np.setdiff1d(wanted, ids, assume_unique=True)
+    if len(missing):
+        log(f"appending {len(missing)} faces missing from the embedding store")
+        rows = session.execute(
+            select(Face.id, Face.embedding_bytes).where(Face.id.in_(missing.tolist()))
+        ).all()
+        EMBEDDINGS.append(
+            [face_id for face_id, _ in rows],
+            [np.frombuffer(b) for _, b in rows],
+        )
+        X, ids = EMBEDDINGS.load()
+
+    if len(wanted) == len(ids):
+        # nothing to filter out, use the store as-is
+        return X, ids.tolist()
+
+    keep = np.isin(ids, wanted)
+    return X[keep], ids[keep].tolist()
+
+
+def rebuild_embeddings() -> int:
+    """rewrite EMBEDDINGS from the faces table. returns the number of embeddings"""
+    with Session(get_engine()) as session:
+        rows = session.execute(
+            select(Face.id, Face.embedding_bytes)
+            .where(Face.embedding_bytes != None)
+            .order_by(Face.id)
+            .execution_options(yield_per=10000)
+        )
+        n = EMBEDDINGS.rebuild((face_id, np.frombuffer(b)) for face_id, b in rows)
+    log(f"rebuilt embedding store with {n} embeddings")
+    return n
+
+
+def verify_embeddings() -> bool:
+    """
+    compare EMBEDDINGS to the faces table
+
+    returns True if every face with an embedding has exactly that embedding in the store,
+    and the store holds nothing else
+    """
+    X, ids = EMBEDDINGS.load()
+    index = {face_id: i for i, face_id in enumerate(ids.tolist())}
+
+    missing = 0
+    different = 0
+    seen = set()
+    with Session(get_engine()) as session:
+        rows = session.execute(
+            select(Face.id, Face.embedding_bytes)
+            .where(Face.embedding_bytes != None)
+            .execution_options(yield_per=10000)
+        )
+        for face_id, b in rows:
+            seen.add(face_id)
+            i = index.get(face_id)
+            if i is None:
+                missing += 1
+            elif not np.array_equal(X[i], np.frombuffer(b).astype(np.float32)):
+                different += 1
+    extra = len(index) - len(seen & index.keys())
+
+    log(
+        f"embedding store: {len(index)} stored, {len(seen)} in database, "
+        f"{missing} missing, {different} different, {extra} not in database"
+    )
+    return missing == 0 and different == 0 and extra == 0
 
 
 def set_face_person(face_id: int, person_id: int, person_source: int):
     log(f"model.set_face_person: set face {face_id} to person {person_id}")
-    with Session(get_engine()) as session:
-        face = session.scalars(select(Face).where(Face.id == face_id)).one()
 
+    def update_face(session: Session):
+        face = session.scalars(select(Face).where(Face.id == face_id)).one()
         face.person_id = person_id
         face.person_source = person_source
-        session.commit()
+
+    get_writer().call(update_face)
 
 
 def get_person_name(conn: sqlite3.Connection, person_id: int) -> Tuple[str, None]:
@@ -243,6 +565,7 @@ def face_add_excluded_person(conn: sqlite3.Connection, face_id: int, person_id:
     )
     conn.commit()
     cursor.close()
+    bump_generation()  # not an ORM session, see _after_commit
 
 
 def get_person_by_name_exact(name: str) -> int:
@@ -341,12 +664,237 @@ def get_faces_for_original(
     return rows
 
 
+def face_is_small(location: Tuple[int, int, int, int], width: int, height: int) -> bool:
+    """
+    location is (top, right, bottom, left), as produced by face_recognition.face_locations
+    width and height are the size of the image the face was found in
+
+    if the image is large enough to be detected in tiles, faces are measured against the tile
+    """
+    top, right, bottom, left = location
+    if _tiled(width, height):
+        width, height = min(width, cfg.DETECTION_TILE_SIZE), min(
+            height, cfg.DETECTION_TILE_SIZE
+        )
+    return (bottom - top) / height < 0.04 or (right - left) / width < 0.04
+
+
+def _tiled(width: int, height: int) -> bool:
+    """whether an image of this size is detected in tiles"""
+    return (
+        bool(cfg.DETECTION_TILE_SIZE) and max(width, height) > cfg.DETECTION_TILE_SIZE
+    )
+
+
+def _tiles(width: int, height: int, tile: int, overlap: int) -> list:
+    """(left, top, right, bottom) of overlapping tiles covering a width x height image"""
+
+    def starts(length):
+        if length <= tile:
+            return [0]
+        n = math.ceil((length - overlap) / (tile - overlap))
+        step = (length - tile) / (n - 1)
+        return [round(i * step) for i in range(n)]
+
+    return [
+        (x, y, min(width, x + tile), min(height, y + tile))
+        for y in starts(height)
+        for x in starts(width)
+    ]
+
+
+def _merge_locations(locations: list) -> list:
+    """
+    drop duplicate (top, right, bottom, left) boxes, such as a face found in two overlapping tiles,
+    keeping the larger box
+    """
+
+    def area(loc):
+        return (loc[2] - loc[0]) * (loc[1] - loc[3])
+
+    def contained(a, b):
+        """fraction of the smaller box covered by the other"""
+        top, bottom = max(a[0], b[0]), min(a[2], b[2])
+        left, right = max(a[3], b[3]), min(a[1], b[1])
+        if bottom <= top or right <= left:
+            return 0.0
+        return (bottom - top) * (right - left) / min(area(a), area(b))
+
+    kept = []
+    for loc in sorted(locations, key=area, reverse=True):
+        if all(_overlap(loc, k) < 0.3 and contained(loc, k) < 0.7 for k in kept):
+            kept += [loc]
+    return kept
+
+
+def _detection_factor(width: int, height: int, max_size: int) -> int:
+    """integer reduction factor so that the long side is at most max_size (0: no limit)"""
+    if not max_size:
+        return 1
+    return max(1, math.ceil(max(width, height) / max_size))
+
+
+def open_for_detection(fp) -> PilImage:
+    """
+    open an image for locate_faces
+
+    JPEGs are decoded at a reduced size if detection will not use full resolution,
+    which is much faster than decoding the whole image
+    """
+    pil_img = PilImage.open(fp)
+    factor = _detection_factor(*pil_img.size, cfg.DETECTION_MAX_SIZE)
+    if pil_img.format == "JPEG" and factor > 1:
+        # draft picks the smallest DCT scale that is at least the requested size
+        pil_img.draft("RGB", (pil_img.width // factor, pil_img.height // factor))
+    pil_img.load()
+    return pil_img
+
+
+def _detect(pil_img: PilImage, max_size: int) -> list:
+    """
+    run the face detector on pil_img reduced to at most max_size on the long side
+
+    returns (top, right, bottom, left) in pil_img coordinates
+    """
+    factor = _detection_factor(*pil_img.size, max_size)
+    rgb = pil_img.convert("RGB")
+    if factor > 1:
+        rgb = rgb.reduce(factor)
+    sx, sy = pil_img.width / rgb.width, pil_img.height / rgb.height
+    return [
+        (round(t * sy), round(r * sx), round(b * sy), round(l * sx))
+        for t, r, b, l in face_recognition.face_locations(np.array(rgb))
+    ]
+
+
+def _detect_tiled(pil_img: PilImage, tile: float) -> list:
+    """
+    run _detect on overlapping tiles of pil_img, each `tile` pixels on a side, so memory use
+    is bounded by the tile size rather than the image size
+
+    returns (top, right, bottom, left) in pil_img coordinates, with duplicates across tile
+    seams merged
+    """
+    tile = max(1, round(tile))
+    overlap = round(tile * cfg.DETECTION_TILE_OVERLAP)
+    boxes = _tiles(pil_img.width, pil_img.height, tile, overlap)
+
+    def detect_tile(box):
+        left, top, _, _ = box
+        return [
+            (t + top, r + left, b + top, l + left)
+            for t, r, b, l in _detect(pil_img.crop(box), cfg.DETECTION_MAX_SIZE)
+        ]
+
+    if cfg.DETECTION_TILE_WORKERS > 1:
+        with ThreadPoolExecutor(cfg.DETECTION_TILE_WORKERS) as executor:
+            found = list(executor.map(detect_tile, boxes))
+    else:
+        found = [detect_tile(box) for box in boxes]
+
+    return _merge_locations([loc for locs in found for loc in locs])
+
+
+def _overlap(a: Tuple[int, int, int, int], b: Tuple[int, int, int, int]) -> float:
+    """intersection over union of two (top, right, bottom, left) boxes"""
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    if bottom <= top or right <= left:
+        return 0.0
+    intersection = (bottom - top) * (right - left)
+    area_a = (a[2] - a[0]) * (a[1] - a[3])
+    area_b = (b[2] - b[0]) * (b[1] - b[3])
+    return intersection / (area_a + area_b - intersection)
+
+
+def locate_faces(pil_img: PilImage, size: Tuple[int, int] = None) -> list:
+    """
+    find faces in pil_img, at the resolution set by config.DETECTION_MAX_SIZE
+
+    `size`: (width, height) of the original image, if pil_img is a reduced-size decode of it
+        (see open_for_detection)
+
+    returns (top, right, bottom, left) for each face, in original image coordinates
+
+    With config.DETECTION_SECOND_PASS, the area around the faces found in the first pass,
+    where small faces in the same group are likely, is searched again at a higher resolution
+
+    Images larger than config.DETECTION_TILE_SIZE are searched in overlapping tiles instead
+    """
+    width, height = size or pil_img.size
+    max_size = cfg.DETECTION_MAX_SIZE
+
+    if _tiled(width, height):
+        locations = _detect_tiled(
+            pil_img, cfg.DETECTION_TILE_SIZE * pil_img.width / width
+        )
+    else:
+        locations = _detect(pil_img, max_size)
+
+    if (
+        not _tiled(width, height)
+        and cfg.DETECTION_SECOND_PASS
+        and locations
+        and _detection_factor(*pil_img.size, max_size) > 1
+    ):
+        # the faces found, expanded by two face heights in every direction
+        margin = 2 * max(b - t for t, _, b, _ in locations)
+        region = (
+            max(0, min(l for _, _, _, l in locations) - margin),
+            max(0, min(t for t, _, _, _ in locations) - margin),
+            min(pil_img.width, max(r for _, r, _, _ in locations) + margin),
+            min(pil_img.height, max(b for _, _, b, _ in locations) + margin),
+        )
+        crop = pil_img.crop(region)
+        if _detection_factor(*crop.size, max_size) < _detection_factor(
+            *pil_img.size, max_size
+        ):
+            for t, r, b, l in _detect(crop, max_size):
+                location = (t + region[1], r + region[0], b + region[1], l + region[0])
+                if all(_overlap(location, other) < 0.3 for other in locations):
+                    locations += [location]
+
+    # scale to original coordinates
+    sx, sy = width / pil_img.width, height / pil_img.height
+    return [
+        (
+            round(t * sy),
+            min(width, round(r * sx)),
+            min(height, round(b * sy)),
+            round(l * sx),
+        )
+        for t, r, b, l in locations
+    ]
+
+
+def face_crop_name(image_hash: str, location: Tuple[int, int, int, int]) -> Path:
+    """
+    the name under FACES_DIR of the crop of location (top, right, bottom, left) in the
+    image with `image_hash`
+
+    crops are made when they are first needed, see gallery.crops
+    """
+    top, right, bottom, left = location
+    return (
+        Path(image_hash[0:2]) / f"{image_hash[0:16]}-{top}-{right}-{bottom}-{left}.jpg"
+    )
+
+
+def image_comment(pil_img: PilImage) -> str:
+    """return the comment embedded in the image file, or an empty string"""
+    comment = pil_img.info.get("comment", "")
+    if isinstance(comment, bytes):
+        comment = comment.decode("utf-8")
+    return comment
+
+
 def detect_face_from_loaded(
-    session: Session, image: Image, pil_img: PilImage
+    session: Session, image: Image, pil_img: PilImage, locations: list = None
 ) -> npt.NDArray | None:
     """
     data should be the contents of the image file
     Image should be the database entry
+    locations, if provided, are the faces already found in the image by locate_faces
 
     returns what face_recognition.load_image_file would have produced for the corresponding image file,
     or None if faces have already been detected
@@ -357,8 +905,6 @@ def detect_face_from_loaded(
         log(f"already detected faces for {image.id}")
         return None
 
-    image_path = IMAGES_DIR / image.file_name
-
     # face_recognition.load_image_file is just
     # https://github.com/ageitgey/face_recognition/blob/2e2dccea9dd0ce730c8d464d0f67c6eebb40c9d1/face_recognition/api.py#L78-L89
     # im = PIL.Image.open(file)
@@ -367,32 +913,20 @@ def detect_face_from_loaded(
     # return np.array(im)
     fr_img = np.array(pil_img.convert("RGB"))
 
-    locations = face_recognition.face_locations(fr_img)
+    if locations is None:
+        locations = locate_faces(pil_img)
     for y1, x2, y2, x1 in locations:  # [(t, r, b, l)]
-        face_height = y2 - y1
-        face_width = x2 - x1
-
         log(f"image {image.id}: new face at {(x1, y1, x2, y2)}")
-        face_is_small = (
-            face_height / pil_img.height < 0.04 or face_width / image.width < 0.04
-        )
         hidden = False
         hidden_reason = None
-        if face_is_small:
+        if face_is_small((y1, x2, y2, x1), pil_img.width, pil_img.height):
             log(
                 f"image {image.id}: face at {(x1, y1, x2, y2)} will be hidden (too small)"
             )
             hidden = True
             hidden_reason = HIDDEN_REASON_SMALL
 
-        cropped = pil_img.crop((x1, y1, x2, y2))
-        cropped_sha = utils.hash_image_data(cropped)
-        output_ext = "".join(image_path.suffixes)
-        output_name = Path(f"{cropped_sha[0:2]}") / f"{cropped_sha[0:8]}{output_ext}"
-        output_path = FACES_DIR / output_name
-        output_path.parent.mkdir(exist_ok=True, parents=True)
-        log(output_path)
-        cropped.save(output_path)
+        output_name = face_crop_name(image.image_hash, (y1, x2, y2, x1))
 
         session.add(
             Face(
@@ -424,10 +958,15 @@ def detect_face(image_id: int):
             image_path = IMAGES_DIR / image.file_name
 
             with open(image_path, "rb") as f:
-                pil_img = PilImage.open(f)
-                pil_img.load()
+                pil_img = open_for_detection(f)
+            locations = locate_faces(pil_img, (image.width, image.height))
 
-            detect_face_from_loaded(session, image, pil_img)
+            # only decode the whole image if there are faces to crop
+            if locations:
+                with open(image_path, "rb") as f:
+                    pil_img = PilImage.open(f)
+                    pil_img.load()
+            detect_face_from_loaded(session, image, pil_img, locations)
 
         else:
             log(f"already detected faces for {image_id}")
@@ -456,223 +995,512 @@ def generate_embedding(session: Session, face: Face, fr_img: npt.NDArray):
     )[0]
 
     face.embedding_bytes = encoding.tobytes()
+    EMBEDDINGS.append([face.id], encoding)
+
+
+def encode_image_faces(file_name: str, faces: list) -> tuple:
+    """
+    decode IMAGES_DIR / file_name once, and compute embeddings for all of `faces`,
+    a list of (face id, (top, right, bottom, left)), with one face_encodings call
 
+    returns (face ids, embedding bytes), or (face ids, None) if the image could not be read
+    """
+    face_ids = [face_id for face_id, _ in faces]
+    try:
+        fr_img = face_recognition.load_image_file(IMAGES_DIR / file_name)
+        encodings = face_recognition.face_encodings(
+            fr_img, known_face_locations=[location for _, location in faces]
+        )
+    except Exception as e:
+        log(f"{file_name}: unable to generate embeddings: {e}")
+        return face_ids, None
+    return face_ids, [encoding.tobytes() for encoding in encodings]
+
+
+def _store_embeddings(session: Session, encoded: list) -> int:
+    """writer operation: store (face ids, embedding bytes) for each image in `encoded`"""
+    rows = [
+        {"id": face_id, "embedding_bytes": embedding}
+        for face_ids, embeddings in encoded
+        for face_id, embedding in zip(face_ids, embeddings)
+    ]
+    if rows:
+        session.execute(update(Face), rows)
+        # the store has no rollback, so only add rows that were committed
+        after_commit(
+            session,
+            partial(
+                EMBEDDINGS.append,
+                [row["id"] for row in rows],
+                [np.frombuffer(row["embedding_bytes"]) for row in rows],
+            ),
+        )
+    return len(rows)
 
-def generate_embeddings():
+
+def generate_embeddings(processes: int = CPUS, commit_every: int = 50):
+    """
+    generate embeddings for all visible faces that don't have one
+
+    faces are grouped by image, so each image is decoded once. Images are spread over
+    `processes` worker processes, and embeddings are committed every `commit_every` images
+    """
     init()
 
     with Session(get_engine()) as session:
-        faces = session.scalars(
-            select(Face).where(Face.embedding_bytes == None).where(Face.hidden == 0)
+        rows = session.execute(
+            select(
+                Image.file_name, Face.id, Face.top, Face.right, Face.bottom, Face.left
+            )
+            .join(Face.image)
+            .where(Face.embedding_bytes == None)
+            .where(Face.hidden == 0)
+            .order_by(Image.id)
         ).all()
 
-        for face in faces:
-            # retrieve image for face
-            image = session.scalars(
-                select(Image).where(Image.id == face.image_id)
-            ).one()
+    by_image = {}
+    for file_name, face_id, top, right, bottom, left in rows:
+        by_image.setdefault(file_name, []).append((face_id, (top, right, bottom, left)))
+    if not by_image:
+        return
+    log(f"generate embeddings for {len(rows)} faces in {len(by_image)} images")
+
+    start = time.time()
+    writer = get_writer()
+    stored = 0
+    pending = []
+
+    def commit():
+        nonlocal stored, pending
+        if pending:
+            stored += writer.call(partial(_store_embeddings, encoded=pending))
+            log(f"committed {stored} embeddings")
+            pending = []
+
+    pool = None
+    if processes > 1 and len(by_image) > 1:
+        from gallery import workers  # imports this module
+
+        pool = workers.new_pool(min(processes, len(by_image)))
+        results = pool.imap_unordered(_encode_image_faces_star, by_image.items())
+    else:
+        results = (encode_image_faces(*item) for item in by_image.items())
 
-            original_img = face_recognition.load_image_file(
-                IMAGES_DIR / image.file_name
-            )
+    try:
+        for face_ids, embeddings in results:
+            if embeddings is not None:
+                pending += [(face_ids, embeddings)]
+            if len(pending) >= commit_every:
+                commit()
+        commit()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    elapsed = time.time() - start
+    log(
+        f"generated {stored} embeddings in {elapsed:.2f}s "
+        f"({len(by_image) / max(elapsed, 1e-9):.1f} images/s)"
+    )
 
-            generate_embedding(session, face, original_img)
-        log(f"commit embeddings")
-        session.commit()
+
+def _encode_image_faces_star(item: tuple) -> tuple:
+    return encode_image_faces(*item)
 
 
-def remove_empty_people(session: Session):
+def remove_empty_people(session: Session, person_ids: list = None):
     """remove any people that are
     1. not referenced by a face
     2. referenced only by hidden faces
+
+    if `person_ids` is provided, only those people are considered
     """
 
-    people = session.scalars(select(Person)).all()
-    for person in people:
-        faces = session.scalars(
-            select(Face).where(Face.person_id == person.id).where(Face.hidden == 0)
-        ).all()
-        if not faces:
-            log(f"delete unreferenced person {person.id}")
-            session.delete(person)
+    visible_face = (
+        select(Face.id).where(Face.person_id == Person.id).where(Face.hidden == 0)
+    )
+    query = select(Person.id).where(~visible_face.exists())
+    if person_ids is not None:
+        query = query.where(Person.id.in_(person_ids))
+    empty = session.scalars(query).all()
+
+    if empty:
+        log(f"delete {len(empty)} unreferenced people")
+        for chunk in _chunks(empty):
+            people_changed(session, chunk)
+            # hidden faces may still refer to them
+            titles_changed(
+                session,
+                session.scalars(select(Face.image_id).where(Face.person_id.in_(chunk))),
+            )
+            session.execute(
+                update(Face).where(Face.person_id.in_(chunk)).values(person_id=None)
+            )
+            session.execute(delete(Person).where(Person.id.in_(chunk)))
 
     session.commit()
 
 
+def _nearest(X: npt.NDArray, queries: list, references: list):
+    """
+    for each row index in `queries`, the position in `references` of the nearest reference row
+    of X, and the distance to it
+    """
+    Q = np.asarray(X[queries], dtype=np.float32)
+    R = np.asarray(X[references], dtype=np.float32)
+    # |q - r|^2 = |q|^2 + |r|^2 - 2 q.r
+    sq = np.sum(Q * Q, axis=1)[:, None] + np.sum(R * R, axis=1)[None, :] - 2 * Q @ R.T
+    nearest = np.argmin(sq, axis=1)
+    return nearest, np.sqrt(np.maximum(sq[np.arange(len(queries)), nearest], 0))
+
+
 def update_labels():
     """
-    Cluster all the embeddings with DBSCAN
+    Cluster all the embeddings with HDBSCAN
     This will produce a variety of clusters
     Each face in the cluster may be labeled
         - If so, assign each face in the cluster to the closest manually-labeled face in that cluster
         - Otherwise, create a new anonymous person and assign all faces in the cluster to that person
+
+    All face and person state is loaded up front, assignments are computed in memory,
+    and the changes are applied in one transaction
     """
 
     init()
+    eps = CLUSTER_EPS
 
+    start = time.time()
     with Session(get_engine()) as session:
-        embeddings, face_ids = all_embeddings(session)
-        log(f"clustering {len(embeddings)} faces...")
-
-        start = time.time()
-        X = np.array(embeddings)
-
-        # eps = 0.44
-        eps = 0.38
-        # min_samples = 3
-        min_samples = 1
-
-        # clustering = DBSCAN(eps=eps, min_samples=min_samples, metric="euclidean").fit(X)
-        clustering = HDBSCAN(min_cluster_size=2, metric="euclidean").fit(X)
-        elapsed = time.time() - start
-        log(f"clustering took {elapsed:.2f}s")
-
-        start = time.time()
-        clusters = {}
-        for xi, cluster_id in enumerate(clustering.labels_):
-            if cluster_id not in clusters:
-                clusters[cluster_id] = []
-            clusters[cluster_id].append(xi)
-        log(f"processing {len(clusters)} clusters...")
-
-        for cluster_id, xis in clusters.items():
-            if cluster_id == -1:
-                # this "cluster" is noise, meaning the face couldn't be clustered at all
-                # treat each of these like their own cluster of 1
-                for xi in xis:
-                    face_id = face_ids[xi]
-
-                    # check if this face is has is already in an automatically-assigned person by itself
-                    face = session.scalars(
-                        select(Face)
-                        .where(Face.id == face_id)
-                        .where(Face.person_source == PERSON_SOURCE_AUTOMATIC)
-                    ).one_or_none()
-                    if face:
-                        other_faces = session.scalars(
-                            select(Face)
-                            .where(Face.person_id == face.person_id)
-                            .where(Face.person_id != None)
-                            .where(Face.id != face_id)
-                        ).all()
-
-                        if (
-                            not other_faces
-                            and face.person_source == PERSON_SOURCE_AUTOMATIC
-                        ):
-                            # already its own one-face cluster
-                            continue
-                        else:
-                            anon_person_id = new_person("")
-                            log(
-                                f"created anonymous person={anon_person_id} for noise face"
-                            )
-
-                            set_face_person(
-                                face_id, anon_person_id, PERSON_SOURCE_AUTOMATIC
-                            )
-                continue
+        X, face_ids = all_embeddings(session)
+
+        # person and source of every clustered face, in the same order as X
+        state = {
+            face_id: (person_id, person_source)
+            for face_id, person_id, person_source in session.execute(
+                select(Face.id, Face.person_id, Face.person_source)
+                .where(Face.embedding_bytes != None)
+                .where(Face.hidden == 0)
+            )
+        }
+        person_ids = np.array(
+            [-1 if state[f][0] is None else state[f][0] for f in face_ids],
+            dtype=np.int64,
+        )
+        sources = np.array(
+            [0 if state[f][1] is None else state[f][1] for f in face_ids],
+            dtype=np.int64,
+        )
 
-            cluster_manual_faces = []
-            cluster_auto_faces = []
-            cluster_no_faces = []
-            cluster_nomanual_faces = []
+        # number of faces (hidden or not) of each person
+        face_counts = dict(
+            session.execute(
+                select(Face.person_id, func.count(Face.id))
+                .where(Face.person_id != None)
+                .group_by(Face.person_id)
+            ).all()
+        )
+    log(f"loading {len(face_ids)} faces took {time.time() - start:.2f}s")
+
+    if not face_ids:
+        return
+
+    start = time.time()
+    log(f"clustering {len(face_ids)} faces...")
+    # clustering = DBSCAN(eps=eps, min_samples=min_samples, metric="euclidean").fit(X)
+    clustering = HDBSCAN(min_cluster_size=2, metric="euclidean").fit(X)
+    log(f"clustering took {time.time() - start:.2f}s")
+
+    start = time.time()
+    labels = clustering.labels_
+    order = np.argsort(labels, kind="stable")
+    cluster_ids, first = np.unique(labels[order], return_index=True)
+    clusters = np.split(order, first[1:])
+    log(f"processing {len(clusters)} clusters...")
+
+    changes = {}  # xi -> person id, or negative placeholder for a new anonymous person
+    new_people = 0
+    for cluster_id, xis in zip(cluster_ids, clusters):
+        if cluster_id == -1:
+            # this "cluster" is noise, meaning the face couldn't be clustered at all
+            # treat each of these like their own cluster of 1:
+            # an automatically-labeled face that shares its person gets a new anonymous person
             for xi in xis:
-                face = session.scalars(
-                    select(Face).where(Face.id == face_ids[xi])
-                ).one()
-                person_id, person_source = face.person_id, face.person_source
-                if person_source == PERSON_SOURCE_MANUAL:
-                    cluster_manual_faces.append((xi, person_id))
-                elif person_source == PERSON_SOURCE_AUTOMATIC:
-                    cluster_auto_faces.append((xi, person_id))
-                    cluster_nomanual_faces.append((xi, person_id))
-                else:
-                    cluster_no_faces.append((xi, person_id))
-                    cluster_nomanual_faces.append((xi, person_id))
-
-            # print(cluster_manual_faces)
-
-            # label each not manually-labeled face in the cluster to the closest labeled face in the cluster
-            if cluster_manual_faces:
-                if cluster_nomanual_faces:
-                    # prepare to query which manually labeled neighbor is closest
-                    manual_X = X[[xi for xi, _ in cluster_manual_faces], :]
-                    neigh = NearestNeighbors(n_neighbors=1, metric="euclidean").fit(
-                        manual_X
-                    )
+                if sources[xi] != PERSON_SOURCE_AUTOMATIC:
+                    continue
+                if face_counts.get(int(person_ids[xi]), 0) > 1:
+                    new_people += 1
+                    changes[xi] = -new_people
+            continue
+
+        manual = xis[sources[xis] == PERSON_SOURCE_MANUAL]
+        auto = xis[sources[xis] == PERSON_SOURCE_AUTOMATIC]
+
+        if len(manual):
+            # label each not manually-labeled face to the closest manually-labeled face
+            targets = xis[sources[xis] != PERSON_SOURCE_MANUAL]
+            references = manual
+        elif len(auto):
+            # label each unlabeled face to the closest automatically-labeled face
+            targets = xis[sources[xis] == 0]
+            references = auto
+        else:
+            # create a new anonymous person for the whole cluster
+            new_people += 1
+            for xi in xis:
+                changes[xi] = -new_people
+            continue
+
+        if not len(targets):
+            continue
+        nearest, dists = _nearest(X, targets, references)
+        nearest_people = person_ids[references[nearest]]
+        for xi, nearest_person, dist in zip(targets, nearest_people, dists):
+            if nearest_person < 0:
+                continue  # labeled source, but no person
+            if dist <= eps and person_ids[xi] != nearest_person:
+                changes[xi] = int(nearest_person)
+    log(
+        f"assigning {len(changes)} faces, {new_people} new people took {time.time() - start:.2f}s"
+    )
 
-                    # relabel all non-manual faces
-                    tup = neigh.kneighbors(
-                        X[[xi for xi, _ in cluster_nomanual_faces], :]
-                    )
-                    dists = tup[0]
-                    nears = tup[1]
-
-                    for dist, near, (face_xi, current_person_id) in zip(
-                        dists, nears, cluster_nomanual_faces
-                    ):
-                        nearest_person = cluster_manual_faces[near[0]][1]
-                        nearest_dist = dist[0]
-
-                        if nearest_dist <= eps:
-                            if current_person_id != nearest_person:
-                                log(
-                                    f"update unlabeled or auto-labeled from {current_person_id} to {nearest_person}"
-                                )
-                                set_face_person(
-                                    face_ids[face_xi],
-                                    nearest_person,
-                                    PERSON_SOURCE_AUTOMATIC,
-                                )
-            elif cluster_auto_faces:
-                if cluster_no_faces:
-                    # prepare to query which automatically labeled neighbor is closest
-                    auto_X = X[[xi for xi, _ in cluster_auto_faces], :]
-                    neigh = NearestNeighbors(n_neighbors=1, metric="euclidean").fit(
-                        auto_X
-                    )
+    start = time.time()
 
-                    # get label for all unlabeled
-                    tup = neigh.kneighbors(X[[xi for xi, _ in cluster_no_faces], :])
-                    dists = tup[0]
-                    nears = tup[1]
-
-                    for dist, near, (face_xi, current_person_id) in zip(
-                        dists, nears, cluster_no_faces
-                    ):
-                        nearest_person = cluster_auto_faces[near[0]][1]
-                        nearest_dist = dist[0]
-
-                        if nearest_dist <= eps:
-                            if current_person_id != nearest_person:
-                                print(
-                                    f"update unlabeled xi={xi} from {current_person_id} to {nearest_person}"
-                                )
-                                set_face_person(
-                                    face_ids[face_xi],
-                                    nearest_person,
-                                    PERSON_SOURCE_AUTOMATIC,
-                                )
-            else:
-                # print(f"no labeled faces in cluster {cluster_id}")
-
-                # create a new anonymous person
-                anon_person_id = new_person("")
+    def apply(session: Session):
+        people = [Person(name="") for _ in range(new_people)]
+        session.add_all(people)
+        session.flush()
+        for xi, person_id in changes.items():
+            if person_id < 0:
                 log(
-                    f"created anonymous person={anon_person_id} for unlabeled face cluster"
+                    f"face {face_ids[xi]}: created anonymous person={people[-person_id - 1].id}"
                 )
+        rows = [
+            {
+                "id": face_ids[xi],
+                "person_id": (
+                    people[-person_id - 1].id if person_id < 0 else person_id
+                ),
+                "person_source": PERSON_SOURCE_AUTOMATIC,
+            }
+            for xi, person_id in changes.items()
+        ]
+        for chunk in _chunks([row["id"] for row in rows]):
+            before = session.execute(
+                select(Face.image_id, Face.person_id).where(Face.id.in_(chunk))
+            ).all()
+            titles_changed(session, [image_id for image_id, _ in before])
+            people_changed(session, [person_id for _, person_id in before])
+        people_changed(session, [row["person_id"] for row in rows])
+        session.execute(update(Face), rows)
 
-                # label all faces in the cluster as that person
-                for xi in xis:
-                    set_face_person(
-                        face_ids[xi], anon_person_id, PERSON_SOURCE_AUTOMATIC
-                    )
-
-        elapsed = time.time() - start
-        log(f"processing took {elapsed:.2f}s")
+    if changes:
+        get_writer().call(apply)
+    log(f"applying changes took {time.time() - start:.2f}s")
 
+    start = time.time()
+    with Session(get_engine()) as session:
         remove_empty_people(session)
+    log(f"removing empty people took {time.time() - start:.2f}s")
+
+
+def _chunks(values, size: int = 10000):
+    """split values into lists small enough to use as SQL IN parameters"""
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start : start + size]
+
+
+def _within_eps(X: npt.NDArray, visible: npt.NDArray, queries: npt.NDArray) -> list:
+    """
+    for each row of `queries`, the (distance, row) of every visible row of X within CLUSTER_EPS,
+    nearest first
+    """
+
+    neighbors = [[] for _ in range(len(queries))]
+    queries_sq = np.sum(queries * queries, axis=1)[:, None]
+    chunk = 65536
+    for start in range(0, len(X), chunk):
+        block = np.asarray(X[start : start + chunk], dtype=np.float32)
+        # |q - b|^2 = |q|^2 + |b|^2 - 2 q.b, shape (n_queries, chunk)
+        sq = queries_sq + np.sum(block * block, axis=1)[None, :] - 2 * queries @ block.T
+        dists = np.sqrt(np.maximum(sq, 0))
+        dists[:, ~visible[start : start + chunk]] = np.inf
+        qis, bis = np.nonzero(dists <= CLUSTER_EPS)
+        for qi, bi in zip(qis, bis):
+            neighbors[qi] += [(float(dists[qi, bi]), start + int(bi))]
+    return [sorted(n) for n in neighbors]
+
+
+def assign_faces(face_ids: list = None) -> int:
+    """
+    Incrementally label faces without re-clustering the whole library
+
+    `face_ids` are faces that are new, or whose label or visibility just changed.
+    If None, all visible faces with an embedding and no person are used.
+
+    The affected faces are `face_ids`, plus any faces within CLUSTER_EPS of them.
+    Each affected face that was not manually labeled is assigned to the person of its nearest
+    manually-labeled neighbor within CLUSTER_EPS, or if there is none, of its nearest labeled
+    neighbor. People in the face's excluded_people are never chosen. A face with no labeled
+    neighbor gets its own anonymous person, as update_labels does for noise.
+
+    returns the number of faces whose person changed
+    """
+
+    init()
+    start = time.time()
+
+    def finish(changed: int, touched: set) -> int:
+        """remove the people that the faces changed or hidden may have left empty"""
+        with Session(get_engine()) as session:
+            # including people left empty by a manual change, whose faces may not be here
+            touched.update(
+                session.scalars(
+                    select(PersonStats.person_id).where(PersonStats.face_count == 0)
+                )
+            )
+            touched.discard(None)
+            if touched:
+                remove_empty_people(session, list(touched))
+        log(f"assign_faces took {time.time() - start:.2f}s")
+        return changed
+
+    with Session(get_engine()) as session:
+        if face_ids is None:
+            face_ids = session.scalars(
+                select(Face.id)
+                .where(Face.embedding_bytes != None)
+                .where(Face.hidden == 0)
+                .where(Face.person_id == None)
+            ).all()
+        if not face_ids:
+            return 0
+
+        # the seeds' people, which a seed that was hidden or relabeled may have left empty
+        seed_people = set()
+        for chunk in _chunks(face_ids):
+            seed_people.update(
+                session.scalars(select(Face.person_id).where(Face.id.in_(chunk)))
+            )
+
+        # the store includes hidden faces, so seeds that were just hidden can be found
+        all_embeddings(session, include_hidden=True)  # append anything missing
+        X, ids = EMBEDDINGS.load()
+        visible = np.isin(ids, embedding_face_ids(session), assume_unique=True)
+        row_of = {face_id: i for i, face_id in enumerate(ids.tolist())}
+
+        seeds = [row_of[face_id] for face_id in face_ids if face_id in row_of]
+        if not seeds:
+            return finish(0, seed_people)
+
+        # faces near the seeds may have been labeled because of them
+        neighbors = _within_eps(X, visible, np.asarray(X[seeds], dtype=np.float32))
+        affected = set(seeds)
+        for ns in neighbors:
+            affected |= {row for _, row in ns}
+        affected = sorted(row for row in affected if visible[row])
+        if not affected:
+            return finish(0, seed_people)
+
+        neighbors = _within_eps(X, visible, np.asarray(X[affected], dtype=np.float32))
+
+        # only load the faces involved
+        involved = set(affected)
+        for ns in neighbors:
+            involved |= {row for _, row in ns}
+        state = {}
+        for chunk in _chunks([int(ids[row]) for row in involved]):
+            rows = session.execute(
+                select(
+                    Face.id, Face.person_id, Face.person_source, Face.excluded_people
+                ).where(Face.id.in_(chunk))
+            ).all()
+            for face_id, person_id, person_source, excluded_people in rows:
+                state[face_id] = (person_id, person_source, excluded_people)
+
+        # how many faces each involved person has, to tell whether a face is alone
+        counts = {}
+        for chunk in _chunks({p for p, _, _ in state.values() if p is not None}):
+            counts.update(
+                session.execute(
+                    select(Face.person_id, func.count(Face.id))
+                    .where(Face.person_id.in_(chunk))
+                    .group_by(Face.person_id)
+                ).all()
+            )
+
+    # faces are assigned one at a time, so later faces see earlier assignments.
+    # new anonymous people get negative placeholder ids until they are created
+    changes = {}  # face id -> person id
+    new_people = 0
+    for row, ns in zip(affected, neighbors):
+        face_id = int(ids[row])
+        person_id, person_source, excluded_people = state[face_id]
+        if person_source == PERSON_SOURCE_MANUAL:
+            continue
+        excluded = set(json.loads(excluded_people)) if excluded_people else set()
+
+        candidates = []
+        for _, n_row in ns:
+            n_id = int(ids[n_row])
+            if n_id == face_id:
+                continue
+            n_person_id, n_source, _ = state[n_id]
+            if n_person_id is None or n_person_id in excluded:
+                continue
+            candidates += [(n_source != PERSON_SOURCE_MANUAL, n_person_id)]
+
+        if candidates:
+            # sorting is stable, so this is the nearest manual label, then the nearest other
+            nearest_person = sorted(candidates, key=lambda c: c[0])[0][1]
+        elif person_id is None or counts.get(person_id, 0) > 1:
+            new_people += 1
+            nearest_person = -new_people
+        else:
+            continue  # already alone in its own person
+
+        if nearest_person != person_id:
+            changes[face_id] = nearest_person
+            state[face_id] = (nearest_person, PERSON_SOURCE_AUTOMATIC, excluded_people)
+            if person_id is not None:
+                counts[person_id] -= 1
+            counts[nearest_person] = counts.get(nearest_person, 0) + 1
+
+    log(f"assigning {len(changes)} of {len(affected)} affected faces")
+
+    def apply(session: Session) -> list:
+        touched = set()
+        created = {}  # placeholder -> person id
+        for face_id, person_id in changes.items():
+            face = session.get(Face, face_id)
+            touched.add(face.person_id)
+            if person_id < 0:
+                if person_id not in created:
+                    person = Person(name="")
+                    session.add(person)
+                    session.flush()
+                    created[person_id] = person.id
+                    log(f"created anonymous person={person.id} for face {face_id}")
+                person_id = created[person_id]
+            log(f"model.assign_faces: set face {face_id} to person {person_id}")
+            face.person_id = person_id
+            face.person_source = PERSON_SOURCE_AUTOMATIC
+        touched.discard(None)
+        return list(touched)
+
+    touched = get_writer().call(apply)
+    return finish(len(changes), seed_people | set(touched))
+
+
+def known_file_hashes(session: Session, file_hashes: list) -> set:
+    """the subset of `file_hashes` that are already in the catalog"""
+    known = set()
+    for chunk in _chunks(set(file_hashes)):
+        known |= set(
+            session.scalars(select(Image.file_hash).where(Image.file_hash.in_(chunk)))
+        )
+    return known
 
 
 def add_original(image_path) -> int:
@@ -711,18 +1539,18 @@ def add_original(image_path) -> int:
         if img is not None:
             log(f"{image_path} image data already present as image {img.id}")
         else:
-            # copy file to IMAGES_DIR
+            from gallery import storage  # imports this module
+
+            # store file in IMAGES_DIR according to config.STORAGE_MODE
             dst_name = Path(f"{img_hash[0:2]}") / f"{img_hash[0:8]}{image_path.suffix}"
             dst_path = IMAGES_DIR / dst_name
             dst_path.parent.mkdir(exist_ok=True, parents=True)
             log(f"{image_path} -> {dst_path}")
-            shutil.copyfile(image_path, dst_path)
+            mode = storage.store(image_path, dst_path, cfg.STORAGE_MODE)
 
             width, height = pil_img.size
 
-            comment = pil_img.info["comment"]
-            if isinstance(comment, bytes):
-                comment = comment.decode("utf-8")
+            comment = image_comment(pil_img)
 
             img = Image(
                 file_name=str(dst_name),
@@ -730,8 +1558,13 @@ def add_original(image_path) -> int:
                 height=height,
                 width=width,
                 image_hash=img_hash,
+                hash_version=utils.IMAGE_HASH_VERSION,
+                dhash=utils.dhash(pil_img),
                 file_hash=file_hash,
                 comment=comment,
+                original_path=(
+                    str(image_path.resolve()) if mode == "reference" else None
+                ),
             )
             session.add(img)
             session.commit()
@@ -783,41 +1616,286 @@ def incremental_index():
     writer.commit()
 
 
-def get_image_title(session: Session, image_id: int) -> str:
+def resolve_titles(session: Session, image_ids) -> dict:
     """
-    Return a title for an image
+    Return a title for each image, as {image id: title}, in a few queries however many
+    images there are
     1. The title field, if it's set
     2. The name of the person in the image
       2. a. if there is only one person and that person has a name
     3. The original file name
     """
+    image_ids = list(set(image_ids))
+    images = {}  # id -> (title, original name)
+    people = {}  # image id -> person ids
+    for chunk in _chunks(image_ids):
+        for id, title, original_name in session.execute(
+            select(Image.id, Image.title, Image.original_name).where(
+                Image.id.in_(chunk)
+            )
+        ):
+            images[id] = (title, original_name)
+        for image_id, person_id in session.execute(
+            select(Face.image_id, Face.person_id)
+            .where(Face.image_id.in_(chunk))
+            .where(Face.person_id != None)
+            .distinct()
+        ):
+            people.setdefault(image_id, set()).add(person_id)
+
+    single = {next(iter(ids)) for ids in people.values() if len(ids) == 1}
+    names = {}
+    for chunk in _chunks(list(single)):
+        names.update(
+            session.execute(
+                select(Person.id, Person.name).where(Person.id.in_(chunk))
+            ).all()
+        )
+
+    titles = {}
+    for id, (title, original_name) in images.items():
+        ids = people.get(id, set())
+        if title != "" and title is not None:
+            titles[id] = title
+        elif len(ids) == 1 and names.get(next(iter(ids))):
+            titles[id] = names[next(iter(ids))]
+        else:
+            titles[id] = original_name
+    return titles
+
+
+def get_image_titles(session: Session, images: list) -> list:
+    """the title of each of `images` (Image rows), see resolve_titles"""
+    missing = [image.id for image in images if image.display_title is None]
+    resolved = resolve_titles(session, missing) if missing else {}
+    return [
+        image.display_title if image.display_title is not None else resolved[image.id]
+        for image in images
+    ]
+
+
+def get_image_title(session: Session, image_id: int) -> str:
+    """Return a title for an image, see resolve_titles"""
+    image = session.get(Image, image_id)
+    return get_image_titles(session, [image])[0]
+
+
+def refresh_titles(session: Session, image_ids) -> int:
+    """store the current title of each image as Image.display_title"""
+    titles = resolve_titles(session, image_ids)
+    if titles:
+        session.execute(
+            update(Image),
+            [{"id": id, "display_title": title} for id, title in titles.items()],
+        )
+    return len(titles)
+
+
+def titles_changed(session: Session, image_ids=(), person_ids=()):
+    """
+    the titles of `image_ids`, and of the images of `person_ids`, are refreshed when
+    `session` commits
+
+    changes to Face.person_id, Person.name, and Image.title made through the ORM are found
+    by themselves (see _track_titles). bulk statements that change them call this first
+    """
+    session.info.setdefault("title_images", set()).update(image_ids)
+    session.info.setdefault("title_people", set()).update(person_ids)
+
+
+def _attribute_changed(obj, *keys) -> bool:
+    state = inspect(obj)
+    return any(state.attrs[key].history.has_changes() for key in keys)
+
+
+@event.listens_for(Session, "after_flush")
+def _track_titles(session: Session, flush_context):
+    if session.bind is not ENGINE:
+        return
+    image_ids, person_ids = set(), set()
+    for obj in [*session.new, *session.dirty, *session.deleted]:
+        if isinstance(obj, Face):
+            if obj in session.new and obj.person_id is None:
+                continue  # e.g. just detected
+            if obj in session.dirty and not _attribute_changed(
+                obj, "person_id", "person"
+            ):
+                continue
+            image_ids.add(obj.image_id)
+        elif isinstance(obj, Person) and obj in session.dirty:
+            if _attribute_changed(obj, "name"):
+                person_ids.add(obj.id)
+        elif isinstance(obj, Image) and obj not in session.deleted:
+            if obj in session.new and obj.display_title is not None:
+                continue  # e.g. ingest, which sets it
+            if obj.display_title is None or _attribute_changed(
+                obj, "title", "original_name"
+            ):
+                image_ids.add(obj.id)
+    image_ids.discard(None)
+    if image_ids or person_ids:
+        titles_changed(session, image_ids, person_ids)
+
+
+@event.listens_for(Session, "before_commit")
+def _refresh_titles(session: Session):
+    if session.bind is not ENGINE:
+        return
+    session.flush()  # commit flushes after this, so find the changes now
+    if not (session.info.get("title_images") or session.info.get("title_people")):
+        return
+    image_ids = session.info.pop("title_images", set())
+    person_ids = session.info.pop("title_people", set())
+    for chunk in _chunks(list(person_ids)):
+        image_ids.update(
+            session.scalars(select(Face.image_id).where(Face.person_id.in_(chunk)))
+        )
+    refresh_titles(session, image_ids)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_titles(session: Session):
+    session.info.pop("title_images", None)
+    session.info.pop("title_people", None)
+
+
+def refresh_person_stats(session: Session, person_ids) -> int:
+    """store the PersonStats of each of `person_ids`, removing those of deleted people"""
+    person_ids = list(set(person_ids))
+    n = 0
+    for chunk in _chunks(person_ids):
+        rows = session.execute(
+            select(
+                Person.id,
+                Person.name,
+                func.count(Face.id),
+                func.count(distinct(Face.image_id)),
+                func.min(Face.id),
+                func.max(Image.created_at),
+            )
+            .select_from(Person)
+            .outerjoin(Face, and_(Face.person_id == Person.id, Face.hidden == 0))
+            .outerjoin(Image, Image.id == Face.image_id)
+            .where(Person.id.in_(chunk))
+            .group_by(Person.id)
+        ).all()
+        session.execute(delete(PersonStats).where(PersonStats.person_id.in_(chunk)))
+        if rows:
+            session.execute(
+                insert(PersonStats),
+                [
+                    {
+                        "person_id": id,
+                        "named": bool(name),
+                        "face_count": face_count,
+                        "image_count": image_count,
+                        "thumb_face_id": thumb_face_id,
+                        "last_seen": last_seen,
+                    }
+                    for id, name, face_count, image_count, thumb_face_id, last_seen in rows
+                ],
+            )
+        n += len(rows)
+    return n
 
-    image = session.scalars(select(Image).where(Image.id == image_id)).one()
 
-    # return title if set
-    if image.title != "" and image.title is not None:
-        return image.title
+def people_changed(session: Session, person_ids):
+    """
+    the PersonStats of `person_ids` are refreshed when `session` commits
+
+    labeling, hiding, naming, and deleting faces or people through the ORM are found by
+    themselves (see _track_people). bulk statements that do those call this first
+    """
+    session.info.setdefault("stats_people", set()).update(person_ids)
+
+
+def _history_ids(obj, key: str) -> set:
+    """ids in the current and previous values of attribute `key` of `obj`"""
+    history = inspect(obj).attrs[key].history
+    values = [*history.added, *history.unchanged, *history.deleted]
+    ids = {getattr(v, "id", v) for v in values}
+    return {id for id in ids if isinstance(id, int)}
+
+
+@event.listens_for(Session, "after_flush")
+def _track_people(session: Session, flush_context):
+    if session.bind is not ENGINE:
+        return
+    person_ids = set()
+    for obj in [*session.new, *session.dirty, *session.deleted]:
+        if isinstance(obj, Face):
+            if obj in session.dirty and not _attribute_changed(
+                obj, "person_id", "person", "hidden"
+            ):
+                continue
+            person_ids |= _history_ids(obj, "person_id") | _history_ids(obj, "person")
+        elif isinstance(obj, Person):
+            if obj in session.dirty and not _attribute_changed(obj, "name"):
+                continue
+            person_ids.add(obj.id)
+    person_ids.discard(None)
+    if person_ids:
+        people_changed(session, person_ids)
 
-    people_ids = [face.person_id for face in image.faces if face.person_id is not None]
-    people_ids = list(set(people_ids))  # uniquify
 
-    if len(people_ids) == 1:
-        person = session.scalars(select(Person).where(Person.id == people_ids[0])).one()
-        if person.name:
-            return person.name
+@event.listens_for(Session, "before_commit")
+def _refresh_people(session: Session):
+    if session.bind is not ENGINE:
+        return
+    session.flush()
+    person_ids = session.info.pop("stats_people", set())
+    if person_ids:
+        refresh_person_stats(session, person_ids)
 
-    return image.original_name
 
+@event.listens_for(Session, "after_rollback")
+def _forget_people(session: Session):
+    session.info.pop("stats_people", None)
 
-def merge_people(session: Session, a: Person, b: Person) -> None:
+
+def get_people_page(session: Session, named: bool, offset: int, limit: int) -> list:
+    """
+    people with unhidden faces, most faces first, as dicts with "id", "name", "count"
+    (faces), "images", "last_seen", and "thumb_face" (a Face, with its Image loaded)
+    """
+    stats = session.scalars(
+        select(PersonStats)
+        .where(PersonStats.named == named)
+        .where(PersonStats.face_count > 0)
+        .order_by(PersonStats.face_count.desc(), PersonStats.person_id)
+        .offset(offset)
+        .limit(limit)
+        .options(
+            selectinload(PersonStats.person),
+            selectinload(PersonStats.thumb_face).selectinload(Face.image),
+        )
+    ).all()
+    return [
+        {
+            "id": s.person_id,
+            "name": s.person.name,
+            "count": s.face_count,
+            "images": s.image_count,
+            "last_seen": s.last_seen,
+            "thumb_face": s.thumb_face,
+        }
+        for s in stats
+    ]
+
+
+def merge_people(session: Session, a: Person, b: Person) -> list:
     """
     merge b into a
+
+    returns the ids of the faces that moved from b to a, which should be re-labeled
+    (see model.assign_faces)
     """
 
     log(f"model.merge_people: merge {b.id} -> {a.id}")
 
     # replace all Face.person == b with a
-    b_faces = session.scalars(select(Face).where(Face.person == b))
+    b_faces = session.scalars(select(Face).where(Face.person == b)).all()
+    merged_face_ids = [face.id for face in b_faces]
     for face in b_faces:
         face.person = a
 
@@ -826,4 +1904,4 @@ def merge_people(session: Session, a: Person, b: Person) -> None:
     session.delete(b)
     session.commit()
 
-    update_labels()
+    return merged_face_ids
@@ -0,0 +1,166 @@
+"""
+Background scheduler for face labeling
+
+Routes that change faces call mark_dirty() with the faces they touched instead of labeling
+inline. Triggers are coalesced: once no new trigger has arrived for `quiet` seconds, all the
+pending faces are labeled in a single model.assign_faces() pass on the scheduler's thread.
+
+A full re-cluster (model.update_labels) runs when requested with recluster_now(), and every
+`interval` seconds if `interval` is non-zero.
+
+Each process has its own scheduler, started on first use.
+"""
+
+import threading
+import time
+
+from gallery import model
+from gallery import config
+
+
+class ReclusterScheduler:
+    def __init__(self, quiet: float, interval: float):
+        """
+        `quiet`: seconds without a new trigger before pending faces are labeled
+        `interval`: seconds between scheduled full re-clusters, or 0 for none
+        """
+        self.quiet = quiet
+        self.interval = interval
+
+        self._cv = threading.Condition()
+        self._pending = set()  # face ids to assign
+        self._pending_unassigned = False  # also assign every face without a person
+        self._full_requested = False
+        self._last_trigger = None
+        self._thread = None
+
+        self.running = None  # "incremental" or "full" while a pass is running
+        self.runs = 0
+        self.coalesced = 0  # triggers folded into an earlier pass
+        self.last_started = None
+        self.last_kind = None
+        self.last_seconds = None
+        self.last_error = None
+        self.last_full = time.time()
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="recluster", daemon=True
+            )
+            self._thread.start()
+
+    def mark_dirty(self, face_ids: list = None):
+        """
+        label `face_ids` soon. If None, label any faces that don't have a person
+        """
+        with self._cv:
+            self._start()
+            if self._pending or self._pending_unassigned:
+                self.coalesced += 1
+            if face_ids is None:
+                self._pending_unassigned = True
+            else:
+                self._pending |= set(face_ids)
+            self._last_trigger = time.time()
+            self._cv.notify()
+
+    def recluster_now(self):
+        """run a full re-cluster as soon as any current pass finishes"""
+        with self._cv:
+            self._start()
+            self._full_requested = True
+            self._cv.notify()
+
+    def status(self) -> dict:
+        with self._cv:
+            return {
+                "dirty": bool(self._pending or self._pending_unassigned),
+                "pending_faces": len(self._pending),
+                "pending_unassigned": self._pending_unassigned,
+                "full_requested": self._full_requested,
+                "running": self.running,
+                "runs": self.runs,
+                "coalesced": self.coalesced,
+                "last_started": self.last_started,
+                "last_kind": self.last_kind,
+                "last_seconds": self.last_seconds,
+                "last_error": self.last_error,
+                "last_full": self.last_full,
+                "quiet": self.quiet,
+                "interval": self.interval,
+            }
+
+    def _next(self):
+        """wait for work. returns ("full", None) or ("incremental", (face_ids, unassigned))"""
+        with self._cv:
+            while True:
+                now = time.time()
+                if self._full_requested or (
+                    self.interval and now - self.last_full >= self.interval
+                ):
+                    self._full_requested = False
+                    self._pending = set()
+                    self._pending_unassigned = False
+                    return "full", None
+
+                timeout = None
+                if self.interval:
+                    timeout = self.last_full + self.interval - now
+                if self._pending or self._pending_unassigned:
+                    due = self._last_trigger + self.quiet
+                    if now >= due:
+                        work = (list(self._pending), self._pending_unassigned)
+                        self._pending = set()
+                        self._pending_unassigned = False
+                        return "incremental", work
+                    timeout = due - now if timeout is None else min(timeout, due - now)
+                self._cv.wait(timeout)
+
+    def _run(self):
+        while True:
+            kind, work = self._next()
+
+            with self._cv:
+                self.running = kind
+                self.last_started = time.time()
+            model.log(f"start {kind} labeling pass", component="scheduler")
+
+            error = None
+            try:
+                if kind == "full":
+                    model.update_labels()
+                else:
+                    face_ids, unassigned = work
+                    if face_ids:
+                        model.assign_faces(face_ids)
+                    if unassigned:
+                        model.assign_faces()
+            except Exception as e:
+                error = f"{e}"
+                model.log(f"{kind} labeling pass failed: {e}", component="scheduler")
+
+            with self._cv:
+                self.running = None
+                self.runs += 1
+                self.last_kind = kind
+                self.last_seconds = time.time() - self.last_started
+                self.last_error = error
+                if kind == "full":
+                    self.last_full = time.time()
+            model.log(
+                f"{kind} labeling pass took {self.last_seconds:.2f}s",
+                component="scheduler",
+            )
+
+
+SCHEDULER = None
+
+
+def get_scheduler() -> ReclusterScheduler:
+    global SCHEDULER
+    if SCHEDULER is None:
+        SCHEDULER = ReclusterScheduler(
+            config.RECLUSTER_QUIET_SECONDS, config.RECLUSTER_INTERVAL_SECONDS
+        )
+    return SCHEDULER
@@ -1,4 +1,6 @@
 from pathlib import Path
+import multiprocessing
+import asyncio
 
 from sanic import Sanic
 
@@ -7,24 +9,37 @@ from gallery.server.routes import (
     root,
     delete_image,
     delete_person,
+    duplicates,
+    face,
     gallery,
+    have,
     hide_face,
     image,
+    jobs as jobs_routes,
     label_one,
     label_many,
     label,
     logs,
     name_person,
     new_people,
+    page_cache,
     people,
     person,
+    recluster,
     rescan_originals,
     search,
     settings,
+    thumb,
     upload,
 )
 from gallery import model
 from gallery import config
+from gallery import workers
+from gallery import jobs
+from gallery import watch
+from gallery import thumbs
+from gallery import crops
+from gallery.server import caching
 
 model.init()
 
@@ -34,27 +49,122 @@ if hasattr(app.config, "ORIGINALS_DIR"):
     config.update(originals_dir=app.config.ORIGINALS_DIR)
 if hasattr(app.config, "CACHE_DIR"):
     config.update(cache_dir=app.config.CACHE_DIR)
+if hasattr(app.config, "RECLUSTER_QUIET"):
+    config.update(recluster_quiet=app.config.RECLUSTER_QUIET)
+if hasattr(app.config, "RECLUSTER_INTERVAL"):
+    config.update(recluster_interval=app.config.RECLUSTER_INTERVAL)
+if hasattr(app.config, "DETECTION_MAX_SIZE"):
+    config.update(detection_max_size=app.config.DETECTION_MAX_SIZE)
+if hasattr(app.config, "DETECTION_SECOND_PASS"):
+    config.update(detection_second_pass=app.config.DETECTION_SECOND_PASS)
+if hasattr(app.config, "DETECTION_TILE_SIZE"):
+    config.update(detection_tile_size=app.config.DETECTION_TILE_SIZE)
+if hasattr(app.config, "DETECTION_TILE_WORKERS"):
+    config.update(detection_tile_workers=app.config.DETECTION_TILE_WORKERS)
+if hasattr(app.config, "WORKER_PROCESSES"):
+    config.update(worker_processes=app.config.WORKER_PROCESSES)
+if hasattr(app.config, "NEAR_DUPLICATE_POLICY"):
+    config.update(near_duplicate_policy=app.config.NEAR_DUPLICATE_POLICY)
+if hasattr(app.config, "NEAR_DUPLICATE_DISTANCE"):
+    config.update(near_duplicate_distance=app.config.NEAR_DUPLICATE_DISTANCE)
+if hasattr(app.config, "STORAGE_MODE"):
+    config.update(storage_mode=app.config.STORAGE_MODE)
+if hasattr(app.config, "THUMBS_AT_INGEST"):
+    config.update(thumbs_at_ingest=app.config.THUMBS_AT_INGEST)
+if hasattr(app.config, "FACE_CACHE_MB"):
+    config.update(face_cache_mb=app.config.FACE_CACHE_MB)
+if hasattr(app.config, "UPLOAD_MAX_MB"):
+    config.update(upload_max_mb=app.config.UPLOAD_MAX_MB)
+if hasattr(app.config, "WATCH"):
+    config.update(watch=app.config.WATCH)
+if hasattr(app.config, "WATCH_QUIET"):
+    config.update(watch_quiet=app.config.WATCH_QUIET)
+if hasattr(app.config, "WATCH_POLL"):
+    config.update(watch_poll=app.config.WATCH_POLL)
+
+
+@app.main_process_start
+async def single_process(app):
+    # only runs when Sanic manages worker processes. The job loop, watcher, recluster
+    # scheduler, catalog writer, and page cache belong to the one process serving requests,
+    # so each worker would run its own
+    if app.state.workers > 1:
+        model.log(
+            f"serving from 1 worker instead of {app.state.workers}, "
+            "use sanic --single-process",
+            component="server",
+        )
+        app.state.workers = 1
+
+
+@app.after_server_start
+async def start_workers(app):
+    # a worker managed by Sanic is a daemon process, which may not start the pool
+    multiprocessing.current_process().daemon = False
+    # pay for process startup and model loading before the first upload
+    workers.get_pool()
+    app.add_task(jobs.run_jobs(app), name="jobs")
+    # crops of named people are shown most, have them ready
+    asyncio.get_running_loop().run_in_executor(None, crops.prewarm)
+
+    if config.WATCH and config.ORIGINALS_DIR:
+        app.ctx.watcher = watch.Watcher(
+            config.ORIGINALS_DIR,
+            lambda paths: jobs.submit("watch", {"paths": paths}),
+            quiet=config.WATCH_QUIET_SECONDS,
+            poll_interval=config.WATCH_POLL_SECONDS,
+        )
+        app.ctx.watcher.start()
+
+
+app.on_request(caching.static_request)
+app.on_response(caching.static_response)
+
+
+@app.before_server_stop
+async def stop_workers(app):
+    if getattr(app.ctx, "watcher", None):
+        app.ctx.watcher.stop()
+    workers.close()
+    thumbs.close()
+
 
 app.static("/static/css/", Path(__file__).parent / "css", name="css")
-app.static("/static/image/", model.IMAGES_DIR, name="images")
-app.static("/static/face/", model.FACES_DIR, name="faces")
+# with STORAGE_MODE "reference", IMAGES_DIR holds symlinks to the originals
+app.static(
+    "/static/image/",
+    model.IMAGES_DIR,
+    name="images",
+    follow_external_symlink_files=True,
+)
+app.static("/static/avatar/", model.AVATARS_DIR, name="avatars")
 app.blueprint(root.bp)
 app.blueprint(delete_image.bp)
 app.blueprint(delete_person.bp)
+app.blueprint(duplicates.bp)
+app.blueprint(duplicates.bp_dismiss)
+app.blueprint(face.bp)
 app.blueprint(gallery.bp)
+app.blueprint(have.bp)
 app.blueprint(hide_face.bp_hide)
 app.blueprint(hide_face.bp_unhide)
 app.blueprint(image.bp)
+app.blueprint(jobs_routes.bp_list)
+app.blueprint(jobs_routes.bp_stream)
 app.blueprint(label_one.bp)
 app.blueprint(label_many.bp)
 app.blueprint(label.bp)
 app.blueprint(logs.bp)
 app.blueprint(name_person.bp)
 app.blueprint(new_people.bp)
+app.blueprint(page_cache.bp)
 app.blueprint(people.bp)
 app.blueprint(person.bp)
+app.blueprint(recluster.bp_status)
+app.blueprint(recluster.bp_now)
 app.blueprint(rescan_originals.bp)
 app.blueprint(search.bp_get)
 app.blueprint(search.bp_post)
 app.blueprint(settings.bp)
+app.blueprint(thumb.bp)
 app.blueprint(upload.bp)
@@ -0,0 +1,155 @@
+"""
+HTTP caching
+
+* Files whose names are derived from their content (originals under /static/image/, avatar
+  atlases under /static/avatar/) never change, so they are sent with an immutable
+  Cache-Control and a strong ETag made from the name, without a stat or read.
+* Pages that only show the catalog are marked with @page. Their ETag is the catalog
+  generation (see model.generation), so a browser revalidating an unchanged page gets a 304
+  before any query runs. Rendered pages are also kept in memory, keyed by URL and
+  generation, so showing a page again does not query the catalog or render a template.
+"""
+
+from collections import OrderedDict
+import inspect
+from functools import wraps
+from pathlib import Path
+
+from sanic.response import HTTPResponse
+from sanic.request import Request
+
+from gallery import model
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+# URL prefixes of files named by their content
+HASH_NAMED = ("/static/image/", "/static/avatar/")
+
+# most rendered pages kept in memory
+PAGE_CACHE_ENTRIES = 256
+
+
+def _code_version() -> str:
+    """changes when templates or code change, so pages are not stale after an upgrade"""
+    root = Path(__file__).parent
+    files = [*root.glob("templates/*.html"), *root.glob("**/*.py")]
+    return f"{max(f.stat().st_mtime_ns for f in files):x}"
+
+
+CODE_VERSION = _code_version()
+
+
+def matches(request: Request, etag: str) -> bool:
+    """whether the request's If-None-Match includes `etag`"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return "*" in tags or etag in tags
+
+
+def not_modified(etag: str, cache_control: str) -> HTTPResponse:
+    return HTTPResponse(
+        status=304, headers={"ETag": etag, "Cache-Control": cache_control}
+    )
+
+
+def _hash_named_etag(path: str) -> str:
+    for prefix in HASH_NAMED:
+        if path.startswith(prefix):
+            return f'"{path[len(prefix):]}"'
+    return None
+
+
+def static_request(request: Request):
+    """request middleware: answer revalidation of content-named files without touching them"""
+    etag = _hash_named_etag(request.path)
+    if etag and request.method in ("GET", "HEAD") and matches(request, etag):
+        return not_modified(etag, IMMUTABLE)
+
+
+def static_response(request: Request, response: HTTPResponse):
+    """response middleware: mark content-named files as immutable"""
+    etag = _hash_named_etag(request.path)
+    if etag and response.status in (200, 206):
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = IMMUTABLE
+
+
+class PageCache:
+    """rendered pages of one catalog generation, least recently used first"""
+
+    def __init__(self, entries: int):
+        self.entries = entries
+        self.generation = None
+        self._pages = OrderedDict()  # (path, query string) -> (body, content type)
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def get(self, generation: int, key):
+        if generation != self.generation:
+            # pages of earlier generations can never be shown again
+            self._pages.clear()
+            self.generation = generation
+        page = self._pages.get(key)
+        if page is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._pages.move_to_end(key)
+        return page
+
+    def put(self, generation: int, key, page):
+        if generation != self.generation:
+            return  # the catalog changed while the page was rendered
+        self._pages[key] = page
+        while len(self._pages) > self.entries:
+            self._pages.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            "generation": self.generation,
+            "pages": len(self._pages),
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+        }
+
+
+PAGES = PageCache(PAGE_CACHE_ENTRIES)
+
+
+def page(handler):
+    """
+    for handlers of pages that only show the catalog: answer 304 if the client has the page
+    as of the current catalog generation, otherwise send it from PAGES, rendering it if
+    needed, with that generation as ETag
+    """
+
+    @wraps(handler)
+    async def wrapper(request: Request, *args, **kwargs):
+        generation = model.generation()
+        headers = {
+            "ETag": f'"{generation:x}-{CODE_VERSION}"',
+            "Cache-Control": "no-cache",  # always revalidate
+        }
+        if matches(request, headers["ETag"]):
+            PAGES.not_modified += 1
+            return not_modified(headers["ETag"], headers["Cache-Control"])
+
+        key = (request.path, request.query_string)
+        cached = PAGES.get(generation, key)
+        if cached is not None:
+            body, content_type = cached
+            return HTTPResponse(body, headers=headers, content_type=content_type)
+
+        response = handler(request, *args, **kwargs)
+        if inspect.isawaitable(response):
+            response = await response
+        if response.status == 200:
+            response.headers.update(headers)
+            PAGES.put(generation, key, (response.body, response.content_type))
+        return response
+
+    return wrapper
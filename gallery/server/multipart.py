@@ -0,0 +1,85 @@
+"""
+Incremental multipart/form-data parser, for request bodies that are streamed rather than
+buffered in memory
+"""
+
+import re
+
+
+def boundary(content_type: str) -> bytes:
+    """the boundary from a multipart/form-data Content-Type header"""
+    match = re.search(r'boundary="?([^";]+)"?', content_type or "")
+    if not match:
+        raise ValueError(f"no multipart boundary in {content_type!r}")
+    return match.group(1).encode()
+
+
+def _parse_headers(block: bytes) -> dict:
+    """part headers, with Content-Disposition parameters as "name" and "filename" """
+    headers = {}
+    for line in block.decode("utf-8", "replace").split("\r\n"):
+        key, _, value = line.partition(":")
+        headers[key.strip().lower()] = value.strip()
+    disposition = headers.get("content-disposition", "")
+    for key in ("name", "filename"):
+        match = re.search(rf'\b{key}="([^"]*)"', disposition)
+        if match:
+            headers[key] = match.group(1)
+    return headers
+
+
+class MultipartParser:
+    """
+    feed() the body as it arrives. It returns events, in order:
+
+    ("part", headers): a new part begins. headers is a dict, see _parse_headers
+    ("data", bytes): some of the current part's content
+    ("end", None): the current part is complete
+    """
+
+    def __init__(self, boundary: bytes):
+        self._delimiter = b"\r\n--" + boundary
+        self._buffer = b"\r\n"  # so the first delimiter looks like the rest
+        self._state = "preamble"
+
+    def feed(self, chunk: bytes) -> list:
+        self._buffer += chunk
+        events = []
+        while True:
+            if self._state in ("preamble", "body"):
+                i = self._buffer.find(self._delimiter)
+                if i < 0:
+                    # keep enough to recognize a delimiter split across chunks
+                    keep = len(self._delimiter) - 1
+                    if self._state == "body" and len(self._buffer) > keep:
+                        events += [("data", self._buffer[:-keep])]
+                    self._buffer = self._buffer[-keep:]
+                    return events
+                if self._state == "body":
+                    if i:
+                        events += [("data", self._buffer[:i])]
+                    events += [("end", None)]
+                self._buffer = self._buffer[i + len(self._delimiter) :]
+                self._state = "delimiter"
+
+            if self._state == "delimiter":
+                if len(self._buffer) < 2:
+                    return events
+                if self._buffer.startswith(b"--"):
+                    self._state = "epilogue"
+                    self._buffer = b""
+                    return events
+                self._buffer = self._buffer[2:]  # \r\n
+                self._state = "headers"
+
+            if self._state == "headers":
+                i = self._buffer.find(b"\r\n\r\n")
+                if i < 0:
+                    return events
+                events += [("part", _parse_headers(self._buffer[:i]))]
+                self._buffer = self._buffer[i + 4 :]
+                self._state = "body"
+
+            if self._state == "epilogue":
+                self._buffer = b""
+                return events
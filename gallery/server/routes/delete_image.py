@@ -3,11 +3,13 @@ from sanic.request import Request
 from sanic import Blueprint
 
 from sqlalchemy.orm import Session
-from sqlalchemy import select
+from sqlalchemy import select, update
 
 from whoosh.index import open_dir
 
 from gallery import model
+from gallery import thumbs
+from gallery import crops
 from gallery.model import Image
 
 
@@ -29,11 +31,17 @@ def bp_image(request: Request):
         image = session.scalars(select(Image).where(Image.id == image_id)).one()
         files_to_remove += [model.IMAGES_DIR / image.file_name]
         for face in image.faces:
-            files_to_remove += [model.FACES_DIR / face.extracted_path]
+            crops.remove(face)
         session.delete(image)
+        # near-duplicates of it no longer have an original to point to
+        session.execute(
+            update(Image).where(Image.duplicate_of == image_id).values(duplicate_of=None)
+        )
         session.commit()
+        thumbs.remove(image.image_hash)
 
         # delete the image file and face files
+        # a referenced original is a symlink in IMAGES_DIR, so only the link is removed
         for file in files_to_remove:
             print(f"delete {file}")
             file.unlink()
@@ -0,0 +1,75 @@
+from pathlib import Path
+
+from sanic.response import html, redirect
+from sanic.request import Request
+from sanic import Blueprint
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+from sqlalchemy.orm import Session
+from sqlalchemy import update
+
+from gallery import model
+from gallery.server import caching
+from gallery import duplicates
+from gallery.model import Image
+
+TEMPLATES_DIR = Path(__file__).parent.parent / "templates"
+
+env = Environment(
+    loader=FileSystemLoader(TEMPLATES_DIR), autoescape=select_autoescape()
+)
+
+
+bp = Blueprint("duplicates")
+bp_dismiss = Blueprint("dismiss-duplicate")
+
+
+@bp.get("/duplicates")
+@caching.page
+def bp_duplicates(request: Request):
+    print("at /duplicates")
+
+    # retrieve limit and offset
+    limit = int(request.args.get("limit", 12))
+    offset = int(request.args.get("offset", 0))
+    next_offset = offset + limit
+    prev_offset = max(0, offset - limit)
+
+    with Session(model.get_engine()) as session:
+        pairs = [
+            {
+                "image": image,
+                "original": original,
+                "distance": duplicates.distance(
+                    int(image.dhash, 16), int(original.dhash, 16)
+                ),
+            }
+            for image, original in duplicates.pairs(session, limit, offset)
+        ]
+
+        template = env.get_template("duplicates.html")
+        return html(
+            template.render(
+                pairs=pairs,
+                next_offset=next_offset,
+                prev_offset=prev_offset,
+                limit=limit,
+            ),
+        )
+
+
+@bp_dismiss.post("/api/v1/dismiss-duplicate")
+def bp_dismiss_duplicate(request: Request):
+    """the image is not a near-duplicate after all"""
+    print("at /api/v1/dismiss-duplicate")
+
+    image_id = int(request.form.get("id"))
+
+    with Session(model.get_engine()) as session:
+        session.execute(
+            update(Image).where(Image.id == image_id).values(duplicate_of=None)
+        )
+        session.commit()
+
+    return redirect(request.headers.get("Referer"))
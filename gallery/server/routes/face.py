@@ -0,0 +1,37 @@
+import asyncio
+
+from sanic.response import file
+from sanic.request import Request
+from sanic.exceptions import NotFound
+from sanic import Blueprint
+
+from gallery import crops
+from gallery.server import caching
+
+bp = Blueprint("face")
+
+# seconds a client may use its copy without revalidating.
+# a face's box never changes, but its id could be reused once it is deleted
+MAX_AGE = 86400
+
+
+@bp.get("/face/<face_id:int>")
+async def bp_face(request: Request, face_id: int):
+    """the crop of a face, made from the original if it is not cached (see gallery.crops)"""
+    loop = asyncio.get_running_loop()
+    name = await loop.run_in_executor(None, crops.face_crop_name, face_id)
+    if name is None:
+        raise NotFound(f"no face {face_id}")
+    etag = f'"{name}"'
+    if caching.matches(request, etag):
+        return caching.not_modified(etag, f"public, max-age={MAX_AGE}")
+
+    path = await loop.run_in_executor(None, crops.face_crop, face_id)
+    if path is None:
+        raise NotFound(f"no crop of face {face_id}")
+    return await file(
+        path,
+        mime_type="image/jpeg",
+        headers={"ETag": etag},
+        max_age=MAX_AGE,
+    )
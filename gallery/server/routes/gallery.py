@@ -11,6 +11,7 @@ from sqlalchemy.orm import Session
 from sqlalchemy import select, desc
 
 from gallery import model
+from gallery.server import caching
 
 TEMPLATES_DIR = Path(__file__).parent.parent / "templates"
 
@@ -23,6 +24,7 @@ bp = Blueprint("gallery")
 
 
 @bp.get("/gallery")
+@caching.page
 def bp_gallery(request: Request):
     print("at /gallery")
 
@@ -43,7 +45,7 @@ def bp_gallery(request: Request):
             .limit(limit)
         ).all()
 
-        titles = [model.get_image_title(session, image.id) for image in images]
+        titles = model.get_image_titles(session, images)
 
     template = env.get_template("gallery.html")
     return html(
@@ -0,0 +1,35 @@
+from sanic.response import json
+from sanic.request import Request
+from sanic.exceptions import BadRequest
+from sanic import Blueprint
+
+from sqlalchemy.orm import Session
+
+from gallery import model
+
+bp = Blueprint("have")
+
+# most hashes accepted in one request
+MAX_HASHES = 10000
+
+
+@bp.post("/api/v1/have")
+def bp_have(request: Request):
+    """
+    which of a batch of file hashes are already in the catalog
+
+    request: {"hashes": [hex SHA-256 of each file, ...]}
+    response: {"have": [the hashes that are already present, ...]}
+    """
+    print("at /api/v1/have")
+
+    hashes = (request.json or {}).get("hashes")
+    if not isinstance(hashes, list) or not all(isinstance(h, str) for h in hashes):
+        raise BadRequest('expected {"hashes": [...]}')
+    if len(hashes) > MAX_HASHES:
+        raise BadRequest(f"at most {MAX_HASHES} hashes per request")
+
+    with Session(model.get_engine()) as session:
+        have = model.known_file_hashes(session, [h.lower() for h in hashes])
+
+    return json({"have": sorted(have)})
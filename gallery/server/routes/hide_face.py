@@ -9,6 +9,7 @@ from whoosh.index import open_dir
 
 from gallery import model
 from gallery.model import Face
+from gallery.scheduler import get_scheduler
 
 
 bp_hide = Blueprint("hide-face")
@@ -27,7 +28,7 @@ def bp_image(request: Request):
         face.hidden_reason = model.HIDDEN_REASON_MANUAL
         session.commit()
 
-    model.update_labels()
+    get_scheduler().mark_dirty([face_id])
 
     redirect_to = request.headers.get("referer")
     print(f"redirecting to {redirect_to}")
@@ -46,7 +47,7 @@ def bp_image(request: Request):
         face.hidden_reason = model.HIDDEN_REASON_MANUAL
         session.commit()
 
-    model.update_labels()
+    get_scheduler().mark_dirty([face_id])
 
     redirect_to = request.headers.get("referer")
     print(f"redirecting to {redirect_to}")
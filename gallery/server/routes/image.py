@@ -10,6 +10,7 @@ from sqlalchemy.orm import Session
 from sqlalchemy import select, or_
 
 from gallery import model
+from gallery.server import caching
 from gallery.model import Person, Face, Image
 
 TEMPLATES_DIR = Path(__file__).parent.parent / "templates"
@@ -23,6 +24,7 @@ bp = Blueprint("image")
 
 
 @bp.get("/image/<image_id>")
+@caching.page
 def bp_image(request: Request, image_id: int):
     print(f"at /image/{image_id}")
 
@@ -46,7 +48,6 @@ def bp_image(request: Request, image_id: int):
             faces += [
                 {
                     "id": face.id,
-                    "src": face.extracted_path,
                     "person_id": face.person_id,
                     "person_name": person_name,
                 }
@@ -57,7 +58,6 @@ def bp_image(request: Request, image_id: int):
         hidden_faces = [
             {
                 "id": face.id,
-                "src": face.extracted_path,
                 "person_id": face.person_id,
             }
             for face in hidden_faces
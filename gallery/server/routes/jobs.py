@@ -0,0 +1,41 @@
+import asyncio
+import json as json_lib
+
+from sanic.response import json
+from sanic.request import Request
+from sanic import Blueprint
+
+from gallery import jobs
+
+bp_list = Blueprint("jobs")
+bp_stream = Blueprint("jobs-stream")
+
+# seconds between checks for changed jobs in the event stream
+STREAM_INTERVAL = 1.0
+
+
+@bp_list.get("/api/v1/jobs")
+def bp_jobs(request: Request):
+    limit = int(request.args.get("limit", 50))
+    return json(jobs.recent(limit))
+
+
+@bp_stream.get("/api/v1/jobs/stream")
+async def bp_jobs_stream(request: Request):
+    """server-sent events: a "job" event whenever a recent job is added or changes"""
+    print("at /api/v1/jobs/stream")
+
+    response = await request.respond(
+        content_type="text/event-stream", headers={"Cache-Control": "no-cache"}
+    )
+
+    loop = asyncio.get_running_loop()
+    sent = {}
+    while not request.transport.is_closing():
+        for job in reversed(await loop.run_in_executor(None, jobs.recent)):
+            data = json_lib.dumps(job)
+            # running jobs always change, since their elapsed seconds grow
+            if sent.get(job["id"]) != data:
+                sent[job["id"]] = data
+                await response.send(f"event: job\ndata: {data}\n\n")
+        await asyncio.sleep(STREAM_INTERVAL)
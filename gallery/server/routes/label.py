@@ -10,7 +10,9 @@ from sqlalchemy.orm import Session
 from sqlalchemy import select, or_
 
 from gallery import model
-from gallery.model import Face, Image, Person
+from gallery.server import caching
+from gallery import avatars
+from gallery.model import Face, Person
 
 TEMPLATES_DIR = Path(__file__).parent.parent / "templates"
 
@@ -23,7 +25,8 @@ bp = Blueprint("label")
 
 
 @bp.get("/label")
-def bp_label(request: Request):
+@caching.page
+async def bp_label(request: Request):
     print("at /label")
 
     limit = int(request.args.get("limit", 25))
@@ -48,19 +51,18 @@ def bp_label(request: Request):
 
         # for each unlabeled face, retrieve the image the face is from
         records = []
-        for face in faces:
-            image = session.scalars(
-                select(Image).where(Image.id == face.image_id)
-            ).one()
+        images = [face.image for face in faces]
+        titles = model.get_image_titles(session, images)
+        for face, image, title in zip(faces, images, titles):
             records += [
                 {
                     "face_id": face.id,
-                    "face_src": face.extracted_path,
                     "image_id": image.id,
                     "image_src": image.file_name,
-                    "image_title": model.get_image_title(session, image.id),
+                    "image_title": title,
                 }
             ]
+        atlases = await avatars.atlases(faces)
 
     print(f"handle_label: {len(records)} records")
 
@@ -72,6 +74,7 @@ def bp_label(request: Request):
     return html(
         template.render(
             records=records,
+            atlases=atlases,
             name_suggestions=name_suggestions,
             prev_offset=prev_offset,
             prev_limit=prev_limit,
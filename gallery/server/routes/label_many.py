@@ -11,6 +11,7 @@ from sqlalchemy import select
 
 from gallery import model
 from gallery.model import Person, Face
+from gallery.scheduler import get_scheduler
 
 TEMPLATES_DIR = Path(__file__).parent.parent / "templates"
 
@@ -28,6 +29,7 @@ def bp_label_one(request: Request):
 
     # print(request.form.items())
 
+    face_ids = set()
     with Session(model.get_engine()) as session:
         for k in request.form.keys():
             v = request.form.get(k)
@@ -35,6 +37,7 @@ def bp_label_one(request: Request):
             face_id = int(k[:sep])
             field = k[sep + 1 :]
             # print(face_id, field, v)
+            face_ids.add(face_id)
 
             if field == "name" and v:
                 person = session.scalars(
@@ -56,6 +59,6 @@ def bp_label_one(request: Request):
                 face.hidden_reason = model.HIDDEN_REASON_MANUAL
                 session.commit()
 
-    model.update_labels()
+    get_scheduler().mark_dirty(face_ids)
 
     return redirect(request.headers.get("referer"))
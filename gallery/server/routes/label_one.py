@@ -11,6 +11,7 @@ from sqlalchemy import select
 
 from gallery import model
 from gallery.model import Face, Person
+from gallery.scheduler import get_scheduler
 
 TEMPLATES_DIR = Path(__file__).parent.parent / "templates"
 
@@ -40,8 +41,9 @@ def bp_label_one(request: Request):
     if not name:
         return redirect(request.headers.get("Referer"))
 
+    face_id = int(request.form.get("face_id"))
+
     with Session(model.get_engine()) as session:
-        face_id = request.form.get("face_id")
         face = session.scalars(select(Face).where(Face.id == face_id)).one()
 
         # Look up a person with this exact name
@@ -84,7 +86,7 @@ def bp_label_one(request: Request):
             session.commit()
             print(f"labeled face {face.id} as new person id={person.id}")
 
-    model.update_labels()
+    get_scheduler().mark_dirty([face_id])
 
     # redirect back where we sumbitted the post from
     referer = request.headers.get("Referer")
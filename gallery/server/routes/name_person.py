@@ -7,6 +7,7 @@ from sqlalchemy import select
 
 from gallery import model
 from gallery.model import Person
+from gallery.scheduler import get_scheduler
 
 
 bp = Blueprint("name-person")
@@ -29,7 +30,8 @@ def bp_name_person(request: Request):
         person = session.scalars(select(Person).where(Person.id == person_id)).one()
 
         if person_with_name:
-            model.merge_people(session, person_with_name, person)
+            merged_face_ids = model.merge_people(session, person_with_name, person)
+            get_scheduler().mark_dirty(merged_face_ids)
             print(f"redirecting to {redirect_to}")
             return redirect(redirect_to)
         else:
@@ -7,10 +7,12 @@ from sanic import Blueprint
 from jinja2 import Environment, FileSystemLoader, select_autoescape
 
 from sqlalchemy.orm import Session
-from sqlalchemy import select, func, or_, desc
+from sqlalchemy import select
 
 from gallery import model
-from gallery.model import Person, Face
+from gallery.server import caching
+from gallery import avatars
+from gallery.model import Person
 
 TEMPLATES_DIR = Path(__file__).parent.parent / "templates"
 
@@ -23,7 +25,8 @@ bp = Blueprint("new-people")
 
 
 @bp.get("/new_people")
-def bp_new_people(request: Request):
+@caching.page
+async def bp_new_people(request: Request):
     print("at /new_people")
 
     limit = int(request.args.get("limit", 25))
@@ -35,44 +38,8 @@ def bp_new_people(request: Request):
     prev_limit = limit
 
     with Session(model.get_engine()) as session:
-        faces_count_subquery = (
-            select(Face.person_id, func.count(Face.person_id).label("face_count"))
-            .where(Face.hidden == 0)
-            .group_by(Face.person_id)
-            .subquery()
-        )
-
-        # Query the Person table, join with the faces_count_subquery,
-        # and sort by the face count
-        people_with_face_counts = (
-            select(Person, faces_count_subquery.c.face_count)
-            .join(
-                faces_count_subquery,
-                Person.id == faces_count_subquery.c.person_id,
-                isouter=True,
-            )
-            .where(or_(Person.name == "", Person.name == None))
-            .order_by(desc(faces_count_subquery.c.face_count))
-            .limit(limit)
-            .offset(offset)
-        )
-
-        # Execute the query
-        results = session.execute(people_with_face_counts).fetchall()
-
-        people_data = []
-        for person, count in results:
-            unhidden_faces = [face for face in person.faces if face.hidden == 0]
-
-            people_data += [
-                {
-                    "id": person.id,
-                    "count": count,
-                    "thumb_src": unhidden_faces[0].extracted_path,
-                }
-            ]
-
-        people_data = sorted(people_data, key=lambda pd: pd["count"], reverse=True)
+        people_data = model.get_people_page(session, False, offset, limit)
+        atlases = await avatars.atlases([pd["thumb_face"] for pd in people_data])
 
         named_people = session.scalars(
             select(Person).where(Person.name != None).where(Person.name != "")
@@ -83,6 +50,7 @@ def bp_new_people(request: Request):
         return html(
             template.render(
                 people=people_data,
+                atlases=atlases,
                 all_names=all_names,
                 next_limit=next_limit,
                 next_offset=next_offset,
@@ -0,0 +1,17 @@
+from sanic.response import json
+from sanic.request import Request
+from sanic import Blueprint
+
+from gallery.server import caching
+
+bp = Blueprint("page-cache")
+
+
+@bp.get("/api/v1/page-cache")
+def bp_page_cache(request: Request):
+    """
+    response: {"generation": catalog generation of the cached pages, "pages": number cached,
+    "hits", "misses", "not_modified": requests answered from the cache, rendered, and
+    answered with 304}
+    """
+    return json(caching.PAGES.stats())
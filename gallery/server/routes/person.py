@@ -10,6 +10,8 @@ from sqlalchemy.orm import Session
 from sqlalchemy import select
 
 from gallery import model
+from gallery.server import caching
+from gallery import avatars
 from gallery.model import Person, Face, Image
 
 TEMPLATES_DIR = Path(__file__).parent.parent / "templates"
@@ -23,10 +25,12 @@ bp = Blueprint("person")
 
 
 @bp.get("/person/<person_id>")
-def bp_person(request: Request, person_id: int):
+@caching.page
+async def bp_person(request: Request, person_id: int):
     print(f"at /person/{person_id}")
 
     images_to_show = []
+    shown_faces = []  # in the order they are shown, for the avatar atlas
     with Session(model.get_engine()) as session:
         # retrieve the person
         person = session.scalars(
@@ -59,12 +63,13 @@ def bp_person(request: Request, person_id: int):
                 .where(Face.hidden == 0)
             ).all()
 
+            shown_faces += faces_of_person
             faces_to_show = [
                 {
-                    "src": fop.extracted_path,
+                    "index": len(shown_faces) - len(faces_of_person) + i,
                     "id": fop.id,
                 }
-                for fop in faces_of_person
+                for i, fop in enumerate(faces_of_person)
             ]
 
             images_to_show += [
@@ -75,6 +80,8 @@ def bp_person(request: Request, person_id: int):
                 }
             ]
 
+        atlases = await avatars.atlases(shown_faces)
+
         people = session.scalars(select(Person)).all()
         all_names = [p.name for p in people if p.name]
 
@@ -90,6 +97,7 @@ def bp_person(request: Request, person_id: int):
             person_name=display_name,
             person_id=person.id,
             images=images_to_show,
+            atlases=atlases,
             all_names=all_names,
         )
     )
@@ -0,0 +1,24 @@
+from sanic.response import json, redirect
+from sanic.request import Request
+from sanic import Blueprint
+
+from gallery.scheduler import get_scheduler
+
+bp_status = Blueprint("recluster-status")
+bp_now = Blueprint("recluster-now")
+
+
+@bp_status.get("/api/v1/recluster")
+def bp_recluster_status(request: Request):
+    return json(get_scheduler().status())
+
+
+@bp_now.post("/api/v1/recluster-now")
+def bp_recluster_now(request: Request):
+    print("at /api/v1/recluster-now")
+
+    get_scheduler().recluster_now()
+
+    referer = request.headers.get("Referer")
+    print(f"redirect to referer {referer}")
+    return redirect(referer)
@@ -11,24 +11,12 @@ from sqlalchemy import select
 
 from gallery import model
 from gallery import config
+from gallery import jobs
 
 
 bp = Blueprint("rescan-originals")
 
 
-async def rescan_originals_task(app, complete: bool = False):
-
-    try:
-        IMAGE_SUFFIXES = [".jpg", ".png", ".webp", ".jpeg"]
-
-        for e in config.ORIGINALS_DIR.rglob("*"):
-            if e.is_file():
-                if e.suffix in IMAGE_SUFFIXES:
-                    model.add_original(e)
-    except KeyboardInterrupt:
-        return
-
-
 @bp.post("/api/v1/rescan-originals")
 def rescan_originals(request: Request):
 
@@ -40,10 +28,8 @@ def rescan_originals(request: Request):
     if not config.ORIGINALS_DIR:
         return redirect(request.headers.get("Referer"))
 
-    model.log("starting async originals scan...")
-    request.app.add_task(
-        rescan_originals_task(request.app, complete), name="rescan_originals"
-    )
+    model.log("queueing originals scan...")
+    jobs.submit("rescan", {"complete": bool(complete)})
 
     # redirect back where we sumbitted the post from
     referer = request.headers.get("Referer")
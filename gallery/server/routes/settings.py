@@ -6,7 +6,8 @@ from sanic import Blueprint
 
 from jinja2 import Environment, FileSystemLoader, select_autoescape
 
-from gallery import model, config
+from gallery import model, config, jobs
+from gallery.scheduler import get_scheduler
 
 TEMPLATES_DIR = Path(__file__).parent.parent / "templates"
 
@@ -32,5 +33,7 @@ def bp_settings(request: Request):
         template.render(
             cache_dir=config.CACHE_DIR,
             originals_dir=originals_dir,
+            recluster=get_scheduler().status(),
+            jobs=jobs.recent(10),
         )
     )
@@ -0,0 +1,50 @@
+from sanic.response import file
+from sanic.request import Request
+from sanic.exceptions import NotFound
+from sanic import Blueprint
+
+from sqlalchemy.orm import Session
+from sqlalchemy import select
+
+from gallery import model
+from gallery import thumbs
+from gallery.model import Image
+from gallery.server import caching
+
+bp = Blueprint("thumb")
+
+# seconds a client may use its copy without revalidating.
+# thumbnails never change, but an image id could be reused once it is deleted
+MAX_AGE = 86400
+
+
+@bp.get("/thumb/<size:int>/<image_id:int>")
+async def bp_thumb(request: Request, size: int, image_id: int):
+    """
+    a thumbnail of an image, `size` pixels wide (one of thumbs.WIDTHS)
+
+    WebP if the client accepts it, otherwise JPEG. Made on first request if needed
+    """
+    if size not in thumbs.WIDTHS:
+        raise NotFound(f"thumbnails are {', '.join(map(str, thumbs.WIDTHS))} wide")
+
+    with Session(model.get_engine()) as session:
+        image = session.execute(
+            select(Image.file_name, Image.image_hash).where(Image.id == image_id)
+        ).one_or_none()
+    if image is None:
+        raise NotFound(f"no image {image_id}")
+
+    fmt = "webp" if "image/webp" in request.headers.get("accept", "") else "jpeg"
+    path = thumbs.thumb_path(image.image_hash, size, fmt)
+    headers = {"ETag": f'"{path.name}"', "Vary": "Accept"}
+    if caching.matches(request, headers["ETag"]):
+        response = caching.not_modified(headers["ETag"], f"public, max-age={MAX_AGE}")
+        response.headers["Vary"] = "Accept"
+        return response
+    if not path.exists():
+        await thumbs.ensure(image.file_name, image.image_hash)
+
+    return await file(
+        path, mime_type=thumbs.FORMATS[fmt], headers=headers, max_age=MAX_AGE
+    )
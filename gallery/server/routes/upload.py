@@ -1,6 +1,7 @@
 from pathlib import Path
-import os
-from tempfile import TemporaryDirectory
+import hashlib
+import asyncio
+import shutil
 
 from sanic.response import html, redirect
 from sanic.request import Request
@@ -12,6 +13,9 @@ from sqlalchemy.orm import Session
 from sqlalchemy import select
 
 from gallery import model
+from gallery import config
+from gallery import jobs
+from gallery.server import multipart
 
 TEMPLATES_DIR = Path(__file__).parent.parent / "templates"
 
@@ -33,22 +37,104 @@ def bp_upload(request: Request):
     )
 
 
-@bp.post("/api/v1/upload-files")
-def bp_upload_files(request: Request):
+# received body buffered before it is written out, in bytes
+WRITE_BATCH = 1 << 20
+
+
+def _known_file(file_hash: str) -> bool:
+    with Session(model.get_engine()) as session:
+        return bool(model.known_file_hashes(session, [file_hash]))
+
+
+class _Receiver:
+    """
+    writes the files of a multipart body to `upload_dir` as it arrives, hashing each along
+    the way. feed() blocks on the disk and catalog, so it is run in an executor
+    """
+
+    def __init__(self, upload_dir: Path, boundary: bytes):
+        self.upload_dir = upload_dir
+        self.parser = multipart.MultipartParser(boundary)
+        self.hashes = {}  # path -> file hash, for files that were kept
+        self.rejected = 0
+        self._f, self._path, self._hash = None, None, None
+
+    def feed(self, chunk: bytes):
+        for event, value in self.parser.feed(chunk):
+            if event == "part" and value.get("filename"):
+                # uploads may share a name
+                self._path = (
+                    self.upload_dir
+                    / f"{len(self.hashes) + self.rejected}"
+                    / Path(value["filename"]).name
+                )
+                self._path.parent.mkdir()
+                self._f = open(self._path, "wb")
+                self._hash = hashlib.sha256()
+            elif event == "data" and self._f is not None:
+                self._f.write(value)
+                self._hash.update(value)
+            elif event == "end" and self._f is not None:
+                self._f.close()
+                self._f = None
+                digest = self._hash.hexdigest()
+                if _known_file(digest):
+                    model.log(
+                        f"{self._path.name} file already present", component="upload"
+                    )
+                    self._path.unlink()
+                    self.rejected += 1
+                else:
+                    self.hashes[str(self._path)] = digest
+
+    def close(self):
+        if self._f is not None:  # body ended inside a file
+            self._f.close()
+            self._path.unlink(missing_ok=True)
+
+
+@bp.post("/api/v1/upload-files", stream=True)
+async def bp_upload_files(request: Request):
     print("at /api/v1/upload-files")
 
-    for key in request.files.keys():
-        files = request.files.getlist(key)
-        for file in files:
-            with TemporaryDirectory(dir=os.getcwd()) as d:
-                uploaded_path = Path(d) / file.name
-                with open(uploaded_path, "wb") as f:
-                    f.write(file.body)
-                model.add_original(uploaded_path)
-
-    model.incremental_index()
-    model.detect_faces()
-    model.generate_embeddings()
-    model.update_labels()
+    # the body goes to disk, not memory, so it may be larger than REQUEST_MAX_SIZE
+    request.stream.request_max_size = int(config.UPLOAD_MAX_MB * 1e6)
+
+    loop = asyncio.get_running_loop()
+    # files are kept until the upload job has ingested them, even across a restart
+    upload_dir = await loop.run_in_executor(None, jobs.uploads_dir)
+    receiver = _Receiver(
+        upload_dir, multipart.boundary(request.headers.get("content-type"))
+    )
+
+    # each file is written as it arrives, a batch at a time, outside the event loop
+    batch = []
+    try:
+        while True:
+            chunk = await request.stream.read()
+            if chunk is not None:
+                batch += [chunk]
+            if batch and (chunk is None or sum(map(len, batch)) >= WRITE_BATCH):
+                await loop.run_in_executor(None, receiver.feed, b"".join(batch))
+                batch = []
+            if chunk is None:
+                break
+    except Exception:  # e.g. the body is larger than UPLOAD_MAX_MB
+        await loop.run_in_executor(None, shutil.rmtree, upload_dir, True)
+        raise
+    finally:
+        await loop.run_in_executor(None, receiver.close)
+
+    hashes, rejected = receiver.hashes, receiver.rejected
+    if hashes:
+        await loop.run_in_executor(
+            None, jobs.submit, "upload", {"dir": str(upload_dir), "hashes": hashes}
+        )
+    else:
+        shutil.rmtree(upload_dir, ignore_errors=True)
+    model.log(
+        f"received {len(hashes)} new files, {rejected} already present",
+        component="upload",
+    )
 
     return redirect(request.headers.get("Referer"))
@@ -0,0 +1,71 @@
+"""
+How originals are stored in IMAGES_DIR
+
+config.STORAGE_MODE is one of
+* "copy": copy the original (the default)
+* "hardlink": another name for the original's data, no copy. Falls back to copying if the
+  original is on a different filesystem
+* "reflink": a copy-on-write clone, on filesystems that support it (btrfs, XFS). Falls back
+  to copying otherwise
+* "reference": leave the original where it is. IMAGES_DIR holds a symlink to it, so
+  everything that reads IMAGES_DIR / file_name keeps working, and Image.original_path
+  records where it lives. The original must not be moved or deleted
+
+Deleting an image removes its entry in IMAGES_DIR. With "hardlink" and "reference", that
+leaves the original untouched.
+"""
+
+from pathlib import Path
+import fcntl
+import errno
+import shutil
+import os
+
+from gallery.model import log
+
+MODES = ("copy", "hardlink", "reflink", "reference")
+
+FICLONE = 0x40049409  # from linux/fs.h
+
+# errors that mean a link or clone is not possible here, so fall back to copying
+_UNSUPPORTED = (errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EPERM)
+
+
+def _reflink(src: Path, dst: Path):
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            dst.unlink()
+            raise
+
+
+def store(src: Path, dst: Path, mode: str) -> str:
+    """
+    put the original at `src` in IMAGES_DIR at `dst` according to `mode`
+
+    replaces anything already at `dst`, so it may be retried. returns the mode that was used,
+    which is "copy" if `mode` was not possible
+    """
+    src, dst = Path(src), Path(dst)
+    if dst.is_symlink() or dst.exists():
+        dst.unlink()
+
+    try:
+        if mode == "hardlink":
+            os.link(src, dst)
+            return mode
+        elif mode == "reflink":
+            _reflink(src, dst)
+            return mode
+        elif mode == "reference":
+            os.symlink(src.resolve(), dst)
+            return mode
+    except OSError as e:
+        if e.errno not in _UNSUPPORTED:
+            raise
+        log(f"{src}: {mode} not possible ({e}), copying", component="storage")
+
+    shutil.copyfile(src, dst)
+    return "copy"
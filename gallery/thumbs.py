@@ -0,0 +1,121 @@
+"""
+Resized copies of originals, for pages that show many images at once
+
+Each image has a WebP and a JPEG thumbnail at each of WIDTHS, named by its image hash under
+THUMBS_DIR. The pixels behind an image hash never change, so thumbnails never need to be
+invalidated, only removed with their image.
+
+Thumbnails are made at ingest while the image is decoded anyway (see
+config.THUMBS_AT_INGEST), and otherwise on first request in a small process pool (see
+ensure()).
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import multiprocessing
+import asyncio
+import os
+
+from PIL import Image as PilImage
+from PIL import ImageOps
+
+from gallery import model
+
+WIDTHS = (320, 640, 1280)
+
+# format -> MIME type
+FORMATS = {"webp": "image/webp", "jpeg": "image/jpeg"}
+
+QUALITY = 80
+
+# processes that make thumbnails on request
+PROCESSES = 2
+
+POOL = None
+
+# image hash -> asyncio.Future for thumbnails being made
+_PENDING = {}
+
+
+def thumb_path(image_hash: str, width: int, fmt: str) -> Path:
+    return model.THUMBS_DIR / image_hash[0:2] / f"{image_hash}-{width}.{fmt}"
+
+
+def _save(img, path: Path, fmt: str):
+    """write atomically, in case the same thumbnail is being made elsewhere"""
+    tmp = path.with_name(f".{path.name}.{os.getpid()}")
+    img.save(tmp, format=fmt.upper(), quality=QUALITY)
+    os.replace(tmp, path)
+
+
+def render(pil_img, image_hash: str) -> int:
+    """make any missing thumbnails of the decoded image `pil_img`, returns how many"""
+    missing = [
+        width
+        for width in WIDTHS
+        if not all(thumb_path(image_hash, width, fmt).exists() for fmt in FORMATS)
+    ]
+    if not missing:
+        return 0
+
+    # browsers apply the EXIF orientation to originals, so apply it to thumbnails too
+    img = ImageOps.exif_transpose(pil_img).convert("RGB")
+    thumb_path(image_hash, WIDTHS[0], "jpeg").parent.mkdir(parents=True, exist_ok=True)
+
+    made = 0
+    # largest first, so each is resized from the previous, smaller one
+    for width in sorted(missing, reverse=True):
+        if img.width > width:
+            img = img.resize(
+                (width, max(1, round(img.height * width / img.width))),
+                PilImage.LANCZOS,
+            )
+        for fmt in FORMATS:
+            path = thumb_path(image_hash, width, fmt)
+            if not path.exists():
+                _save(img, path, fmt)
+                made += 1
+    return made
+
+
+def generate(file_name: str, image_hash: str) -> int:
+    """make any missing thumbnails of IMAGES_DIR / `file_name`, returns how many"""
+    with PilImage.open(model.IMAGES_DIR / file_name) as pil_img:
+        # JPEGs can be decoded at reduced size directly, which is much faster
+        pil_img.draft("RGB", (max(WIDTHS), max(WIDTHS)))
+        return render(pil_img, image_hash)
+
+
+def remove(image_hash: str):
+    """remove the thumbnails of an image"""
+    for width in WIDTHS:
+        for fmt in FORMATS:
+            thumb_path(image_hash, width, fmt).unlink(missing_ok=True)
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global POOL
+    if POOL is None:
+        # not forked, since the server is running threads whose locks could be held
+        POOL = ProcessPoolExecutor(
+            PROCESSES, mp_context=multiprocessing.get_context("forkserver")
+        )
+    return POOL
+
+
+async def ensure(file_name: str, image_hash: str):
+    """make any missing thumbnails of an image in the pool, once however many ask"""
+    future = _PENDING.get(image_hash)
+    if future is None:
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(get_pool(), generate, file_name, image_hash)
+        _PENDING[image_hash] = future
+        future.add_done_callback(lambda _: _PENDING.pop(image_hash, None))
+    await future
+
+
+def close():
+    global POOL
+    if POOL is not None:
+        POOL.shutdown()
+        POOL = None
@@ -5,10 +5,42 @@ from gallery import model
 
 from PIL import Image as PilImage
 
+# version of hash_image_data, stored with each image's image_hash
+# 1: SHA-256 of a Python list of every channel value
+# 2: SHA-256 of the raw pixel buffer, fed to the hasher in strips of rows. This is the same
+#    digest as version 1 for every image version 1 could hash (8-bit, multi-band modes such
+#    as RGB), so hashes of both versions can be compared. It also hashes single-band and
+#    16-bit images, which version 1 could not
+IMAGE_HASH_VERSION = 2
+
+# rows of pixels copied at a time by hash_image_data
+IMAGE_HASH_STRIP_ROWS = 256
+
 
 def hash_image_data(img) -> str:
-    pixel_data = [x for xs in list(img.getdata()) for x in xs]
-    return hashlib.sha256(bytes(pixel_data)).hexdigest()
+    h = hashlib.sha256()
+    width, height = img.size
+    for top in range(0, height, IMAGE_HASH_STRIP_ROWS):
+        bottom = min(height, top + IMAGE_HASH_STRIP_ROWS)
+        h.update(img.crop((0, top, width, bottom)).tobytes())
+    return h.hexdigest()
+
+
+def dhash(img) -> str:
+    """
+    64-bit difference hash of the image, as 16 hex digits
+
+    each bit is whether a pixel is brighter than its right neighbor in a 9x8 grayscale
+    reduction, so resized, re-encoded or lightly edited copies hash alike
+    """
+    small = img.convert("L").resize((9, 8), PilImage.Resampling.LANCZOS)
+    pixels = small.tobytes()
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            left, right = pixels[row * 9 + col], pixels[row * 9 + col + 1]
+            bits = (bits << 1) | (left > right)
+    return f"{bits:016x}"
 
 
 def hash_file_data(f) -> str:
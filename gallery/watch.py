@@ -0,0 +1,257 @@
+"""
+Follow ORIGINALS_DIR and ingest new or changed originals as they appear
+
+Changes are found with inotify where it is available (Linux), or by polling the tree with
+gallery.manifest.walk otherwise. Either way, a changed file is only ingested once it has
+had no events and its size and mtime have not changed for `quiet` seconds, so files that
+are still being copied in are not read half-written. Files that settle together are
+ingested as one batch.
+
+On start, anything that changed while nothing was watching is picked up from the manifest.
+"""
+
+from pathlib import Path
+import ctypes
+import ctypes.util
+import threading
+import select
+import struct
+import time
+import os
+
+from gallery import ingest
+from gallery import manifest
+from gallery.model import log
+
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_Q_OVERFLOW = 0x4000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len
+
+
+def _is_image(path: str) -> bool:
+    name = Path(path).name
+    return not name.startswith(".") and Path(name).suffix in manifest.IMAGE_SUFFIXES
+
+
+class _Inotify:
+    """changed paths under a directory tree, from inotify"""
+
+    def __init__(self, root: Path):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._fd = libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        self._dirs = {}  # watch descriptor -> directory
+        self.rescan = False  # events were lost, the whole tree should be checked
+        self._watch_tree(str(root))
+
+    def _watch_tree(self, directory: str) -> list:
+        """watch `directory` and everything below it, returns the images already there"""
+        found = []
+        for d, _, files in os.walk(directory):
+            wd = self._add_watch(self._fd, os.fsencode(d), WATCH_MASK)
+            if wd < 0:
+                log(f"{d}: unable to watch", component="watch")
+                continue
+            self._dirs[wd] = d
+            found += [os.path.join(d, f) for f in files]
+        return found
+
+    def wait(self, timeout: float) -> list:
+        """block up to `timeout` seconds for changes, returns the paths that changed"""
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return []
+
+        changed = []
+        data = os.read(self._fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                self.rescan = True
+                continue
+            if wd not in self._dirs or not name:
+                continue
+            path = os.path.join(self._dirs[wd], name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    changed += self._watch_tree(path)
+            else:
+                changed += [path]
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+
+class _Poll:
+    """changed paths under a directory tree, by comparing successive walks"""
+
+    def __init__(self, root: Path, interval: float):
+        self.root = root
+        self.interval = interval
+        self.rescan = False
+        self._snapshot = self._walk()
+        self._next = time.time() + interval
+
+    def _walk(self) -> dict:
+        return {
+            path: (st.st_size, st.st_mtime_ns, st.st_ino)
+            for path, st in manifest.walk(self.root).items()
+        }
+
+    def wait(self, timeout: float) -> list:
+        now = time.time()
+        if timeout is None or now + timeout >= self._next:
+            time.sleep(max(0, self._next - now))
+        else:
+            time.sleep(timeout)
+            return []
+
+        snapshot = self._walk()
+        changed = [
+            path for path, st in snapshot.items() if self._snapshot.get(path) != st
+        ]
+        self._snapshot = snapshot
+        self._next = time.time() + self.interval
+        return changed
+
+    def close(self):
+        pass
+
+
+class Watcher:
+    def __init__(
+        self,
+        root,
+        on_batch,
+        quiet: float = 2.0,
+        poll_interval: float = 5.0,
+        use_inotify: bool = True,
+    ):
+        """
+        `root`: directory to follow
+        `on_batch`: called with a list of paths that are ready to be ingested
+        `quiet`: seconds a file must be unchanged before it is ingested
+        `poll_interval`: seconds between walks, if inotify is not used
+        `use_inotify`: use inotify if it is available, otherwise always poll
+        """
+        self.root = Path(root)
+        self.on_batch = on_batch
+        self.quiet = quiet
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+
+        self._pending = {}  # path -> (time of last change, (size, mtime_ns))
+        self._stopped = threading.Event()
+        self._thread = None
+        self.batches = 0
+        self.files = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="watch", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _source(self):
+        if self.use_inotify:
+            try:
+                return _Inotify(self.root)
+            except (OSError, AttributeError) as e:
+                log(f"inotify unavailable ({e}), polling", component="watch")
+        return _Poll(self.root, self.poll_interval)
+
+    def _catch_up(self) -> list:
+        """paths that are new or changed since they were last ingested"""
+        return manifest.changed(manifest.walk(self.root))
+
+    def _mark(self, paths: list):
+        now = time.time()
+        for path in paths:
+            if _is_image(path):
+                self._pending[path] = (now, self._stat(path))
+
+    @staticmethod
+    def _stat(path: str):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    def _settled(self) -> list:
+        """pending paths that have not changed for `quiet` seconds"""
+        now = time.time()
+        settled = []
+        for path, (changed_at, stat) in list(self._pending.items()):
+            if now - changed_at < self.quiet:
+                continue
+            current = self._stat(path)
+            if current is None:
+                del self._pending[path]  # removed before it settled
+            elif current != stat:
+                self._pending[path] = (now, current)  # still being written
+            else:
+                del self._pending[path]
+                settled += [path]
+        return settled
+
+    def run(self):
+        source = self._source()
+        log(f"watching {self.root} with {type(source).__name__}", component="watch")
+        self._mark(self._catch_up())
+        try:
+            while not self._stopped.is_set():
+                timeout = self.quiet / 2 if self._pending else 1.0
+                self._mark(source.wait(timeout))
+                if source.rescan:
+                    source.rescan = False
+                    self._mark(self._catch_up())
+
+                settled = self._settled()
+                if settled:
+                    self.batches += 1
+                    self.files += len(settled)
+                    log(f"{len(settled)} files ready", component="watch")
+                    try:
+                        self.on_batch(sorted(settled))
+                    except Exception as e:
+                        log(f"unable to ingest batch: {e}", component="watch")
+        finally:
+            source.close()
+
+
+def ingest_batch(paths: list, **kwargs) -> list:
+    """
+    ingest `paths`, which are under ORIGINALS_DIR, and record them in the manifest
+
+    `kwargs` are passed to gallery.ingest.ingest. returns the image id of each path
+    """
+    found = {}
+    for path in paths:
+        try:
+            found[str(path)] = os.stat(path)
+        except OSError:
+            pass  # removed since it was seen
+    paths = sorted(found)
+
+    file_hashes = {}
+    ids = ingest.ingest(paths, file_hashes=file_hashes, **kwargs)
+    manifest.update(found, paths, file_hashes, ids)
+    return ids
@@ -0,0 +1,80 @@
+"""
+Long-lived pool of warm worker processes for face detection and encoding
+
+The server creates the pool once, when it starts, instead of spawning processes for every
+upload or rescan. Each worker runs one tiny detection and encoding when it starts, so the
+face_recognition models are loaded and ready before the first real image arrives.
+
+Work is dispatched with gallery.ingest.ingest(paths, pool=get_pool()).
+
+Workers are started by a fork server rather than forked from the server process, which by
+then is running threads (the catalog and log writers, the scheduler) whose locks a forked
+child could inherit while they are held. So workers do not inherit settings made with
+config.update(), and are given them when they start.
+"""
+
+import multiprocessing
+import multiprocessing.pool
+import signal
+
+import face_recognition
+import numpy as np
+
+from gallery import model
+from gallery import config
+
+POOL = None
+
+
+def _init(settings: dict):
+    """worker initializer: use the server's settings, and warm up"""
+    # a SIGTERM to the whole process group (e.g. systemd stopping the server) would kill an
+    # idle worker holding the pool's task queue lock, and close() would wait for it forever.
+    # The server closes the pool when it stops, and workers exit if it dies
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    config.apply(settings)
+    _warm()
+
+
+def _warm():
+    """exercise the detector and encoder once"""
+    img = np.zeros((64, 64, 3), dtype=np.uint8)
+    face_recognition.face_locations(img)
+    face_recognition.face_encodings(img, known_face_locations=[(8, 56, 56, 8)])
+
+
+def new_pool(processes: int) -> multiprocessing.pool.Pool:
+    """
+    a pool of `processes` workers with this process's settings, started by a fork server
+    for the same reason as the warm pool. For commands that need a pool of their own
+    """
+    context = multiprocessing.get_context("forkserver")
+    return context.Pool(
+        processes, initializer=config.apply, initargs=(config.settings(),)
+    )
+
+
+def processes() -> int:
+    """number of worker processes in the pool"""
+    return config.WORKER_PROCESSES or model.CPUS
+
+
+def get_pool() -> multiprocessing.pool.Pool:
+    """the warm pool for this process, started on first use"""
+    global POOL
+    if POOL is None:
+        model.log(f"start {processes()} warm workers", component="workers")
+        context = multiprocessing.get_context("forkserver")
+        POOL = context.Pool(
+            processes(), initializer=_init, initargs=(config.settings(),)
+        )
+    return POOL
+
+
+def close():
+    """let the workers finish their current images and exit"""
+    global POOL
+    if POOL is not None:
+        POOL.close()
+        POOL.join()
+        POOL = None
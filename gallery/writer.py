@@ -0,0 +1,216 @@
+"""
+Single writer for a SQLite database
+
+Rather than each caller opening a Session and committing its own rows, callers submit
+operations to a Writer. An operation is a callable that takes a Session and returns a value
+(for example, the id of a row it added). One thread per process applies operations and commits
+them in batches, which are bounded by size (`max_batch`) and time (`max_delay`).
+
+A batch is also committed early once the queue is empty if anyone is waiting on a result,
+so a caller that needs an id back does not pay `max_delay`.
+
+An operation may be applied more than once, if its batch fails and is retried. Side effects
+outside the database should be registered with after_commit(), so that they only happen once
+the operation's rows are committed.
+"""
+
+from concurrent.futures import Future
+import multiprocessing.util
+import threading
+import queue
+import time
+import os
+
+from sqlalchemy.orm import Session
+from sqlalchemy import event
+
+
+def after_commit(session: Session, fn):
+    """from within an operation: call `fn()` once the operation has been committed"""
+    session.info.setdefault("after_commit", []).append(fn)
+
+
+def _print(message: str, component: str = None):
+    print(f"==== [{component}] {message}")
+
+
+def _run_after_commit(session: Session, log):
+    for fn in session.info.pop("after_commit", []):
+        try:
+            fn()
+        except Exception as e:
+            log(f"after commit: {e}", component="writer")
+
+
+class _Op:
+    def __init__(self, fn, future: Future, urgent: bool):
+        self.fn = fn
+        self.future = future
+        self.urgent = urgent
+
+
+class Writer:
+    def __init__(
+        self,
+        get_engine,
+        name: str,
+        max_batch: int = 256,
+        max_delay: float = 0.05,
+        log=_print,
+    ):
+        """
+        `get_engine`: callable that returns the sqlalchemy engine to write to
+        `name`: used when reporting throughput
+        `max_batch`: maximum number of operations per commit
+        `max_delay`: maximum seconds an operation waits for its batch to fill
+        `log`: called with (message, component=) to report throughput and failures, e.g.
+        model.log. Only printed by default, since the writer of the log database cannot
+        log through itself
+        """
+        self.get_engine = get_engine
+        self.name = name
+        self.log = log
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+
+        self.ops = 0
+        self.rows = 0
+        self.batches = 0
+        self.busy_seconds = 0.0
+
+        self.pid = os.getpid()
+        self._q = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name=f"writer-{name}", daemon=True
+        )
+        self._thread.start()
+
+        # flush outstanding operations when this process exits normally,
+        # including multiprocessing workers, which do not run atexit handlers
+        multiprocessing.util.Finalize(self, self.close, exitpriority=10)
+
+    def submit(self, fn, urgent: bool = False) -> Future:
+        """
+        queue `fn(session)` to be applied in the next batch
+
+        returns a Future for the value returned by `fn`, available once the batch is committed
+        `urgent`: commit as soon as the queue is empty instead of waiting for the batch to fill
+        """
+        if self._closed:
+            raise RuntimeError(f"writer {self.name} is closed")
+        future = Future()
+        self._q.put(_Op(fn, future, urgent))
+        return future
+
+    def call(self, fn):
+        """apply `fn(session)`, wait for it to be committed, and return its result"""
+        return self.submit(fn, urgent=True).result()
+
+    def flush(self):
+        """wait for all previously-submitted operations to be committed"""
+        self.call(lambda session: None)
+
+    def close(self):
+        if self._closed or self.pid != os.getpid():
+            return
+        self.flush()
+        self._closed = True
+        self._q.put(None)
+        self._thread.join()
+        self.report()
+
+    def rows_per_second(self) -> float:
+        return self.rows / self.busy_seconds if self.busy_seconds else 0.0
+
+    def report(self):
+        if self.ops:
+            self.log(
+                f"{self.name}: {self.ops} ops, {self.rows} rows in {self.batches} "
+                f"batches ({self.rows_per_second():.1f} rows/s)",
+                component="writer",
+            )
+
+    def _next_batch(self) -> list:
+        """block for one operation, then gather more until the batch is full or due"""
+
+        op = self._q.get()
+        if op is None:
+            return []
+        batch = [op]
+        urgent = op.urgent
+        deadline = time.time() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                if urgent:
+                    op = self._q.get_nowait()
+                else:
+                    op = self._q.get(timeout=max(0, deadline - time.time()))
+            except queue.Empty:
+                break
+            if op is None:
+                self._q.put(None)  # stop after this batch
+                break
+            batch += [op]
+            urgent = urgent or op.urgent
+        return batch
+
+    def _session(self, flushed: list) -> Session:
+        """a new session that adds the number of rows in each flush to `flushed`"""
+        session = Session(self.get_engine())
+
+        @event.listens_for(session, "after_flush")
+        def count_rows(session, flush_context):
+            flushed.append(len(session.new) + len(session.dirty) + len(session.deleted))
+
+        return session
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+
+            start = time.time()
+            flushed = []
+            with self._session(flushed) as session:
+                try:
+                    results = [(op, op.fn(session)) for op in batch]
+                    session.commit()
+                except Exception:
+                    session.rollback()
+                    session.info.pop("after_commit", None)
+                    flushed.clear()
+                    results = None
+                else:
+                    _run_after_commit(session, self.log)
+
+            # something in the batch failed. apply each operation on its own so only
+            # the failing ones see an error
+            if results is None:
+                results = []
+                for op in batch:
+                    op_flushed = []
+                    with self._session(op_flushed) as session:
+                        try:
+                            result = op.fn(session)
+                            session.commit()
+                            _run_after_commit(session, self.log)
+                            results += [(op, result)]
+                            flushed += op_flushed
+                        except Exception as e:
+                            session.rollback()
+                            self.log(
+                                f"{self.name}: operation failed: {e}",
+                                component="writer",
+                            )
+                            op.future.set_exception(e)
+            rows = sum(flushed)
+
+            self.ops += len(batch)
+            self.rows += rows
+            self.batches += 1
+            self.busy_seconds += time.time() - start
+
+            for op, result in results:
+                op.future.set_result(result)
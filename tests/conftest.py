@@ -0,0 +1,60 @@
+import tempfile
+
+import numpy as np
+import pytest
+from sqlalchemy.orm import Session
+
+from gallery import config
+
+# the catalog and caches of the test session, set before gallery.model reads CACHE_DIR
+config.update(cache_dir=tempfile.mkdtemp(prefix="gallery-test-"))
+
+from gallery import embeddings
+from gallery import model
+
+model.init()
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """an empty embedding store in place of model.EMBEDDINGS"""
+    store = embeddings.EmbeddingStore(tmp_path / "embeddings")
+    monkeypatch.setattr(model, "EMBEDDINGS", store)
+    return store
+
+
+def _add_faces(vectors, person_id: int = None, person_source: int = None) -> list:
+    with Session(model.get_engine()) as session:
+        image = model.Image(
+            file_name="test.jpg",
+            original_name="test.jpg",
+            height=100,
+            width=100,
+            image_hash="",
+            file_hash="",
+            faces=[
+                model.Face(
+                    top=0,
+                    right=10,
+                    bottom=10,
+                    left=0,
+                    hidden=0,
+                    extracted_path="",
+                    excluded_people="[]",
+                    person_id=person_id,
+                    person_source=person_source,
+                    embedding_bytes=np.asarray(v, dtype=np.float64).tobytes(),
+                )
+                for v in vectors
+            ],
+        )
+        session.add(image)
+        session.commit()
+        return [face.id for face in image.faces]
+
+
+@pytest.fixture
+def add_faces():
+    """add_faces(vectors, person_id=, person_source=): add an image with one face for each
+    of `vectors` to the catalog, returns the face ids"""
+    return _add_faces
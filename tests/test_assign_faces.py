@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+from sqlalchemy.orm import Session
+
+from gallery import model
+
+DIM = 128
+
+
+def _at(x: float, offset: float = 0.0):
+    """a point far from every other test's faces, `offset` away from the one at `x`"""
+    v = np.zeros(DIM)
+    v[0] = x
+    v[1] = offset
+    return v
+
+
+def test_within_eps():
+    eps = model.CLUSTER_EPS
+    X = np.array([_at(0), _at(0, eps / 2), _at(0, eps / 4), _at(0, 2 * eps)])
+    visible = np.array([True, True, False, True])
+
+    [neighbors] = model._within_eps(X, visible, X[:1].astype(np.float32))
+
+    assert [row for _, row in neighbors] == [0, 1]  # not hidden 2, or 3 outside eps
+    assert neighbors[1][0] == pytest.approx(eps / 2)
+
+
+def test_assign_faces(store, add_faces):
+    with Session(model.get_engine()) as session:
+        person = model.Person(name="labeled")
+        session.add(person)
+        session.commit()
+        person_id = person.id
+    add_faces([_at(100)], person_id, model.PERSON_SOURCE_MANUAL)
+    near, far = add_faces(
+        [_at(100, model.CLUSTER_EPS / 2), _at(100, 2 * model.CLUSTER_EPS)]
+    )
+
+    assert model.assign_faces([near, far]) == 2
+
+    with Session(model.get_engine()) as session:
+        near = session.get(model.Face, near)
+        far = session.get(model.Face, far)
+        assert near.person_id == person_id
+        assert near.person_source == model.PERSON_SOURCE_AUTOMATIC
+        # no labeled face within eps, so it gets an anonymous person of its own
+        assert far.person_id != person_id
+        assert far.person.name == ""
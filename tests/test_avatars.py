@@ -0,0 +1,70 @@
+from types import SimpleNamespace
+import asyncio
+
+from PIL import Image as PilImage
+
+from gallery import avatars
+from gallery import crops
+from gallery import model
+
+
+def test_atlas_missing_original(tmp_path, monkeypatch):
+    monkeypatch.setattr(model, "IMAGES_DIR", tmp_path / "images")
+    monkeypatch.setattr(model, "AVATARS_DIR", tmp_path / "avatars")
+    monkeypatch.setattr(crops, "CACHE", crops.CropCache(tmp_path / "faces"))
+
+    image = SimpleNamespace(id=1, file_name="missing.jpg", image_hash="ab" * 32)
+    face = SimpleNamespace(
+        id=1, image_id=1, image=image, top=10, right=60, bottom=60, left=10
+    )
+
+    [atlas] = asyncio.run(avatars.atlases([face]))
+
+    assert (atlas["columns"], atlas["rows"]) == (1, 1)
+    with PilImage.open(model.AVATARS_DIR / atlas["src"]) as img:
+        assert img.size == (avatars.AVATAR_SIZE, avatars.AVATAR_SIZE)
+
+
+def test_atlases_split(tmp_path, monkeypatch):
+    monkeypatch.setattr(model, "IMAGES_DIR", tmp_path / "images")
+    monkeypatch.setattr(model, "AVATARS_DIR", tmp_path / "avatars")
+    monkeypatch.setattr(crops, "CACHE", crops.CropCache(tmp_path / "faces"))
+
+    image = SimpleNamespace(id=1, file_name="missing.jpg", image_hash="cd" * 32)
+    faces = [
+        SimpleNamespace(
+            id=i, image_id=1, image=image, top=i, right=60, bottom=60, left=0
+        )
+        for i in range(avatars.MAX_TILES + 1)
+    ]
+
+    atlases = asyncio.run(avatars.atlases(faces))
+
+    assert [a["rows"] for a in atlases] == [avatars.MAX_TILES // avatars.COLUMNS, 1]
+    assert all((model.AVATARS_DIR / a["src"]).exists() for a in atlases)
+
+
+def test_prune_invalidates_pages(tmp_path, monkeypatch):
+    monkeypatch.setattr(model, "IMAGES_DIR", tmp_path / "images")
+    monkeypatch.setattr(model, "AVATARS_DIR", tmp_path / "avatars")
+    monkeypatch.setattr(crops, "CACHE", crops.CropCache(tmp_path / "faces"))
+    monkeypatch.setattr(avatars, "MAX_ATLASES", 2)
+    monkeypatch.setattr(avatars, "PRUNE_TO", 1)
+
+    image = SimpleNamespace(id=1, file_name="missing.jpg", image_hash="ef" * 32)
+
+    def atlas(i):
+        face = SimpleNamespace(
+            id=i, image_id=1, image=image, top=i, right=60, bottom=60, left=0
+        )
+        [atlas] = asyncio.run(avatars.atlases([face]))
+        return atlas["src"]
+
+    atlas(0)
+    atlas(1)
+    generation = model.generation()
+
+    newest = atlas(2)
+
+    assert [p.name for p in model.AVATARS_DIR.glob("*.jpg")] == [newest]
+    assert model.generation() > generation
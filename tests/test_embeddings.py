@@ -0,0 +1,77 @@
+import numpy as np
+
+from gallery import model
+
+
+def test_empty(store):
+    X, ids = store.load()
+    assert X.shape == (0, store.dim)
+    assert len(ids) == 0
+
+
+def test_append_load(store):
+    vectors = np.arange(3 * store.dim, dtype=np.float64).reshape(3, store.dim)
+    store.append([1, 2], vectors[:2])
+    store.append([3], vectors[2])
+
+    X, ids = store.load()
+    assert ids.tolist() == [1, 2, 3]
+    assert X.dtype == np.float32
+    np.testing.assert_array_equal(X, vectors)
+
+
+def test_last_row_wins(store):
+    old, new = np.zeros(store.dim), np.ones(store.dim)
+    store.append([1, 2], [old, old])
+    store.append([1], [new])
+
+    X, ids = store.load()
+    assert sorted(ids.tolist()) == [1, 2]
+    np.testing.assert_array_equal(X[ids.tolist().index(1)], new)
+    np.testing.assert_array_equal(X[ids.tolist().index(2)], old)
+
+
+def test_partial_row_dropped(store):
+    store.append([1], [np.ones(store.dim)])
+    with open(store.vectors_path, "ab") as f:
+        f.write(b"\0" * 12)  # a crash part way through the next row
+    assert len(store) == 1
+
+    store.append([2], [np.full(store.dim, 2.0)])
+    X, ids = store.load()
+    assert ids.tolist() == [1, 2]
+    np.testing.assert_array_equal(X[1], np.full(store.dim, 2.0))
+
+
+def test_rebuild(store):
+    store.append([1, 2], [np.zeros(store.dim), np.zeros(store.dim)])
+
+    assert store.rebuild([(3, np.ones(store.dim))]) == 1
+    X, ids = store.load()
+    assert ids.tolist() == [3]
+    np.testing.assert_array_equal(X, np.ones((1, store.dim)))
+
+
+def test_verify(store, add_faces):
+    rng = np.random.default_rng(0)
+    face_ids = add_faces(rng.normal(size=(2, store.dim)))
+
+    model.rebuild_embeddings()
+    assert model.verify_embeddings()
+
+    # a stale embedding for one face
+    store.append(face_ids[:1], rng.normal(size=(1, store.dim)))
+    assert not model.verify_embeddings()
+
+    model.rebuild_embeddings()
+    assert model.verify_embeddings()
+
+    # a face the database does not have
+    store.append([max(face_ids) + 1000], rng.normal(size=(1, store.dim)))
+    assert not model.verify_embeddings()
+
+    # a face missing from the store
+    model.rebuild_embeddings()
+    X, ids = store.load()
+    store.rebuild((i, v) for i, v in zip(ids.tolist(), X) if i != face_ids[0])
+    assert not model.verify_embeddings()
@@ -0,0 +1,17 @@
+import numpy as np
+import pytest
+from PIL import Image as PilImage
+
+from gallery import bench_hash
+from gallery import utils
+
+
+@pytest.mark.parametrize("mode", ["RGB", "RGBA", "L", "CMYK"])
+def test_hash_image_data_matches_v1(mode, monkeypatch):
+    # several strips, the last one short
+    monkeypatch.setattr(utils, "IMAGE_HASH_STRIP_ROWS", 7)
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 256, (30, 41, 3), dtype=np.uint8)
+    img = PilImage.fromarray(pixels, "RGB").convert(mode)
+
+    assert utils.hash_image_data(img) == bench_hash.hash_image_data_v1(img)
@@ -0,0 +1,72 @@
+from gallery.server import multipart
+
+BOUNDARY = b"XyZ"
+
+
+def _part(name: str, filename: str, data: bytes) -> bytes:
+    return (
+        b"--" + BOUNDARY + b"\r\n"
+        b'Content-Disposition: form-data; name="' + name.encode() + b'"; '
+        b'filename="' + filename.encode() + b'"\r\n'
+        b"Content-Type: application/octet-stream\r\n\r\n" + data + b"\r\n"
+    )
+
+
+def _body(*parts: bytes) -> bytes:
+    return b"preamble\r\n" + b"".join(parts) + b"--" + BOUNDARY + b"--\r\nepilogue"
+
+
+def _parse(body: bytes, size: int) -> list:
+    """the parts of `body` fed `size` bytes at a time, as [(headers, data, complete)]"""
+    parser = multipart.MultipartParser(BOUNDARY)
+    parts = []
+    for i in range(0, len(body), size):
+        for event, value in parser.feed(body[i : i + size]):
+            if event == "part":
+                parts += [[value, b"", False]]
+            elif event == "data":
+                parts[-1][1] += value
+            elif event == "end":
+                parts[-1][2] = True
+    return [tuple(p) for p in parts]
+
+
+def test_boundary():
+    content_type = 'multipart/form-data; boundary="XyZ"; charset=utf-8'
+    assert multipart.boundary(content_type) == BOUNDARY
+    assert multipart.boundary("multipart/form-data; boundary=XyZ") == BOUNDARY
+
+
+def test_parts_split_across_chunks():
+    # the data holds near-misses of the delimiter
+    a = b"a\r\n-" + b"\r\n--Xy" * 50 + b"\r\n--X"
+    b = b"\r\n" + bytes(range(256)) * 10
+    body = _body(_part("files", "a.jpg", a), _part("files", "b.jpg", b))
+
+    # including a delimiter split at every possible place
+    for size in (1, 2, 3, 5, 7, 64, len(body)):
+        parts = _parse(body, size)
+        assert [(h["name"], h["filename"], d, c) for h, d, c in parts] == [
+            ("files", "a.jpg", a, True),
+            ("files", "b.jpg", b, True),
+        ], size
+
+
+def test_empty_part():
+    parts = _parse(_body(_part("files", "empty.jpg", b"")), 1)
+    assert [(h["filename"], d, c) for h, d, c in parts] == [("empty.jpg", b"", True)]
+
+
+def test_truncated():
+    data = b"x" * 1000
+    body = _body(_part("files", "a.jpg", b"a"), _part("files", "b.jpg", data))
+    cut = body.index(data) + 500
+
+    parts = _parse(body[:cut], 64)
+
+    assert [(h["filename"], c) for h, _, c in parts] == [
+        ("a.jpg", True),
+        ("b.jpg", False),
+    ]
+    # held back in case it begins a delimiter, but never more than was sent
+    assert data[:400] <= parts[1][1] <= data[:500]
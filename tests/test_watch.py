@@ -0,0 +1,55 @@
+import threading
+import time
+
+from gallery.watch import Watcher
+
+QUIET = 0.5
+POLL = 0.1
+
+
+def _watch(root):
+    batches = []
+    ready = threading.Event()
+
+    def on_batch(paths):
+        batches.append(paths)
+        ready.set()
+
+    watcher = Watcher(
+        root, on_batch, quiet=QUIET, poll_interval=POLL, use_inotify=False
+    )
+    watcher.start()
+    return watcher, batches, ready
+
+
+def test_poll_picks_up_new_file(tmp_path):
+    watcher, batches, ready = _watch(tmp_path)
+    try:
+        time.sleep(2 * POLL)  # the first walk has seen an empty tree
+        path = tmp_path / "a.jpg"
+        path.write_bytes(b"image")
+        written = time.time()
+
+        assert ready.wait(10 * QUIET)
+        assert time.time() - written >= QUIET
+        assert batches == [[str(path)]]
+    finally:
+        watcher.stop()
+
+
+def test_poll_waits_for_file_being_written(tmp_path):
+    watcher, batches, ready = _watch(tmp_path)
+    try:
+        time.sleep(2 * POLL)
+        path = tmp_path / "b.jpg"
+        with open(path, "wb") as f:
+            for _ in range(int(3 * QUIET / POLL)):
+                f.write(b"x" * 1024)
+                f.flush()
+                time.sleep(POLL)
+                assert not batches  # still being written
+
+        assert ready.wait(10 * QUIET)
+        assert batches == [[str(path)]]
+    finally:
+        watcher.stop()
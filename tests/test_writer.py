@@ -0,0 +1,86 @@
+import pytest
+from sqlalchemy import create_engine, text
+
+from gallery.writer import Writer, after_commit
+
+
+def _writer(tmp_path, **kwargs):
+    engine = create_engine(f"sqlite:///{tmp_path / 'writer.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE item (id INTEGER PRIMARY KEY, name TEXT)"))
+    return engine, Writer(lambda: engine, "test", **kwargs)
+
+
+def _insert(name, hooks=None):
+    def op(session):
+        if name is None:
+            raise ValueError("no name")
+        id = session.execute(
+            text("INSERT INTO item (name) VALUES (:name) RETURNING id"), {"name": name}
+        ).scalar()
+        if hooks is not None:
+            after_commit(session, lambda: hooks.append(name))
+        return id
+
+    return op
+
+
+def _names(engine):
+    with engine.connect() as conn:
+        return [name for name, in conn.execute(text("SELECT name FROM item"))]
+
+
+def test_batches(tmp_path):
+    engine, writer = _writer(tmp_path, max_batch=4, max_delay=1.0)
+    try:
+        futures = [writer.submit(_insert(f"{i}")) for i in range(10)]
+        writer.flush()
+
+        assert [f.result() for f in futures] == list(range(1, 11))
+        assert writer.ops == 11  # and the flush
+        assert writer.batches == 3
+    finally:
+        writer.close()
+
+
+def test_failing_op_is_isolated(tmp_path):
+    engine, writer = _writer(tmp_path, max_delay=1.0)
+    hooks = []
+    try:
+        futures = [
+            writer.submit(_insert("a", hooks)),
+            writer.submit(_insert(None, hooks)),
+            writer.submit(_insert("b", hooks)),
+        ]
+        writer.flush()
+
+        assert futures[0].result() is not None
+        with pytest.raises(ValueError):
+            futures[1].result()
+        assert futures[2].result() is not None
+        assert _names(engine) == ["a", "b"]
+        # the batch that failed as a whole ran no hooks
+        assert hooks == ["a", "b"]
+    finally:
+        writer.close()
+
+
+def test_after_commit_order(tmp_path):
+    engine, writer = _writer(tmp_path, max_delay=1.0)
+    hooks = []
+    seen = []
+
+    def committed_op(session):
+        _insert("c", hooks)(session)
+        # runs after the commit, so another connection sees the row
+        after_commit(session, lambda: seen.append(_names(engine)))
+
+    try:
+        writer.submit(_insert("a", hooks))
+        writer.submit(_insert("b", hooks))
+        writer.call(committed_op)
+
+        assert hooks == ["a", "b", "c"]
+        assert seen == [["a", "b", "c"]]
+    finally:
+        writer.close()